@@ -0,0 +1,173 @@
+"""
+Structured Access Logging
+
+Log records are put on a queue by the request threads and written by a
+QueueListener thread, so a slow terminal or disk never stalls a request. Each
+request is logged as one JSON line with its route, status, duration and the
+number of datastore calls it made. Under heavy traffic, fast successful
+requests are sampled; errors and slow requests are always logged.
+"""
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+
+# Datastore calls made by the current request (a one-item list, or None outside a request)
+_datastore_calls = contextvars.ContextVar('datastore_calls', default=None)
+
+
+def count_datastore_call(calls=1):
+    """Called by storage backends for each round trip to the datastore"""
+    counter = _datastore_calls.get()
+    if counter is not None:
+        counter[0] += calls
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; access records add their request fields"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'access', None) or {})
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class ListenerQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that runs its own QueueListener, restarting it after a fork"""
+
+    def __init__(self, handlers, queue_size):
+        super().__init__(queue.Queue(queue_size))
+        self.handlers = handlers
+        self.queue_size = queue_size
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # Forked: the parent's listener thread did not come along
+                self.queue = queue.Queue(self.queue_size)
+            self._listener = logging.handlers.QueueListener(
+                self.queue, *self.handlers, respect_handler_level=True
+            )
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def prepare(self, record):
+        """Render the message and traceback now; args may not be safe to format later"""
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        """Write out queued records and stop the listener thread"""
+        with self._start_lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+            self._listener = None
+            self._pid = None
+
+
+def setup_logging(config):
+    """Route all logging through one queue to a JSON stream handler on stderr"""
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(JsonFormatter())
+    handler = ListenerQueueHandler([stream], config['queue_size'])
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(config['level'])
+    atexit.register(handler.stop)
+    return handler
+
+
+class AccessLog:
+    """Times requests and writes one access record per request"""
+
+    def __init__(self, config):
+        self.logger = logging.getLogger('access')
+        self.sample_above_rps = config['sample_above_rps']
+        self.sample_rate = config['sample_rate']
+        self.slow_request_ms = config['slow_request_ms']
+        self._second = 0
+        self._requests_this_second = 0
+
+    def start(self):
+        """Begin counting datastore calls for the current request"""
+        _datastore_calls.set([0])
+
+    def record(self, method, route, path, status, duration, response_bytes=None, remote_addr=None):
+        """Log one finished request; route is the URL rule it matched, if any"""
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        duration_ms = duration * 1000
+        sample_rate = self._sample_rate(status, duration_ms)
+        if sample_rate < 1 and random.random() >= sample_rate:
+            return
+
+        counter = _datastore_calls.get()
+        self.logger.info('%s %s %s', method, route or path, status, extra={
+            'access': {
+                'method': method,
+                'route': route,
+                'path': path,
+                'status': status,
+                'duration_ms': round(duration_ms, 2),
+                'datastore_calls': counter[0] if counter is not None else 0,
+                'response_bytes': response_bytes,
+                'remote_addr': remote_addr,
+                'sample_rate': sample_rate,
+            }
+        })
+
+    def _sample_rate(self, status, duration_ms):
+        """Fraction of requests like this one being logged right now"""
+        now = int(time.monotonic())
+        if now != self._second:
+            # Approximate per-second rate; races between threads only blur the count
+            self._second = now
+            self._requests_this_second = 0
+        self._requests_this_second += 1
+
+        if status >= 400 or duration_ms >= self.slow_request_ms:
+            return 1
+        if self._requests_this_second <= self.sample_above_rps:
+            return 1
+        return self.sample_rate
@@ -1,26 +1,83 @@
 """
 Flask Application - Appointment Booking System Backend
 """
-from flask import Flask, request, jsonify
+import boot     # first, so start-up is timed from here
+from flask import Flask, request, jsonify, g
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import (JWTManager, create_access_token, jwt_required, get_jwt, get_jwt_identity,
+                                verify_jwt_in_request)
 from datetime import datetime, timedelta
-from config import Config, FIREBASE_CONFIG
-from firebase_db import firebase_db
+from config import Config, FIREBASE_CONFIG, APP_SETTINGS, LOGGING_CONFIG, RATE_LIMIT_CONFIG
+from storage import database, AppointmentStore
 from notifications import notification_service
+from reminders import ReminderScheduler
+from access_log import AccessLog, setup_logging
+from json_provider import FastJSONProvider, NDJSON_MIMETYPE, ndjson_chunks, prefers_ndjson
+from exports import AppointmentExport, load_checkpoint
+from change_feed import ChangeFeedHub, Subscription, sse_stream
+from search_index import AppointmentSearchIndex
+from rate_limit import RateLimiter, client_key
+import metrics
+import functools
 import logging
+import time
 
 # Initialize Flask app
 app = Flask(__name__)
 app.config.from_object(Config)
+app.json = FastJSONProvider(app)
 
 # Initialize extensions
 CORS(app, origins=Config.CORS_ORIGINS)
 jwt = JWTManager(app)
 
 # Logging configuration
-logging.basicConfig(level=logging.INFO)
+setup_logging(LOGGING_CONFIG)
 logger = logging.getLogger(__name__)
+access_log = AccessLog(LOGGING_CONFIG)
+
+# Live appointment changes for /api/appointments/stream
+change_feed = ChangeFeedHub(database)
+
+# Staff search (loaded on the first search in each worker)
+search_index = AppointmentSearchIndex(database, refresh_seconds=APP_SETTINGS['search_refresh_seconds'])
+
+# Per-client rate limits and the concurrency cap (also applied by asgi.py)
+rate_limiter = RateLimiter.from_settings(RATE_LIMIT_CONFIG)
+
+# Latency histograms and counters for /api/metrics
+if APP_SETTINGS['metrics_enabled']:
+    metrics.instrument_store(database, sorted(AppointmentStore.__abstractmethods__))
+    metrics.instrument_notifications(notification_service)
+    metrics.register_state_metrics(database, notification_service, change_feed, rate_limiter)
+    metrics.register_boot_metrics(boot.boot_timings)
+
+# Appointment reminders
+reminder_scheduler = ReminderScheduler(
+    database,
+    notification_service,
+    APP_SETTINGS['appointment_reminder_hours']
+)
+
+# Started in each worker process once it runs (gunicorn.conf.py, asgi.py's
+# lifespan startup, or the first request), never in a preloading master
+@boot.on_worker_start
+def connect_storage():
+    database.connect()
+
+@boot.on_worker_start
+def start_reminders():
+    if APP_SETTINGS['reminders_enabled']:
+        reminder_scheduler.start()
+
+def staff_required(view):
+    """403 unless the request's access token was issued to staff (use under @jwt_required())"""
+    @functools.wraps(view)
+    def check_role(*args, **kwargs):
+        if get_jwt().get('role') != 'staff':
+            return jsonify({'success': False, 'error': 'Staff access required'}), 403
+        return view(*args, **kwargs)
+    return check_role
 
 # ============ AUTHENTICATION ENDPOINTS ============
 
@@ -33,7 +90,7 @@ def client_signup():
         if not all(key in data for key in ['email', 'password', 'name', 'phone']):
             return jsonify({'success': False, 'error': 'Missing required fields'}), 400
         
-        result = firebase_db.create_client_user(
+        result = database.create_client_user(
             email=data['email'],
             password=data['password'],
             name=data['name'],
@@ -67,28 +124,24 @@ def client_login():
         if not all(key in data for key in ['email', 'password']):
             return jsonify({'success': False, 'error': 'Email and password required'}), 400
         
-        # Verify with Firebase
-        from firebase_admin import auth
-        try:
-            user = auth.get_user_by_email(data['email'])
-            # In production, verify password securely
-            # This is a simplified version - use Firebase Client SDK for real authentication
-            
-            access_token = create_access_token(
-                identity=user.uid,
-                additional_claims={'role': 'client'}
-            )
-            
-            user_data = firebase_db.get_user_by_uid(user.uid, 'client')
-            
-            return jsonify({
-                'success': True,
-                'uid': user.uid,
-                'access_token': access_token,
-                'user': user_data.get('data') if user_data['success'] else {}
-            }), 200
-        except Exception as e:
+        # Verify with the storage backend (Firebase Auth or local users)
+        user = database.authenticate_user(data['email'], data['password'], 'client')
+        if not user['success']:
             return jsonify({'success': False, 'error': 'Invalid credentials'}), 401
+        
+        access_token = create_access_token(
+            identity=user['uid'],
+            additional_claims={'role': 'client'}
+        )
+        
+        user_data = database.get_user_by_uid(user['uid'], 'client')
+        
+        return jsonify({
+            'success': True,
+            'uid': user['uid'],
+            'access_token': access_token,
+            'user': user_data.get('data') if user_data['success'] else {}
+        }), 200
     except Exception as e:
         logger.error(f"Client login error: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -103,7 +156,7 @@ def staff_signup():
         if not all(key in data for key in required_fields):
             return jsonify({'success': False, 'error': 'Missing required fields'}), 400
         
-        result = firebase_db.create_staff_user(
+        result = database.create_staff_user(
             email=data['email'],
             password=data['password'],
             name=data['name'],
@@ -137,25 +190,23 @@ def staff_login():
         if not all(key in data for key in ['email', 'password']):
             return jsonify({'success': False, 'error': 'Email and password required'}), 400
         
-        from firebase_admin import auth
-        try:
-            user = auth.get_user_by_email(data['email'])
-            
-            access_token = create_access_token(
-                identity=user.uid,
-                additional_claims={'role': 'staff'}
-            )
-            
-            user_data = firebase_db.get_user_by_uid(user.uid, 'staff')
-            
-            return jsonify({
-                'success': True,
-                'uid': user.uid,
-                'access_token': access_token,
-                'user': user_data.get('data') if user_data['success'] else {}
-            }), 200
-        except Exception as e:
+        user = database.authenticate_user(data['email'], data['password'], 'staff')
+        if not user['success']:
             return jsonify({'success': False, 'error': 'Invalid credentials'}), 401
+        
+        access_token = create_access_token(
+            identity=user['uid'],
+            additional_claims={'role': 'staff'}
+        )
+        
+        user_data = database.get_user_by_uid(user['uid'], 'staff')
+        
+        return jsonify({
+            'success': True,
+            'uid': user['uid'],
+            'access_token': access_token,
+            'user': user_data.get('data') if user_data['success'] else {}
+        }), 200
     except Exception as e:
         logger.error(f"Staff login error: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -173,21 +224,8 @@ def create_appointment():
         if not all(key in data for key in required_fields):
             return jsonify({'success': False, 'error': 'Missing required fields'}), 400
         
-        # Check availability
-        availability = firebase_db.check_availability(
-            data['service_type'],
-            data['appointment_date'],
-            data['appointment_time']
-        )
-        
-        if not availability['available']:
-            return jsonify({
-                'success': False,
-                'error': 'Time slot is not available'
-            }), 400
-        
-        # Create appointment
-        result = firebase_db.create_appointment(
+        # Claim the slot and create the appointment in one atomic write
+        result = database.reserve_appointment(
             service_type=data['service_type'],
             client_data={
                 'client_name': data['client_name'],
@@ -201,6 +239,12 @@ def create_appointment():
             }
         )
         
+        if result.get('slot_taken'):
+            return jsonify({
+                'success': False,
+                'error': result['error']
+            }), 409
+        
         if result['success']:
             # Send confirmation notification
             notification_service.send_appointment_confirmation(result['data'])
@@ -219,28 +263,202 @@ def create_appointment():
 
 @app.route('/api/appointments', methods=['GET'])
 def get_appointments():
-    """Get appointments with optional filters"""
+    """Get appointments with optional filters.
+    
+    With `Accept: application/x-ndjson` every match is streamed, one
+    appointment per line, instead of returning one page. With `since`
+    (empty for a first sync) only the changes after that watermark are
+    returned; see AppointmentStore.get_changes.
+    """
     try:
-        service_type = request.args.get('service_type')
-        status = request.args.get('status')
-        date = request.args.get('date')
+        if 'since' in request.args:
+            result, status = appointment_changes(request.args, request.args.get('limit', type=int))
+            return jsonify(result), status
         
-        result = firebase_db.get_appointments(
-            service_type=service_type,
-            status=status,
-            date=date
-        )
+        fields = request.args.get('fields')
+        filters = {
+            'service_type': request.args.get('service_type'),
+            'status': request.args.get('status'),
+            'date': request.args.get('date'),
+            'limit': request.args.get('limit', type=int),
+            'start_after': request.args.get('start_after'),
+            'order_by': request.args.get('order_by'),
+            'fields': [f for f in fields.split(',') if f] if fields else None
+        }
+        
+        if prefers_ndjson(request.accept_mimetypes):
+            try:
+                rows = database.stream_appointments(**filters)
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            return app.response_class(ndjson_chunks(rows, app.json.dump_bytes), mimetype=NDJSON_MIMETYPE)
+        
+        result = database.get_appointments(**filters)
         
         return jsonify(result), 200 if result['success'] else 400
     except Exception as e:
         logger.error(f"Get appointments error: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def appointment_changes(args, limit):
+    """GET /api/appointments?since= response (also used by asgi.py)"""
+    if any(args.get(name) for name in ('status', 'order_by', 'start_after', 'fields')):
+        return {'success': False, 'error': 'since can only be combined with service_type, date and limit'}, 400
+    
+    result = database.get_changes(
+        since=args.get('since'),
+        service_type=args.get('service_type'),
+        date=args.get('date'),
+        limit=limit
+    )
+    if result.get('expired'):
+        return result, 410
+    return result, 200 if result['success'] else 400
+
+@app.route('/api/appointments/export', methods=['GET'])
+@jwt_required()
+@staff_required
+def export_appointments():
+    """Stream appointments dated from..to as CSV, NDJSON or Parquet (staff only).
+    
+    The X-Export-Id response header names the export; if the download is
+    interrupted, `?resume=<export_id>` sends the rest (to the same user only).
+    """
+    try:
+        batch_size = APP_SETTINGS['export_batch_size']
+        owner = get_jwt_identity()
+        if request.args.get('resume'):
+            export = AppointmentExport.resume(database, request.args['resume'], batch_size, owner)
+            if export is None:
+                return jsonify({'success': False, 'error': 'Export not found'}), 404
+            if export.checkpoint['complete']:
+                return jsonify({'success': False, 'error': 'Export already complete'}), 400
+        else:
+            export = AppointmentExport.start(
+                database,
+                request.args.get('format', 'csv'),
+                start_date=request.args.get('from'),
+                end_date=request.args.get('to'),
+                service_type=request.args.get('service_type'),
+                status=request.args.get('status'),
+                batch_size=batch_size,
+                owner=owner
+            )
+        
+        response = app.response_class(export.chunks(app.json.dump_bytes), mimetype=export.mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename="{export.filename}"'
+        response.headers['X-Export-Id'] = export.export_id
+        return response
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Export appointments error: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/appointments/export/<export_id>', methods=['GET'])
+@jwt_required()
+@staff_required
+def get_export(export_id):
+    """Progress of one of the user's exports: rows written so far and whether it finished"""
+    try:
+        checkpoint = load_checkpoint(database, export_id, get_jwt_identity())
+        if checkpoint is None:
+            return jsonify({'success': False, 'error': 'Export not found'}), 404
+        return jsonify({'success': True, 'export_id': export_id, 'data': checkpoint}), 200
+    except Exception as e:
+        logger.error(f"Get export error: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/appointments/stream', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+@staff_required
+def stream_appointment_changes():
+    """Server-Sent Events: the matching appointments, then each change (staff only).
+    
+    Requires a `service_type` and/or `date` filter. Sends a `snapshot` event,
+    then `added`, `modified` and `removed` events as appointments change.
+    EventSource cannot set headers, so the token may be passed as `?jwt=`.
+    """
+    try:
+        subscription = change_feed.subscribe(
+            Subscription(APP_SETTINGS['change_feed_queue_size']),
+            service_type=request.args.get('service_type'),
+            status=request.args.get('status'),
+            date=request.args.get('date')
+        )
+        response = app.response_class(
+            sse_stream(subscription, app.json.dump_bytes, APP_SETTINGS['change_feed_heartbeat_seconds']),
+            mimetype='text/event-stream'
+        )
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        response.call_on_close(subscription.close)
+        return response
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Stream appointments error: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/appointments/search', methods=['GET'])
+@jwt_required()
+@staff_required
+def search_appointments():
+    """Search by partial client name, email, phone or appointment number (staff only).
+    
+    Every word of `q` must match the start of a word in one of those fields
+    (phone digits match anywhere). Results are ranked; page with `limit`
+    and the returned `next_offset`. Off if SEARCH_INDEX_ENABLED is false.
+    """
+    if not APP_SETTINGS['search_index_enabled']:
+        return jsonify({'success': False, 'error': 'Endpoint not found'}), 404
+    try:
+        limit = min(request.args.get('limit', 20, type=int), APP_SETTINGS['max_page_size'])
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        result = search_index.search(
+            request.args.get('q'),
+            service_type=request.args.get('service_type'),
+            status=request.args.get('status'),
+            limit=max(limit, 1),
+            offset=offset
+        )
+        if result.get('loading'):
+            return jsonify(result), 503, {'Retry-After': '5'}
+        return jsonify(result), 200 if result['success'] else 400
+    except Exception as e:
+        logger.error(f"Search appointments error: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/appointments/by-number/<appointment_number>', methods=['GET'])
+def get_appointment_by_number(appointment_number):
+    """Get an appointment by the number in its confirmation email.
+    
+    Numbers are sequential, so the client's email must be given too.
+    """
+    try:
+        email = request.args.get('email')
+        if not email:
+            return jsonify({'success': False, 'error': 'email is required'}), 400
+        
+        result, status = appointment_for_email(database.get_appointment_by_number(appointment_number), email)
+        return jsonify(result), status
+    except Exception as e:
+        logger.error(f"Get appointment by number error: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def appointment_for_email(result, email):
+    """A lookup result, or 404 unless it is the appointment of `email` (also used by asgi.py)"""
+    if not result['success']:
+        return result, 404
+    if (result['data'].get('client_email') or '').strip().lower() != email.strip().lower():
+        return {'success': False, 'error': 'Appointment not found'}, 404
+    return result, 200
+
 @app.route('/api/appointments/<appointment_id>', methods=['GET'])
 def get_appointment(appointment_id):
     """Get a specific appointment"""
     try:
-        result = firebase_db.get_appointment_by_id(appointment_id)
+        result = database.get_appointment_by_id(appointment_id)
         return jsonify(result), 200 if result['success'] else 404
     except Exception as e:
         logger.error(f"Get appointment error: {e}")
@@ -255,15 +473,14 @@ def update_appointment_status(appointment_id):
         if 'status' not in data:
             return jsonify({'success': False, 'error': 'Status is required'}), 400
         
-        result = firebase_db.update_appointment_status(appointment_id, data['status'])
+        result = database.update_appointment_status(appointment_id, data['status'])
+        
+        if result.get('slot_taken'):
+            return jsonify(result), 409
         
         if result['success']:
-            # Send status update notification
-            appt = firebase_db.get_appointment_by_id(appointment_id)
-            if appt['success']:
-                appt_data = appt['data']
-                appt_data['status'] = data['status']
-                notification_service.send_status_update(appt_data, data['status'])
+            # Send status update notification from the updated document
+            notification_service.send_status_update(result.pop('data'), data['status'])
         
         return jsonify(result), 200 if result['success'] else 400
     except Exception as e:
@@ -274,7 +491,7 @@ def update_appointment_status(appointment_id):
 def delete_appointment(appointment_id):
     """Delete/cancel an appointment"""
     try:
-        result = firebase_db.delete_appointment(appointment_id)
+        result = database.delete_appointment(appointment_id)
         return jsonify(result), 200 if result['success'] else 400
     except Exception as e:
         logger.error(f"Delete appointment error: {e}")
@@ -290,7 +507,7 @@ def check_availability():
         if not service_type or not appointment_date:
             return jsonify({'success': False, 'error': 'service_type and date are required'}), 400
         
-        result = firebase_db.get_available_slots(service_type, appointment_date)
+        result = database.get_available_slots(service_type, appointment_date)
         return jsonify(result), 200 if result['success'] else 400
     except Exception as e:
         logger.error(f"Check availability error: {e}")
@@ -305,12 +522,26 @@ def get_statistics():
     try:
         claims = get_jwt_identity()
         
-        result = firebase_db.get_statistics()
+        result = database.get_statistics(
+            start_date=request.args.get('from'),
+            end_date=request.args.get('to')
+        )
         return jsonify(result), 200 if result['success'] else 400
     except Exception as e:
         logger.error(f"Get statistics error: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.cli.command('rebuild-statistics')
+def rebuild_statistics_command():
+    """Recount every appointment into the statistics counters.
+    
+    A full scan that rewrites every counter, so it is an operator command
+    rather than a route: run it once after upgrading a deployment whose
+    appointments predate the counters.
+    """
+    result = database.rebuild_statistics()
+    print(result['message'] if result['success'] else f"Error: {result['error']}")
+
 # ============ HEALTH CHECK ============
 
 @app.route('/api/health', methods=['GET'])
@@ -322,6 +553,13 @@ def health_check():
         'service': 'AppointmentPro Backend'
     }), 200
 
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus metrics for this worker process"""
+    if not APP_SETTINGS['metrics_enabled']:
+        return jsonify({'success': False, 'error': 'Endpoint not found'}), 404
+    return app.response_class(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
 # ============ ERROR HANDLERS ============
 
 @app.errorhandler(404)
@@ -336,12 +574,56 @@ def internal_error(error):
 
 @app.before_request
 def log_request():
-    logger.info(f"{request.method} {request.path}")
+    g.request_started = time.perf_counter()
+    access_log.start()
+    boot.start_worker()
 
 @app.after_request
 def log_response(response):
-    logger.info(f"Response: {response.status_code}")
+    record_request(
+        request.method,
+        request.url_rule.rule if request.url_rule is not None else None,
+        request.path,
+        response.status_code,
+        time.perf_counter() - g.request_started,
+        response.content_length,
+        request.remote_addr
+    )
     return response
 
+def record_request(method, route, path, status, duration, response_bytes=None, remote_addr=None):
+    """Access log line and metrics for one finished request (also used by asgi.py)"""
+    access_log.record(method, route, path, status, duration, response_bytes, remote_addr)
+    if APP_SETTINGS['metrics_enabled']:
+        metrics.observe_request(method, route or '<unmatched>', status, duration)
+
+# ============ ADMISSION CONTROL ============
+
+@app.before_request
+def admit_request():
+    """Shed or throttle the request before its handler touches the datastore"""
+    rule = request.url_rule.rule if request.url_rule is not None else None
+    rejection = rate_limiter.admit(request.method, rule, request_client)
+    if rejection:
+        error, retry_after = rejection
+        return jsonify({'success': False, 'error': error}), 429, {'Retry-After': str(retry_after)}
+    g.admitted_rule = rule
+
+@app.teardown_request
+def release_request(error=None):
+    if 'admitted_rule' in g:
+        rate_limiter.release(g.pop('admitted_rule'))
+
+def request_client():
+    """Rate limit key for the current request: its user, else its address"""
+    try:
+        verify_jwt_in_request(optional=True)
+        identity = get_jwt_identity()
+    except Exception:
+        identity = None     # an invalid token is limited by address
+    forwarded_for = request.headers.get('X-Forwarded-For') if RATE_LIMIT_CONFIG['trust_forwarded_for'] else None
+    return client_key(identity, request.remote_addr, forwarded_for)
+
 if __name__ == '__main__':
+    boot.start_worker()
     app.run(debug=True, host='0.0.0.0', port=5000)
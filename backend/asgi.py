@@ -0,0 +1,497 @@
+"""
+ASGI Entry Point
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000 --workers 4
+
+The booking, listing, availability and login routes run as coroutines on the
+worker's event loop, so one worker holds many in-flight requests instead of
+one thread each, and datastore calls that do not depend on each other are
+awaited together. Every other route is served by the Flask app, called on a
+thread pool (long responses such as exports stream from there chunk by chunk).
+"""
+import asyncio
+import io
+import json
+import re
+import sys
+import time
+from urllib.parse import parse_qs
+from flask_jwt_extended import create_access_token, decode_token
+from app import (app, database, notification_service, change_feed, access_log, record_request, logger,
+                 appointment_changes, appointment_for_email, rate_limiter)
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+from config import Config, APP_SETTINGS, RATE_LIMIT_CONFIG
+from async_store import create_async_storage
+from json_provider import NDJSON_MIMETYPE, ndjson_chunks_async, prefers_ndjson
+from change_feed import AsyncSubscription, sse_stream_async
+from rate_limit import client_key
+from boot import start_worker
+import metrics
+
+async_database = create_async_storage(database, APP_SETTINGS['async_io_threads'])
+if APP_SETTINGS['metrics_enabled']:
+    metrics.instrument_store(async_database, getattr(async_database, 'NATIVE_METHODS', ()))
+
+ROUTES = []     # (method, rule, pattern, handler); handler None = served by Flask
+
+
+def add_route(method, rule, handler):
+    pattern = re.compile('^' + re.sub(r'<(\w+)>', r'(?P<\1>[^/]+)', rule) + '$')
+    ROUTES.append((method, rule, pattern, handler))
+    # As in Flask, a fixed path wins over a rule with variables
+    ROUTES.sort(key=lambda entry: '<' in entry[1])
+
+
+def route(method, rule):
+    """Register an async handler; rule uses Flask's <name> syntax"""
+    def register(handler):
+        add_route(method, rule, handler)
+        return handler
+    return register
+
+
+# Flask routes whose paths a native rule would otherwise match
+add_route('GET', '/api/appointments/export', None)
+add_route('GET', '/api/appointments/search', None)
+
+
+class StreamingBody:
+    """A handler result sent chunk by chunk as the async iterator produces it"""
+
+    def __init__(self, chunks, mimetype, headers=None):
+        self.chunks = chunks
+        self.mimetype = mimetype
+        self.headers = headers or {}
+
+
+class Request:
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = {key: values[0] for key, values in
+                     parse_qs(scope['query_string'].decode('latin-1'), keep_blank_values=True).items()}
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                        for name, value in scope['headers']}
+        client = scope.get('client')
+        self.remote_addr = client[0] if client else None
+        self.body = body
+
+    @property
+    def accept_mimetypes(self):
+        return parse_accept_header(self.headers.get('accept'), MIMEAccept)
+
+    def get_json(self):
+        return json.loads(self.body) if self.body else None
+
+    def arg_int(self, name):
+        try:
+            return int(self.args[name])
+        except (KeyError, ValueError):
+            return None
+
+
+def request_token(request):
+    auth = request.headers.get('authorization', '')
+    return auth[7:] if auth.startswith('Bearer ') else request.args.get('jwt')
+
+
+def token_error(request, staff_only=False):
+    """401 result unless the request carries a valid access token (header or ?jwt=); 403 for non-staff if staff_only"""
+    token = request_token(request)
+    if not token:
+        return {'success': False, 'error': 'Missing access token'}, 401
+    try:
+        with app.app_context():
+            claims = decode_token(token)
+    except Exception as e:
+        return {'success': False, 'error': str(e)}, 401
+    if staff_only and claims.get('role') != 'staff':
+        return {'success': False, 'error': 'Staff access required'}, 403
+    return None
+
+
+def request_client(request):
+    """Rate limit key for a request: its user, else its address"""
+    identity = None
+    token = request_token(request)
+    if token:
+        try:
+            with app.app_context():
+                identity = decode_token(token)[app.config['JWT_IDENTITY_CLAIM']]
+        except Exception:
+            pass    # an invalid token is limited by address
+    forwarded_for = request.headers.get('x-forwarded-for') if RATE_LIMIT_CONFIG['trust_forwarded_for'] else None
+    return client_key(identity, request.remote_addr, forwarded_for)
+
+
+async def notify(fn, *args):
+    """Hand a notification to the delivery queue (sent inline, off the loop, if the queue is off)"""
+    if notification_service.async_dispatch:
+        fn(*args)
+    else:
+        await async_database.run(fn, *args)
+
+# ============ AUTHENTICATION ENDPOINTS ============
+
+async def login(request, user_type):
+    data = request.get_json()
+
+    if not all(key in data for key in ['email', 'password']):
+        return {'success': False, 'error': 'Email and password required'}, 400
+
+    # The credential check and the profile lookup do not depend on each other
+    user, profile = await asyncio.gather(
+        async_database.authenticate_user(data['email'], data['password'], user_type),
+        async_database.get_user_by_email(data['email'], user_type)
+    )
+    if not user['success']:
+        return {'success': False, 'error': 'Invalid credentials'}, 401
+
+    if profile['success'] and profile['data'].get('uid') == user['uid']:
+        user_data = dict(profile['data'])
+        user_data.pop('id', None)
+    else:
+        result = await async_database.get_user_by_uid(user['uid'], user_type)
+        user_data = result.get('data') if result['success'] else {}
+
+    with app.app_context():
+        access_token = create_access_token(
+            identity=user['uid'],
+            additional_claims={'role': user_type}
+        )
+
+    return {
+        'success': True,
+        'uid': user['uid'],
+        'access_token': access_token,
+        'user': user_data
+    }, 200
+
+
+@route('POST', '/api/auth/client-login')
+async def client_login(request):
+    """Client login"""
+    return await login(request, 'client')
+
+
+@route('POST', '/api/auth/staff-login')
+async def staff_login(request):
+    """Staff login"""
+    return await login(request, 'staff')
+
+# ============ APPOINTMENT ENDPOINTS ============
+
+@route('POST', '/api/appointments')
+async def create_appointment(request):
+    """Create a new appointment"""
+    data = request.get_json()
+
+    required_fields = ['service_type', 'client_name', 'client_email', 'client_phone',
+                       'appointment_date', 'appointment_time']
+    if not all(key in data for key in required_fields):
+        return {'success': False, 'error': 'Missing required fields'}, 400
+
+    result = await async_database.reserve_appointment(
+        service_type=data['service_type'],
+        client_data={
+            'client_name': data['client_name'],
+            'client_email': data['client_email'],
+            'client_phone': data['client_phone']
+        },
+        appointment_data={
+            'appointment_date': data['appointment_date'],
+            'appointment_time': data['appointment_time'],
+            'purpose': data.get('purpose', '')
+        }
+    )
+
+    if result.get('slot_taken'):
+        return {'success': False, 'error': result['error']}, 409
+
+    if not result['success']:
+        return result, 400
+
+    await notify(notification_service.send_appointment_confirmation, result['data'])
+    return {
+        'success': True,
+        'appointment_number': result['appointment_number'],
+        'appointment_id': result['appointment_id'],
+        'message': 'Appointment created successfully'
+    }, 201
+
+
+@route('GET', '/api/appointments')
+async def get_appointments(request):
+    """Get appointments with optional filters (streamed as NDJSON on request)"""
+    if 'since' in request.args:
+        return await async_database.run(appointment_changes, request.args, request.arg_int('limit'))
+
+    fields = request.args.get('fields')
+    filters = {
+        'service_type': request.args.get('service_type'),
+        'status': request.args.get('status'),
+        'date': request.args.get('date'),
+        'limit': request.arg_int('limit'),
+        'start_after': request.args.get('start_after'),
+        'order_by': request.args.get('order_by'),
+        'fields': [f for f in fields.split(',') if f] if fields else None
+    }
+
+    if prefers_ndjson(request.accept_mimetypes):
+        try:
+            rows = await async_database.stream_appointments(**filters)
+        except ValueError as e:
+            return {'success': False, 'error': str(e)}, 400
+        return StreamingBody(ndjson_chunks_async(rows, app.json.dump_bytes), NDJSON_MIMETYPE), 200
+
+    result = await async_database.get_appointments(**filters)
+    return result, 200 if result['success'] else 400
+
+
+@route('GET', '/api/appointments/stream')
+async def stream_appointment_changes(request):
+    """Server-Sent Events change feed (staff only)"""
+    error = token_error(request, staff_only=True)
+    if error:
+        return error
+
+    try:
+        subscription = await async_database.run(
+            change_feed.subscribe,
+            AsyncSubscription(APP_SETTINGS['change_feed_queue_size'], asyncio.get_running_loop()),
+            service_type=request.args.get('service_type'),
+            status=request.args.get('status'),
+            date=request.args.get('date')
+        )
+    except ValueError as e:
+        return {'success': False, 'error': str(e)}, 400
+    chunks = sse_stream_async(subscription, app.json.dump_bytes, APP_SETTINGS['change_feed_heartbeat_seconds'])
+    return StreamingBody(chunks, 'text/event-stream',
+                         {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}), 200
+
+
+@route('GET', '/api/appointments/<appointment_id>')
+async def get_appointment(request, appointment_id):
+    """Get a specific appointment"""
+    result = await async_database.get_appointment_by_id(appointment_id)
+    return result, 200 if result['success'] else 404
+
+
+@route('GET', '/api/appointments/by-number/<appointment_number>')
+async def get_appointment_by_number(request, appointment_number):
+    """Get an appointment by the number in its confirmation email"""
+    email = request.args.get('email')
+    if not email:
+        return {'success': False, 'error': 'email is required'}, 400
+    return appointment_for_email(await async_database.get_appointment_by_number(appointment_number), email)
+
+
+@route('PUT', '/api/appointments/<appointment_id>/status')
+async def update_appointment_status(request, appointment_id):
+    """Update appointment status"""
+    data = request.get_json()
+
+    if 'status' not in data:
+        return {'success': False, 'error': 'Status is required'}, 400
+
+    result = await async_database.update_appointment_status(appointment_id, data['status'])
+
+    if result.get('slot_taken'):
+        return result, 409
+
+    if result['success']:
+        await notify(notification_service.send_status_update, result.pop('data'), data['status'])
+
+    return result, 200 if result['success'] else 400
+
+
+@route('GET', '/api/availability')
+async def check_availability(request):
+    """Check appointment availability"""
+    service_type = request.args.get('service_type')
+    appointment_date = request.args.get('date')
+
+    if not service_type or not appointment_date:
+        return {'success': False, 'error': 'service_type and date are required'}, 400
+
+    result = await async_database.get_available_slots(service_type, appointment_date)
+    return result, 200 if result['success'] else 400
+
+# ============ SERVING ============
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def serve_route(scope, receive, send, rule, handler, params):
+    started = time.perf_counter()
+    access_log.start()
+    request = Request(scope, await read_body(receive))
+    # Shed or throttle before the handler touches the datastore
+    rejection = rate_limiter.admit(request.method, rule, lambda: request_client(request))
+    try:
+        if rejection:
+            error, retry_after = rejection
+            await send_response(request, receive, send, rule, started,
+                                {'success': False, 'error': error}, 429, {'Retry-After': str(retry_after)})
+            return
+        try:
+            payload, status = await handler(request, **params)
+        except Exception as e:
+            logger.error("%s %s error: %s", request.method, rule, e)
+            payload, status = {'success': False, 'error': str(e)}, 500
+        await send_response(request, receive, send, rule, started, payload, status)
+    finally:
+        if not rejection:
+            rate_limiter.release(rule)
+
+
+async def send_response(request, receive, send, rule, started, payload, status, headers=None):
+    if isinstance(payload, StreamingBody):
+        response = app.response_class(mimetype=payload.mimetype)
+        response.headers.update(payload.headers)
+    else:
+        response = app.json.response(payload)
+    response.status_code = status
+    if headers:
+        response.headers.update(headers)
+    origin = request.headers.get('origin')
+    if origin in Config.CORS_ORIGINS:
+        response.headers['Access-Control-Allow-Origin'] = origin
+        response.headers['Vary'] = 'Origin'
+
+    if isinstance(payload, StreamingBody):
+        del response.headers['Content-Length']
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in response.headers.items()]
+    })
+    if isinstance(payload, StreamingBody):
+        sent = await send_stream(receive, send, payload.chunks)
+    else:
+        body = response.get_data()
+        sent = len(body)
+        await send({'type': 'http.response.body', 'body': body})
+    record_request(request.method, rule, request.path, status,
+                   time.perf_counter() - started, sent, request.remote_addr)
+
+
+async def send_stream(receive, send, chunks):
+    """Send an async iterator's chunks until it ends or the client disconnects; returns bytes sent"""
+    sent = 0
+
+    async def pump():
+        nonlocal sent
+        async for chunk in chunks:
+            sent += len(chunk)
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def disconnected():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    streaming = asyncio.ensure_future(pump())
+    watcher = asyncio.ensure_future(disconnected())
+    try:
+        await asyncio.wait({streaming, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (streaming, watcher):
+            task.cancel()
+        await asyncio.gather(streaming, watcher, return_exceptions=True)
+        if hasattr(chunks, 'aclose'):
+            await chunks.aclose()
+    if streaming.done() and not streaming.cancelled() and streaming.exception():
+        raise streaming.exception()
+    return sent
+
+
+def wsgi_environ(scope, body):
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    server = scope.get('server') or ('localhost', 80)
+    environ['SERVER_NAME'], environ['SERVER_PORT'] = server[0], str(server[1] or 80)
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+    for name, value in scope['headers']:
+        name, value = name.decode('latin-1'), value.decode('latin-1')
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'content-length':
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def serve_flask(scope, receive, send):
+    """Run the Flask app on the thread pool, streaming its response body back"""
+    environ = wsgi_environ(scope, await read_body(receive))
+    response_start = {}
+
+    def start_response(status, headers, exc_info=None):
+        response_start['status'] = int(status.split(' ', 1)[0])
+        response_start['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                     for name, value in headers]
+
+    body = await async_database.run(app, environ, start_response)
+    chunks = iter(body)
+    try:
+        await send({'type': 'http.response.start', **response_start})
+        while True:
+            chunk = await async_database.run(next, chunks, None)
+            if chunk is None:
+                break
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(body, 'close'):
+            await async_database.run(body.close)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            start_worker()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            async_database.shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    for method, rule, pattern, handler in ROUTES:
+        if method == scope['method']:
+            match = pattern.match(scope['path'])
+            if match and handler is None:
+                break
+            if match:
+                return await serve_route(scope, receive, send, rule, handler, match.groupdict())
+    return await serve_flask(scope, receive, send)
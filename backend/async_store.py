@@ -0,0 +1,70 @@
+"""
+Async Storage Access
+
+Awaitable versions of the AppointmentStore operations for the ASGI entry point
+(asgi.py). Blocking calls run on a bounded thread pool so the event loop never
+waits on them; with Firestore, the request-path operations use the async
+client instead (see firebase_async_db.py).
+"""
+import asyncio
+import contextvars
+import functools
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from config import STORAGE_CONFIG
+
+
+class ThreadedAsyncStore:
+    """Runs a sync store's methods on a thread pool: `await store.get_appointments(...)`"""
+
+    def __init__(self, store, max_workers):
+        self.store = store
+        self.max_workers = max_workers
+        self._executor = None
+        self._pid = None
+
+    def run(self, fn, *args, **kwargs):
+        """Await fn(*args, **kwargs) on the pool, in the caller's context"""
+        if self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='async-io')
+            self._pid = os.getpid()
+        context = contextvars.copy_context()
+        return asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(context.run, fn, *args, **kwargs)
+        )
+
+    def __getattr__(self, name):
+        method = getattr(self.store, name)
+
+        async def call(*args, **kwargs):
+            return await self.run(method, *args, **kwargs)
+        call.__name__ = name
+        return call
+
+    async def stream_appointments(self, *args, **kwargs):
+        """Async iterator over store.stream_appointments, read in batches on the pool"""
+        rows = await self.run(self.store.stream_appointments, *args, **kwargs)
+        return self.iterate(rows)
+
+    async def iterate(self, rows, batch_size=500):
+        """Consume a blocking iterator on the pool, batch_size items per hop"""
+        while True:
+            batch = await self.run(lambda: list(itertools.islice(rows, batch_size)))
+            if not batch:
+                return
+            for row in batch:
+                yield row
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False)
+
+
+def create_async_storage(store, max_workers, backend=None):
+    """Async access to `store`, the configured storage backend"""
+    backend = backend or STORAGE_CONFIG['backend']
+    if backend == 'firestore':
+        from firebase_async_db import AsyncFirebaseDB
+        return AsyncFirebaseDB(store, max_workers)
+    return ThreadedAsyncStore(store, max_workers)
@@ -0,0 +1,66 @@
+"""
+Worker Boot Time
+
+Imports the app in fresh interpreters and reports how long a worker takes to
+become ready, median and worst over the runs, broken down by the start-up
+phases boot.py records.
+
+    python benchmarks/boot_time.py --runs 10
+    python benchmarks/boot_time.py --module asgi --backend firestore
+
+Uses an in-memory SQLite store unless --backend says otherwise; reminders are
+off so no run waits on the datastore.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import boot
+import {module}
+boot.start_worker()
+while 'ready' not in boot.boot_timings() and time.perf_counter() - started < 60:
+    time.sleep(0.001)
+timings = boot.boot_timings()
+timings['import {module}'] = time.perf_counter() - started
+sys.stdout.write(json.dumps(timings))
+"""
+
+
+def boot_once(module, env):
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD.format(module=module)],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure AppointmentPro worker boot time')
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters to start')
+    parser.add_argument('--module', default='app', choices=('app', 'asgi'), help='entry point to import')
+    parser.add_argument('--backend', default='sqlite', help='STORAGE_BACKEND for the runs')
+    args = parser.parse_args()
+
+    env = dict(os.environ, STORAGE_BACKEND=args.backend, REMINDERS_ENABLED='false', LOG_LEVEL='WARNING')
+    if args.backend == 'sqlite':
+        env['SQLITE_PATH'] = ':memory:'
+
+    runs = [boot_once(args.module, env) for _ in range(args.runs)]
+    phases = sorted({phase for run in runs for phase in run}, key=lambda phase: -statistics.median(
+        run.get(phase, 0) for run in runs))
+    print(f"{'phase':<40} {'median ms':>10} {'max ms':>10}")
+    for phase in phases:
+        values = [run[phase] * 1000 for run in runs if phase in run]
+        print(f"{phase:<40} {statistics.median(values):>10.1f} {max(values):>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
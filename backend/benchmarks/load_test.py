@@ -0,0 +1,332 @@
+"""
+API Load Test and Latency Benchmark
+
+Starts the Flask app in-process against an in-memory SQLite store (no
+Firebase project needed), drives a weighted mix of bookings, availability
+checks, status updates, listings and statistics from concurrent clients, and
+reports throughput plus p50/p95/p99 latency per route.
+
+    python benchmarks/load_test.py --concurrency 16 --duration 30 --output bench.json
+    python benchmarks/load_test.py --compare bench.json   # fail on p95 regressions
+
+Email/SMS delivery is replaced by a counting sink so results measure the API,
+not the mail server.
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVICES = ['School/College', 'Bank', 'Hospital', 'Doctor', 'Cafe', 'Barber',
+            'Advocate', 'Teacher', 'Company']
+
+DEFAULT_MIX = {
+    'book': 30,
+    'availability': 40,
+    'status_update': 15,
+    'list': 10,
+    'statistics': 5,
+}
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100
+    lower = int(k)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+
+class Recorder:
+    """Per-route latency samples and status counts"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+
+    def record(self, route, seconds, ok):
+        with self._lock:
+            self.samples.setdefault(route, []).append(seconds)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    def summary(self, elapsed):
+        routes = {}
+        everything = []
+        for route, values in sorted(self.samples.items()):
+            values.sort()
+            everything.extend(values)
+            routes[route] = _stats(values, elapsed, self.errors.get(route, 0))
+        everything.sort()
+        return routes, _stats(everything, elapsed, sum(self.errors.values()))
+
+
+def _stats(values, elapsed, errors):
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'throughput_rps': round(len(values) / elapsed, 2) if elapsed else 0.0,
+        'mean_ms': round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+        'p50_ms': round(percentile(values, 50) * 1000, 3),
+        'p95_ms': round(percentile(values, 95) * 1000, 3),
+        'p99_ms': round(percentile(values, 99) * 1000, 3),
+        'max_ms': round(values[-1] * 1000, 3) if values else 0.0,
+    }
+
+
+class Client:
+    """One simulated user with a keep-alive connection"""
+
+    def __init__(self, port, token, shared, recorder, rng):
+        self.port = port
+        self.token = token
+        self.shared = shared
+        self.recorder = recorder
+        self.rng = rng
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+
+    def request(self, route, method, path, body=None, auth=False, ok_statuses=(200, 201)):
+        headers = {'Content-Type': 'application/json'}
+        if auth:
+            headers['Authorization'] = f'Bearer {self.token}'
+        payload = json.dumps(body) if body is not None else None
+        start = time.perf_counter()
+        try:
+            self.conn.request(method, path, body=payload, headers=headers)
+            response = self.conn.getresponse()
+            data = response.read()
+            status = response.status
+        except (http.client.HTTPException, OSError):
+            self.conn.close()
+            self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+            self.recorder.record(route, time.perf_counter() - start, False)
+            return None, None
+        self.recorder.record(route, time.perf_counter() - start, status in ok_statuses)
+        return status, data
+
+    def random_slot(self):
+        day = datetime.now().date() + timedelta(days=self.rng.randint(1, self.shared['days']))
+        hour = self.rng.randint(9, 16)
+        minute = self.rng.choice((0, 30))
+        return self.rng.choice(SERVICES), day.strftime('%Y-%m-%d'), f"{hour:02d}:{minute:02d}"
+
+    # ============ OPERATIONS ============
+
+    def book(self):
+        service_type, date, time_str = self.random_slot()
+        status, data = self.request('POST /api/appointments', 'POST', '/api/appointments', {
+            'service_type': service_type,
+            'client_name': 'Load Test',
+            'client_email': 'load@example.com',
+            'client_phone': '555-0100',
+            'appointment_date': date,
+            'appointment_time': time_str,
+            'purpose': 'benchmark'
+        }, ok_statuses=(201, 409))
+        if status == 201:
+            appointment_id = json.loads(data)['appointment_id']
+            with self.shared['lock']:
+                self.shared['appointment_ids'].append(appointment_id)
+
+    def availability(self):
+        service_type, date, _ = self.random_slot()
+        self.request(
+            'GET /api/availability', 'GET',
+            f"/api/availability?service_type={service_type.replace('/', '%2F')}&date={date}"
+        )
+
+    def status_update(self):
+        with self.shared['lock']:
+            ids = self.shared['appointment_ids']
+            appointment_id = self.rng.choice(ids) if ids else None
+        if appointment_id is None:
+            return self.book()
+        self.request(
+            'PUT /api/appointments/<id>/status', 'PUT',
+            f'/api/appointments/{appointment_id}/status',
+            {'status': self.rng.choice(('Confirmed', 'Completed', 'Pending'))},
+            ok_statuses=(200, 409)
+        )
+
+    def list(self):
+        self.request('GET /api/appointments', 'GET', '/api/appointments?limit=50&order_by=-created_at')
+
+    def statistics(self):
+        self.request('GET /api/statistics', 'GET', '/api/statistics', auth=True)
+
+
+def start_server():
+    """Import the app against an in-memory store and serve it on a free port"""
+    os.environ['STORAGE_BACKEND'] = 'sqlite'
+    os.environ['SQLITE_PATH'] = ':memory:'
+    os.environ['REMINDERS_ENABLED'] = 'false'
+    os.environ['RATE_LIMIT_ENABLED'] = 'false'
+    sys.path.insert(0, BACKEND_DIR)
+
+    from werkzeug.serving import make_server, WSGIRequestHandler
+    from app import app
+    from notifications import notification_service
+
+    delivered = {'email': 0, 'sms': 0}
+
+    def email_sink(to_email, subject, body):
+        delivered['email'] += 1
+        return {'success': True, 'message': 'benchmark sink'}
+
+    def sms_sink(phone_number, message):
+        delivered['sms'] += 1
+        return {'success': True, 'message': 'benchmark sink'}
+
+    notification_service.send_email = email_sink
+    notification_service.send_sms = sms_sink
+
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'   # keep-alive
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, delivered
+
+
+def staff_token(port):
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    credentials = {'email': 'bench-staff@example.com', 'password': 'benchmark', 'name': 'Bench',
+                   'phone': '555-0101', 'role': 'admin'}
+    conn.request('POST', '/api/auth/staff-signup', body=json.dumps(credentials),
+                 headers={'Content-Type': 'application/json'})
+    return json.loads(conn.getresponse().read())['access_token']
+
+
+def run(args):
+    if not args.verbose:
+        logging.disable(logging.INFO)
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    server, delivered = start_server()
+    port = server.server_port
+    token = staff_token(port)
+    mix = dict(DEFAULT_MIX, **json.loads(args.mix)) if args.mix else DEFAULT_MIX
+    operations, weights = zip(*[(name, weight) for name, weight in mix.items() if weight > 0])
+
+    shared = {'lock': threading.Lock(), 'appointment_ids': [], 'days': args.days}
+    recorder = Recorder()
+
+    # Seed some history so listings and statistics have data to work with
+    seeder = Client(port, token, shared, Recorder(), random.Random(args.seed))
+    for _ in range(args.seed_bookings):
+        seeder.book()
+
+    stop_at = time.perf_counter() + args.warmup + args.duration
+    measure_from = time.perf_counter() + args.warmup
+
+    def worker(index):
+        rng = random.Random(args.seed + index + 1)
+        client = Client(port, token, shared, Recorder(), rng)
+        while time.perf_counter() < stop_at:
+            if client.recorder is not recorder and time.perf_counter() >= measure_from:
+                client.recorder = recorder
+            getattr(client, rng.choices(operations, weights)[0])()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    server.shutdown()
+
+    routes, total = recorder.summary(args.duration)
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'concurrency': args.concurrency,
+            'duration_seconds': args.duration,
+            'warmup_seconds': args.warmup,
+            'mix': mix,
+            'storage': 'sqlite :memory:',
+            'notifications_delivered': delivered,
+        },
+        'total': total,
+        'routes': routes,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(current, baseline, tolerance):
+    """Print p95 deltas per route; return routes slower than the tolerance allows"""
+    regressions = []
+    print(f"{'route':40} {'base p95':>10} {'now p95':>10} {'change':>8}")
+    for route, stats in current['routes'].items():
+        base = baseline['routes'].get(route)
+        if not base or not base['p95_ms']:
+            continue
+        change = (stats['p95_ms'] - base['p95_ms']) / base['p95_ms']
+        flag = ' <-- regression' if change > tolerance else ''
+        print(f"{route:40} {base['p95_ms']:>10.2f} {stats['p95_ms']:>10.2f} {change:>+7.1%}{flag}")
+        if change > tolerance:
+            regressions.append(route)
+    return regressions
+
+
+def print_report(result):
+    meta = result['meta']
+    print(f"\n{meta['concurrency']} clients, {meta['duration_seconds']}s, commit {meta['commit']}")
+    print(f"{'route':40} {'req':>7} {'err':>5} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for route, stats in list(result['routes'].items()) + [('TOTAL', result['total'])]:
+        print(f"{route:40} {stats['requests']:>7} {stats['errors']:>5} {stats['throughput_rps']:>8.1f} "
+              f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the AppointmentPro API')
+    parser.add_argument('--concurrency', type=int, default=8, help='simultaneous clients')
+    parser.add_argument('--duration', type=float, default=20, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=3, help='unmeasured seconds first')
+    parser.add_argument('--days', type=int, default=14, help='booking horizon in days')
+    parser.add_argument('--seed-bookings', type=int, default=200, help='appointments created first')
+    parser.add_argument('--seed', type=int, default=42, help='random seed')
+    parser.add_argument('--mix', help='JSON weights overriding %s' % json.dumps(DEFAULT_MIX))
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON to compare p95 latencies against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p95 slowdown (0.2 = 20%%)')
+    parser.add_argument('--verbose', action='store_true', help='keep request logging on')
+    args = parser.parse_args()
+
+    result = run(args)
+    print_report(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        if compare(result, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
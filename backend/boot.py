@@ -0,0 +1,101 @@
+"""
+Process Startup
+
+Keeps worker start-up fast and fork-safe. Heavy client libraries (the
+Firestore client, Twilio) are imported on first use, clients that hold
+connections or threads are created in each process on first use, and
+background work such as reminders starts once the worker is running
+(start_worker) rather than at import time, where under `gunicorn --preload`
+it would run in the master and be inherited across fork().
+
+Start-up phases are timed (boot_timings) and served at /api/metrics.
+"""
+import importlib
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+_started = time.perf_counter()    # app.py imports this module first
+_timings = {}                     # phase -> seconds
+_worker_tasks = []
+_worker_pid = None
+_worker_lock = threading.Lock()
+
+
+class LazyModule:
+    """A module imported on its first attribute access (the import lock makes
+    a first access from several threads at once safe)"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        module = self._module
+        if module is None:
+            with boot_phase(f'import {self._name}'):
+                module = self._module = importlib.import_module(self._name)
+        return getattr(module, attr)
+
+
+def lazy_import(name):
+    return LazyModule(name)
+
+
+@contextmanager
+def boot_phase(name):
+    """Time a start-up step as `name`"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _timings[name] = time.perf_counter() - start
+
+
+def boot_timings():
+    """Seconds this process spent in each start-up phase; 'ready' counts from
+    the start of the process (or the fork that created it)"""
+    return dict(_timings)
+
+
+def on_worker_start(task):
+    """Register a function start_worker runs once in each worker process"""
+    _worker_tasks.append(task)
+    return task
+
+
+def start_worker():
+    """Run the on_worker_start tasks in this process, in the background (once per process)"""
+    global _worker_pid
+    if _worker_pid == os.getpid():
+        return
+    with _worker_lock:
+        if _worker_pid == os.getpid():
+            return
+        _worker_pid = os.getpid()
+    threading.Thread(target=_run_worker_tasks, name='worker-start', daemon=True).start()
+
+
+def _run_worker_tasks():
+    for task in _worker_tasks:
+        try:
+            with boot_phase(task.__name__):
+                task()
+        except Exception as e:
+            logger.error("Worker start task %s failed: %s", task.__name__, e)
+    _timings['ready'] = time.perf_counter() - _started
+    logger.info("Worker %s ready in %.3fs", os.getpid(), _timings['ready'])
+
+
+def _after_fork():
+    # A forked worker's 'ready' time counts from the fork
+    global _started
+    _started = time.perf_counter()
+    _timings.pop('ready', None)
+
+
+os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,225 @@
+"""
+Appointment Change Feed
+
+Backs the Server-Sent Events stream at /api/appointments/stream. Each distinct
+filter has one store watch (a Firestore snapshot listener), however many
+dashboards are subscribed to it; the hub keeps that filter's current
+appointments, gives new subscribers a snapshot of them, and fans every change
+out to each subscriber's queue.
+
+A feed must be filtered by date and/or service type: its watch and its copy
+of the matching appointments live in every worker, so an unfiltered feed
+would hold the whole collection.
+"""
+import asyncio
+import logging
+import queue
+import threading
+
+# Lets a reconnecting EventSource wait this long (ms) before retrying
+SSE_RETRY_MS = 3000
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """A subscriber's queue of (event, data) pairs, read by a WSGI response thread.
+
+    A subscriber that falls queue_size events behind gets a 'reset' event
+    and is dropped; the client reconnects and starts from a fresh snapshot.
+    """
+
+    def __init__(self, queue_size):
+        self._queue = queue.Queue(queue_size)
+        self.overflowed = False
+        self.closed = False
+        self.hub = None
+        self.key = None
+
+    def push(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout):
+        """Next event, or None after `timeout` seconds without one"""
+        if self.overflowed:
+            return ('reset', {})
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return ('reset', {}) if self.overflowed else None
+
+    def close(self):
+        if not self.closed and self.hub is not None:
+            self.closed = True
+            self.hub.unsubscribe(self)
+
+
+class AsyncSubscription(Subscription):
+    """Subscription read by a coroutine; events are handed over to its event loop"""
+
+    def __init__(self, queue_size, loop):
+        super().__init__(queue_size)
+        self._loop = loop
+        self._queue = asyncio.Queue(queue_size)
+
+    def push(self, event):
+        try:
+            self._loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:        # loop closed
+            pass
+
+    def _put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self, timeout):
+        if self.overflowed:
+            return ('reset', {})
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return ('reset', {}) if self.overflowed else None
+
+
+class _Feed:
+    """One filter's watch, its current appointments and its subscribers"""
+
+    def __init__(self):
+        self.appointments = {}
+        self.subscribers = set()
+        self.ready = False
+        self.stop = None
+        self.lock = threading.Lock()
+
+    def add(self, subscription):
+        with self.lock:
+            if self.ready:
+                subscription.push(('snapshot', {'appointments': list(self.appointments.values())}))
+            self.subscribers.add(subscription)
+
+    def apply(self, changes):
+        """Store watch callback"""
+        with self.lock:
+            for kind, appointment_id, appointment in changes:
+                if kind == 'removed':
+                    self.appointments.pop(appointment_id, None)
+                else:
+                    self.appointments[appointment_id] = appointment
+
+            if not self.ready:
+                self.ready = True
+                events = [('snapshot', {'appointments': list(self.appointments.values())})]
+            else:
+                events = [(kind, appointment) for kind, _, appointment in changes]
+            for subscription in self.subscribers:
+                for event in events:
+                    subscription.push(event)
+
+
+class ChangeFeedHub:
+    """Shares one store watch per filter between all its subscribers"""
+
+    def __init__(self, store):
+        self.store = store
+        self._feeds = {}        # (service_type, status, date) -> _Feed
+        self._lock = threading.Lock()
+
+    def subscribe(self, subscription, service_type=None, status=None, date=None):
+        """Attach a Subscription to the feed for these filters, starting its watch if needed.
+        Raises ValueError unless the feed is narrowed by service_type or date."""
+        if not service_type and not date:
+            raise ValueError('A service_type or date filter is required')
+        key = (service_type or None, status or None, date or None)
+        with self._lock:
+            feed = self._feeds.get(key)
+            starting = feed is None
+            if starting:
+                feed = self._feeds[key] = _Feed()
+            subscription.hub = self
+            subscription.key = key
+            feed.add(subscription)
+
+        if starting:
+            try:
+                stop = self.store.watch_appointments(feed.apply, *key)
+            except Exception:
+                with self._lock:
+                    self._feeds.pop(key, None)
+                with feed.lock:
+                    for other in feed.subscribers - {subscription}:
+                        other.push(('reset', {}))
+                raise
+            with self._lock:
+                if self._feeds.get(key) is feed:
+                    feed.stop = stop
+                    stop = None
+            if stop is not None:    # every subscriber left while it was starting
+                stop()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        stop = None
+        with self._lock:
+            feed = self._feeds.get(subscription.key)
+            if feed is None:
+                return
+            with feed.lock:
+                feed.subscribers.discard(subscription)
+                idle = not feed.subscribers
+            if idle:
+                del self._feeds[subscription.key]
+                stop = feed.stop
+        if stop is not None:
+            try:
+                stop()
+            except Exception as e:
+                logger.error("Change feed stop error: %s", e)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'feeds': len(self._feeds),
+                'subscribers': sum(len(feed.subscribers) for feed in self._feeds.values())
+            }
+
+
+def sse_event(event, data, dump_bytes):
+    return b'event: ' + event.encode() + b'\ndata: ' + dump_bytes(data) + b'\n\n'
+
+
+def sse_stream(subscription, dump_bytes, heartbeat_seconds):
+    """text/event-stream body for a Subscription; a comment line is sent when idle
+    so proxies keep the connection open and a closed client is noticed"""
+    try:
+        yield f'retry: {SSE_RETRY_MS}\n\n'.encode()
+        while True:
+            event = subscription.get(heartbeat_seconds)
+            if event is None:
+                yield b': keepalive\n\n'
+                continue
+            yield sse_event(event[0], event[1], dump_bytes)
+            if event[0] == 'reset':
+                return
+    finally:
+        subscription.close()
+
+
+async def sse_stream_async(subscription, dump_bytes, heartbeat_seconds):
+    """sse_stream for an AsyncSubscription"""
+    try:
+        yield f'retry: {SSE_RETRY_MS}\n\n'.encode()
+        while True:
+            event = await subscription.get(heartbeat_seconds)
+            if event is None:
+                yield b': keepalive\n\n'
+                continue
+            yield sse_event(event[0], event[1], dump_bytes)
+            if event[0] == 'reset':
+                return
+    finally:
+        subscription.close()
@@ -30,6 +30,12 @@ FIREBASE_CONFIG = {
     'serviceAccountKey': os.environ.get('FIREBASE_SERVICE_ACCOUNT_KEY') or 'firebase-key.json'
 }
 
+# Storage backend: 'firestore' (default) or 'sqlite' for single-site/offline use
+STORAGE_CONFIG = {
+    'backend': os.environ.get('STORAGE_BACKEND') or 'firestore',
+    'sqlite_path': os.environ.get('SQLITE_PATH') or 'appointmentpro.db',
+}
+
 # Email/SMS Configuration (for notifications)
 NOTIFICATION_CONFIG = {
     'email_from': os.environ.get('EMAIL_FROM') or 'noreply@appointmentpro.com',
@@ -37,9 +43,33 @@ NOTIFICATION_CONFIG = {
     'smtp_port': int(os.environ.get('SMTP_PORT') or 587),
     'smtp_username': os.environ.get('SMTP_USERNAME') or '',
     'smtp_password': os.environ.get('SMTP_PASSWORD') or '',
+    # Pooled, authenticated SMTP sessions reused across messages
+    'smtp_pool_size': int(os.environ.get('SMTP_POOL_SIZE') or 4),
+    'smtp_idle_timeout_seconds': 60,
+    'smtp_max_messages_per_connection': 100,
+    'smtp_noop_after_seconds': 15,
     'twilio_account_sid': os.environ.get('TWILIO_ACCOUNT_SID') or '',
     'twilio_auth_token': os.environ.get('TWILIO_AUTH_TOKEN') or '',
     'twilio_phone_number': os.environ.get('TWILIO_PHONE_NUMBER') or '',
+    # Background delivery: emails/SMS are queued and sent by a worker pool
+    'async_dispatch': (os.environ.get('NOTIFICATION_ASYNC') or 'true').lower() == 'true',
+    'queue_workers': int(os.environ.get('NOTIFICATION_WORKERS') or 4),
+    'queue_max_size': int(os.environ.get('NOTIFICATION_QUEUE_SIZE') or 1000),
+    'max_retries': 3,
+    'retry_backoff_seconds': 2,
+    'queue_drain_timeout_seconds': 30,
+}
+
+# Logging: JSON lines on stderr, written by a background thread
+LOGGING_CONFIG = {
+    'level': (os.environ.get('LOG_LEVEL') or 'INFO').upper(),
+    'queue_size': 10000,
+    # Every request is logged up to this many requests/second; beyond it,
+    # fast successful requests are logged at sample_rate
+    'sample_above_rps': int(os.environ.get('ACCESS_LOG_SAMPLE_ABOVE_RPS') or 50),
+    'sample_rate': float(os.environ.get('ACCESS_LOG_SAMPLE_RATE') or 0.1),
+    # Requests slower than this are always logged
+    'slow_request_ms': 500,
 }
 
 # Application Settings
@@ -47,6 +77,88 @@ APP_SETTINGS = {
     'business_hours_start': 9,
     'business_hours_end': 17,
     'slot_duration_minutes': 30,
-    'max_appointments_per_day': 20,
+    # Active bookings one service takes per date (0 = no limit), and how many
+    # bookings share one slot (desks/counters/doctors)
+    'max_appointments_per_day': int(os.environ.get('MAX_APPOINTMENTS_PER_DAY') or 20),
+    'slot_capacity': int(os.environ.get('SLOT_CAPACITY') or 1),
+    # Per-service hours, slot lengths, breaks, closures and capacities
+    # overriding the settings above (JSON, see schedules.py); a changed file is
+    # picked up within schedule_check_seconds, without a restart
+    'schedule_file': os.environ.get('SCHEDULE_FILE') or os.path.join(os.path.dirname(__file__), 'schedules.json'),
+    'schedule_check_seconds': 5,
     'appointment_reminder_hours': 24,
+    'reminders_enabled': (os.environ.get('REMINDERS_ENABLED') or 'true').lower() == 'true',
+    # Seconds before an indexed day's slot occupancy is re-read from Firestore,
+    # so bookings made by other worker processes become visible (0 = never)
+    'slot_index_ttl_seconds': 60,
+    # Counter documents that statistics writes are spread across
+    'stat_counter_shards': 10,
+    # Documents each service's daily booking total (and its max_per_day) is
+    # split across with Firestore, so a busy day is not one write hotspot
+    'capacity_shards': 8,
+    # Upper bound on the page size GET /api/appointments will return
+    'max_page_size': 500,
+    # Appointment numbers each worker leases from the per-day counter at a time
+    # (unused ones are skipped when the worker exits or the day changes)
+    'appointment_number_block_size': 20,
+    # Delta sync (GET /api/appointments?since=): seconds of recent writes resent
+    # on the next sync in case an earlier write commits late (covers clock skew
+    # between workers), and days deletions are remembered for
+    'sync_settle_seconds': 5,
+    'tombstone_retention_days': 30,
+    # Appointments read (and written out) per page by /api/appointments/export
+    'export_batch_size': int(os.environ.get('EXPORT_BATCH_SIZE') or 1000),
+    # In-process appointment document cache (entries, and seconds before an
+    # entry is re-read so other workers' writes become visible)
+    'appointment_cache_size': 10000,
+    'appointment_cache_ttl_seconds': 30,
+    # Identical availability and statistics reads in flight at once share one
+    # Firestore call, and its result answers the same read for this many seconds
+    # after (0 = share in-flight reads only); this process's writes clear it
+    'read_window_seconds': float(os.environ.get('READ_WINDOW_SECONDS') or 1),
+    # /api/appointments/stream: seconds between keepalive comments on an idle
+    # stream, and events a slow subscriber may fall behind before it is reset
+    'change_feed_heartbeat_seconds': 15,
+    'change_feed_queue_size': 1000,
+    # /api/appointments/search keeps a compact copy of every appointment in each
+    # worker's memory (about 1 KB each) and reads other workers' changes at most
+    # this often; SEARCH_INDEX_ENABLED=false turns the endpoint off
+    'search_index_enabled': (os.environ.get('SEARCH_INDEX_ENABLED') or 'true').lower() == 'true',
+    'search_refresh_seconds': 5,
+    # Latency histograms and counters served at /api/metrics
+    'metrics_enabled': (os.environ.get('METRICS_ENABLED') or 'true').lower() == 'true',
+    # Threads the ASGI entry point (asgi.py) runs blocking calls and Flask routes on
+    'async_io_threads': int(os.environ.get('ASYNC_IO_THREADS') or 32),
+}
+
+# Rate limiting and admission control (see rate_limit.py)
+RATE_LIMIT_CONFIG = {
+    # False admits every request: no per-client limits and no concurrency cap
+    'enabled': (os.environ.get('RATE_LIMIT_ENABLED') or 'true').lower() == 'true',
+    # (method, route): (requests, per_seconds) for each client (user, else IP address)
+    'limits': {
+        ('POST', '/api/appointments'): (10, 60),
+        ('GET', '/api/availability'): (120, 60),
+        ('POST', '/api/auth/client-signup'): (10, 3600),
+        ('POST', '/api/auth/staff-signup'): (10, 3600),
+        ('POST', '/api/auth/client-login'): (10, 60),
+        ('POST', '/api/auth/staff-login'): (10, 60),
+    },
+    # 'memory' (per worker) or 'sqlite' (a file shared by the workers on a host)
+    'store': os.environ.get('RATE_LIMIT_STORE') or 'memory',
+    'sqlite_path': os.environ.get('RATE_LIMIT_DB') or 'ratelimits.db',
+    # Buckets kept before the least recently used are evicted
+    'max_buckets': 100000,
+    # Take the client address from X-Forwarded-For (only behind a proxy that sets it)
+    'trust_forwarded_for': (os.environ.get('RATE_LIMIT_TRUST_PROXY') or 'false').lower() == 'true',
+    # Requests one worker serves at once before shedding the rest with 429 (0 = no cap),
+    # and long-lived routes that do not count towards it
+    'max_concurrent_requests': int(os.environ.get('MAX_CONCURRENT_REQUESTS') or 200),
+    'concurrency_exempt': (
+        '/api/health',
+        '/api/metrics',
+        '/api/appointments/stream',
+        '/api/appointments/export',
+        '/api/appointments/export/<export_id>',
+    ),
 }
@@ -0,0 +1,72 @@
+"""
+Bounded LRU/TTL Entity Cache
+
+Holds recently used documents by id. Entries expire after a TTL so changes
+made by other worker processes are eventually picked up.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+
+class EntityCache:
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()   # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Cached copy of the value, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+
+    def put(self, key, value):
+        """Insert or replace a value, evicting the least recently used entry when full"""
+        if self.max_entries <= 0:
+            return
+        entry = (time.monotonic() + self.ttl_seconds, copy.deepcopy(value))
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def patch(self, key, changes):
+        """Apply field changes to a cached value in place (no-op when absent)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[1].update(copy.deepcopy(changes))
+
+    def evict(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+        }
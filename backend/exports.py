@@ -0,0 +1,248 @@
+"""
+Appointment Exports
+
+Streams the appointments in a date range as CSV, NDJSON or Parquet. Rows are
+read one keyset page at a time (ordered by appointment_date, then id) and each
+page is written out before the next is read, so memory use does not grow with
+the size of the export. After every page the export's position is saved as a
+checkpoint, and an interrupted export can be resumed from it. An export
+belongs to the user who started it: only they can follow or resume it.
+"""
+import calendar
+import csv
+import io
+import logging
+import uuid
+from datetime import datetime, date
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from json_provider import NDJSON_MIMETYPE
+
+EXPORT_COLUMNS = (
+    'id', 'appointment_number', 'service_type', 'client_name', 'client_email',
+    'client_phone', 'appointment_date', 'appointment_time', 'purpose', 'status',
+    'created_at', 'updated_at'
+)
+
+# format -> (mimetype, file extension)
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': (NDJSON_MIMETYPE, 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+logger = logging.getLogger(__name__)
+
+
+def _cell(value):
+    return None if value is None else str(value)
+
+
+class _CsvWriter:
+    def __init__(self, dump_bytes):
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+
+    def _drain(self):
+        data = self._buffer.getvalue().encode('utf-8')
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data
+
+    def header(self):
+        self._writer.writerow(EXPORT_COLUMNS)
+        return self._drain()
+
+    def rows(self, appointments):
+        self._writer.writerows([appt.get(column, '') for column in EXPORT_COLUMNS]
+                               for appt in appointments)
+        return self._drain()
+
+    def close(self):
+        return b''
+
+
+class _NdjsonWriter:
+    def __init__(self, dump_bytes):
+        self._dump_bytes = dump_bytes
+
+    def header(self):
+        return b''
+
+    def rows(self, appointments):
+        return b''.join(
+            self._dump_bytes({column: appt.get(column) for column in EXPORT_COLUMNS}) + b'\n'
+            for appt in appointments
+        )
+
+    def close(self):
+        return b''
+
+
+class _ByteSink:
+    """Write-only file object whose contents are taken after each row group"""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts.clear()
+        return data
+
+
+class _ParquetWriter:
+    """Zstandard-compressed Parquet, one row group per page"""
+
+    def __init__(self, dump_bytes):
+        self._schema = pyarrow.schema([(column, pyarrow.string()) for column in EXPORT_COLUMNS])
+        self._sink = _ByteSink()
+        self._writer = pyarrow.parquet.ParquetWriter(self._sink, self._schema, compression='zstd')
+
+    def header(self):
+        return self._sink.drain()
+
+    def rows(self, appointments):
+        columns = {column: [_cell(appt.get(column)) for appt in appointments] for column in EXPORT_COLUMNS}
+        self._writer.write_table(pyarrow.Table.from_pydict(columns, schema=self._schema))
+        return self._sink.drain()
+
+    def close(self):
+        self._writer.close()
+        return self._sink.drain()
+
+
+WRITERS = {'csv': _CsvWriter, 'ndjson': _NdjsonWriter, 'parquet': _ParquetWriter}
+
+
+def month_range(today=None):
+    """First and last day of the current month, as appointment_date strings"""
+    today = today or date.today()
+    last_day = calendar.monthrange(today.year, today.month)[1]
+    return today.replace(day=1).isoformat(), today.replace(day=last_day).isoformat()
+
+
+def load_checkpoint(store, export_id, owner):
+    """The checkpoint of owner's export export_id, or None (also for other users' exports)"""
+    checkpoint = store.get_export_checkpoint(export_id)
+    if checkpoint is None or checkpoint.get('owner') != owner:
+        return None
+    return checkpoint
+
+
+class AppointmentExport:
+    """One export: its filters, its progress, and the response body that writes it"""
+
+    def __init__(self, store, export_id, checkpoint, batch_size):
+        self.store = store
+        self.export_id = export_id
+        self.checkpoint = checkpoint
+        self.batch_size = batch_size
+
+    @classmethod
+    def start(cls, store, export_format, start_date=None, end_date=None,
+              service_type=None, status=None, batch_size=1000, owner=None):
+        """A new export for `owner` (a user id); invalid arguments raise ValueError"""
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format: {export_format}")
+        if export_format == 'parquet' and pyarrow is None:
+            raise ValueError('Parquet export requires the pyarrow package')
+        default_start, default_end = month_range()
+        start_date, end_date = start_date or default_start, end_date or default_end
+        for value in (start_date, end_date):
+            datetime.strptime(value, '%Y-%m-%d')
+        if start_date > end_date:
+            raise ValueError('from must not be after to')
+
+        checkpoint = {
+            'format': export_format,
+            'start_date': start_date,
+            'end_date': end_date,
+            'service_type': service_type,
+            'status': status,
+            'after': None,
+            'rows': 0,
+            'complete': False,
+            'owner': owner,
+            'created_at': datetime.now().isoformat(),
+            'updated_at': datetime.now().isoformat()
+        }
+        export = cls(store, uuid.uuid4().hex, checkpoint, batch_size)
+        store.save_export_checkpoint(export.export_id, checkpoint)
+        return export
+
+    @classmethod
+    def resume(cls, store, export_id, batch_size=1000, owner=None):
+        """The export saved as export_id, continuing after its last checkpoint;
+        None if unknown or started by someone other than owner"""
+        checkpoint = load_checkpoint(store, export_id, owner)
+        if checkpoint is None:
+            return None
+        if checkpoint['format'] == 'parquet' and pyarrow is None:
+            raise ValueError('Parquet export requires the pyarrow package')
+        return cls(store, export_id, checkpoint, batch_size)
+
+    @property
+    def mimetype(self):
+        return EXPORT_FORMATS[self.checkpoint['format']][0]
+
+    @property
+    def filename(self):
+        checkpoint = self.checkpoint
+        part = f"-from-{checkpoint['rows']}" if checkpoint['rows'] else ''
+        return (f"appointments-{checkpoint['start_date']}-{checkpoint['end_date']}{part}."
+                f"{EXPORT_FORMATS[checkpoint['format']][1]}")
+
+    def chunks(self, dump_bytes):
+        """The export file, one chunk per page of appointments.
+
+        A resumed export is a complete file of the rows not yet exported. The
+        checkpoint is saved when the server asks for the next chunk, after the
+        previous one was handed to the client, so a resume may repeat the rows
+        of the last chunk in flight but never skips any. A failure ends the
+        response without its final chunk, which clients see as a broken
+        transfer.
+        """
+        checkpoint = self.checkpoint
+        writer = WRITERS[checkpoint['format']](dump_bytes)
+        try:
+            yield writer.header()
+            after = tuple(checkpoint['after']) if checkpoint['after'] else None
+            for page in self.store.export_batches(
+                checkpoint['start_date'], checkpoint['end_date'], checkpoint['service_type'],
+                checkpoint['status'], after, self.batch_size
+            ):
+                yield writer.rows(page)
+                checkpoint['after'] = [page[-1]['appointment_date'], page[-1]['id']]
+                checkpoint['rows'] += len(page)
+                checkpoint['updated_at'] = datetime.now().isoformat()
+                self.store.save_export_checkpoint(self.export_id, checkpoint)
+            yield writer.close()
+            checkpoint['complete'] = True
+            checkpoint['updated_at'] = datetime.now().isoformat()
+            self.store.save_export_checkpoint(self.export_id, checkpoint)
+        except Exception as e:
+            logger.error("Export %s failed after %s rows: %s", self.export_id, checkpoint['rows'], e)
+            raise
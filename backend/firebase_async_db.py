@@ -0,0 +1,258 @@
+"""
+Async Firestore Access
+
+The request-path FirebaseDB operations rewritten as coroutines on the async
+Firestore client. Queries, batch and transaction writes and the post-commit
+bookkeeping are built by the sync FirebaseDB, so both serving modes share one slot index, cache,
+counter scheme and listener list. Other operations (including Firebase Auth,
+which has no async API) run on the thread pool.
+"""
+from access_log import count_datastore_call
+from boot import lazy_import
+from storage import ACTIVE_STATUSES
+from async_store import ThreadedAsyncStore
+
+firestore_async = lazy_import('firebase_admin.firestore_async')
+
+
+class AsyncFirebaseDB(ThreadedAsyncStore):
+    # Implemented here with the async client rather than on the thread pool
+    NATIVE_METHODS = (
+        'reserve_appointment', 'get_appointments', 'get_appointment_by_id',
+        'get_appointment_by_number', 'update_appointment_status', 'check_availability', 'get_available_slots',
+        'get_user_by_email', 'get_user_by_uid'
+    )
+
+    @property
+    def db(self):
+        """Async Firestore client for this process's Firebase app"""
+        return firestore_async.client(self.store.app)
+
+    # ============ APPOINTMENT OPERATIONS ============
+
+    async def reserve_appointment(self, service_type, client_data, appointment_data):
+        """Atomically claim a place in a time slot and create the appointment in it"""
+        try:
+            client = self.db
+            # Numbering may lease a new block of numbers in a blocking transaction
+            appointment = await self.run(self.store.build_appointment, service_type, client_data, appointment_data)
+            doc_ref = client.collection('appointments').document()
+
+            @firestore_async.async_transactional
+            async def reserve(transaction):
+                stats = await self.stat_state(client, transaction)
+                counts = await self.read_capacity(
+                    client, transaction, service_type, appointment['appointment_date'], appointment['appointment_time']
+                )
+                refused = self.store.capacity_admission_error(counts)
+                if refused is None:
+                    self.store.reservation_writes(client, transaction, doc_ref, appointment, counts, stats)
+                return refused
+
+            count_datastore_call()
+            refused = await reserve(client.transaction())
+            if refused is not None:
+                return refused
+            return self.store.appointment_created(doc_ref.id, appointment)
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    async def get_appointments(self, service_type=None, status=None, date=None,
+                               limit=None, start_after=None, order_by=None, fields=None):
+        """Retrieve appointments with optional filters, paging and projection"""
+        try:
+            query, page = self.store.appointments_query(
+                self.db, service_type, status, date, limit, start_after, order_by, fields
+            )
+            count_datastore_call()
+            docs = [doc async for doc in query.stream()]
+            return self.store.appointments_page(docs, fields, page)
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    async def stream_appointments(self, service_type=None, status=None, date=None,
+                                  limit=None, start_after=None, order_by=None, fields=None):
+        """Async iterator over matching appointments, converted as Firestore streams them"""
+        query, page = self.store.appointments_query(
+            self.db, service_type, status, date, limit, start_after, order_by, fields, capped=False
+        )
+        count_datastore_call()
+        return self._listing(query.stream(), fields, page)
+
+    async def _listing(self, docs, fields, page):
+        async for doc in docs:
+            yield self.store.appointment_from_doc(doc, fields, page)
+
+    async def get_appointment_by_id(self, appointment_id, fresh=False):
+        """Get a specific appointment (served from the cache when possible, unless fresh)"""
+        try:
+            appt = None if fresh else self.store.appointment_cache.get(appointment_id)
+            if appt is None:
+                appt = await self.read_appointment(appointment_id)
+            if appt is not None:
+                return {'success': True, 'data': appt}
+            return {'success': False, 'error': 'Appointment not found'}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    async def get_appointment_by_number(self, appointment_number):
+        """Get an appointment by its appointment_number (via the number index)"""
+        try:
+            appointment_id = self.store.number_index.get(appointment_number)
+            if appointment_id is None:
+                count_datastore_call()
+                mapping = await self.store.number_ref(self.db, appointment_number).get()
+                if mapping.exists:
+                    appointment_id = mapping.get('appointment_id')
+                else:
+                    query = self.store.number_lookup_query(self.db, appointment_number)
+                    appointment_id = await self.run(self.store.backfill_number, [doc async for doc in query.stream()])
+                if appointment_id is None:
+                    return {'success': False, 'error': 'Appointment not found'}
+                self.store.number_index.put(appointment_number, appointment_id)
+            return await self.get_appointment_by_id(appointment_id)
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    async def update_appointment_status(self, appointment_id, new_status):
+        """Update appointment status; the result carries the updated appointment
+        (re-read in the transaction: see FirebaseDB.update_appointment_status)"""
+        try:
+            client = self.db
+            doc_ref = client.collection('appointments').document(appointment_id)
+
+            @firestore_async.async_transactional
+            async def update(transaction):
+                count_datastore_call()
+                current = self.store.cache_appointment(appointment_id, await doc_ref.get(transaction=transaction))
+                if current is None:
+                    return None, None, None
+                stats = await self.stat_state(client, transaction)
+                counts = None
+                was_active = current.get('status') in ACTIVE_STATUSES
+                if was_active != (new_status in ACTIVE_STATUSES):
+                    counts = await self.read_capacity(
+                        client, transaction, current['service_type'], current['appointment_date'],
+                        current['appointment_time'],
+                        self.store.holder_shard(appointment_id, current) if was_active else None
+                    )
+                    if not was_active:
+                        refused = self.store.capacity_admission_error(counts)
+                        if refused is not None:
+                            return current, None, refused
+                changes = self.store.status_writes(
+                    client, transaction, appointment_id, current, new_status, stats, counts
+                )
+                return current, changes, None
+
+            count_datastore_call()
+            current, changes, refused = await update(client.transaction())
+            if current is None:
+                return {'success': False, 'error': 'Appointment not found'}
+            if refused is not None:
+                return refused
+            return self.store.status_updated(appointment_id, current, changes)
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    async def check_availability(self, service_type, appointment_date, appointment_time):
+        """Whether a slot can take another booking (from the slot index)"""
+        try:
+            await self.ensure_day_indexed(service_type, appointment_date)
+            slot_counts = self.store.slot_index.slot_counts(service_type, appointment_date)
+            return self.store.slot_check(
+                service_type, appointment_date, appointment_time,
+                slot_counts.get(appointment_time, 0), sum(slot_counts.values())
+            )
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    async def get_available_slots(self, service_type, appointment_date, duration_mins=30):
+        """Times with room for another booking, and each slot's remaining capacity"""
+        try:
+            async def available_slots():
+                await self.ensure_day_indexed(service_type, appointment_date)
+                slot_counts = self.store.slot_index.slot_counts(service_type, appointment_date)
+                return self.store.slot_availability(
+                    service_type, appointment_date, slot_counts, sum(slot_counts.values())
+                )
+
+            return await self.store.single_flight.do_async(('slots', service_type, appointment_date), available_slots)
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    async def read_capacity(self, client, transaction, service_type, appointment_date, appointment_time, shard=None):
+        """FirebaseDB.read_capacity on the async client"""
+        reads = self.store.capacity_reads(client, service_type, appointment_date, appointment_time, shard)
+        try:
+            ref = next(reads)
+            while True:
+                count_datastore_call()
+                if ref is None:
+                    query = self.store.booked_query(client, service_type, appointment_date)
+                    ref = reads.send([doc async for doc in query.stream(transaction=transaction)])
+                else:
+                    ref = reads.send(await ref.get(transaction=transaction))
+        except StopIteration as done:
+            return done.value
+
+    async def stat_state(self, client, transaction):
+        """FirebaseDB.stat_state on the async client"""
+        count_datastore_call()
+        counters = self.store.counters
+        return counters.write_state(await counters.meta_ref(client).get(transaction=transaction))
+
+    async def ensure_day_indexed(self, service_type, appointment_date):
+        """Load a day's bookings into the slot index unless already indexed
+        (concurrent callers for the same day share one query)"""
+        slot_index = self.store.slot_index
+        if slot_index.is_loaded(service_type, appointment_date):
+            return
+
+        async def load():
+            pending = slot_index.begin_load(service_type, appointment_date)
+            try:
+                count_datastore_call()
+                booked = [
+                    (doc.id, doc.get('appointment_time'), doc.get('status'))
+                    async for doc in self.store.booked_query(self.db, service_type, appointment_date).stream()
+                ]
+            except BaseException:
+                slot_index.cancel_load(service_type, appointment_date, pending)
+                raise
+            slot_index.load_day(service_type, appointment_date, booked, pending)
+
+        await self.store.single_flight.do_async(('day', service_type, appointment_date), load)
+
+    async def read_appointment(self, appointment_id):
+        """Current appointment document as a dict (refreshing the cache), or None"""
+        count_datastore_call()
+        doc = await self.db.collection('appointments').document(appointment_id).get()
+        return self.store.cache_appointment(appointment_id, doc)
+
+    # ============ USER OPERATIONS ============
+
+    async def get_user_by_email(self, email, user_type='client'):
+        """Get user by email"""
+        try:
+            collection = 'clients' if user_type == 'client' else 'staff'
+            count_datastore_call()
+            async for doc in self.db.collection(collection).where('email', '==', email).limit(1).stream():
+                user = doc.to_dict()
+                user['id'] = doc.id
+                return {'success': True, 'data': user}
+            return {'success': False, 'error': 'User not found'}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    async def get_user_by_uid(self, uid, user_type='client'):
+        """Get user by UID"""
+        try:
+            collection = 'clients' if user_type == 'client' else 'staff'
+            count_datastore_call()
+            doc = await self.db.collection(collection).document(uid).get()
+            if doc.exists:
+                return {'success': True, 'data': doc.to_dict()}
+            return {'success': False, 'error': 'User not found'}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
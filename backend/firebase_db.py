@@ -1,74 +1,355 @@
 """
-Firebase Database Helper Module
+Firebase Database Helper Module - Firestore storage backend
 """
-import firebase_admin
-from firebase_admin import credentials, firestore, auth
+import os
+import random
+import threading
+import time
+import zlib
 from datetime import datetime, timedelta
-import uuid
-from config import FIREBASE_CONFIG
+from urllib.parse import quote
+from config import FIREBASE_CONFIG, APP_SETTINGS
+from storage import AppointmentStore, ACTIVE_STATUSES
+from schedules import schedules
+from slot_index import SlotOccupancyIndex
+from stat_counters import ShardedCounters
+from entity_cache import EntityCache
+from single_flight import SingleFlight
+from access_log import count_datastore_call
+from boot import lazy_import, boot_phase
 
-class FirebaseDB:
+# The Firebase Admin SDK, the Firestore client library (with gRPC) and
+# Firebase Auth take a while to import; they are loaded when this process
+# first talks to Firebase
+firebase_admin = lazy_import('firebase_admin')
+credentials = lazy_import('firebase_admin.credentials')
+firestore = lazy_import('firebase_admin.firestore')
+auth = lazy_import('firebase_admin.auth')
+api_exceptions = lazy_import('google.api_core.exceptions')
+
+# Seconds to wait before trying again after Firebase failed to initialize
+INIT_RETRY_SECONDS = 30
+
+# Active bookings per (service, date, time), and per (service, date, shard)
+SLOT_CAPACITY_COLLECTION = 'slot_capacity'
+DAY_CAPACITY_COLLECTION = 'day_capacity'
+
+class FirebaseDB(AppointmentStore):
     def __init__(self):
-        self.db = None
-        self.initialize()
+        super().__init__()
+        self._app = None
+        self._client = None
+        self._client_pid = None
+        self._retry_at = None           # (pid, monotonic time) after a failed initialize
+        self._client_lock = threading.Lock()
+        self.slot_index = SlotOccupancyIndex(ttl_seconds=APP_SETTINGS['slot_index_ttl_seconds'])
+        self.counters = ShardedCounters(APP_SETTINGS['stat_counter_shards'])
+        self.capacity_shards = APP_SETTINGS['capacity_shards']
+        self.appointment_cache = EntityCache(
+            APP_SETTINGS['appointment_cache_size'],
+            APP_SETTINGS['appointment_cache_ttl_seconds']
+        )
+        # appointment_number -> document id (numbers never change)
+        self.number_index = EntityCache(APP_SETTINGS['appointment_cache_size'], 24 * 3600)
+        # Shares concurrent identical reads (availability, statistics)
+        self.single_flight = SingleFlight(APP_SETTINGS['read_window_seconds'])
+    
+    @property
+    def db(self):
+        """This process's Firestore client, created on first use"""
+        if self._client_pid != os.getpid():
+            self.initialize()
+        return self._client
+    
+    @property
+    def app(self):
+        """This process's Firebase Admin app"""
+        if self._client_pid != os.getpid():
+            self.initialize()
+        return self._app
     
     def initialize(self):
-        """Initialize Firebase Admin SDK"""
-        try:
-            if not firebase_admin._apps:
-                cred = credentials.Certificate(FIREBASE_CONFIG['serviceAccountKey'])
-                firebase_admin.initialize_app(cred)
-            self.db = firestore.client()
-        except Exception as e:
-            print(f"Firebase initialization error: {e}")
+        """Initialize the Firebase Admin SDK for this process.
+        
+        A gRPC channel must not be used across fork(), so each process gets its
+        own app (and with it its own Firestore client) instead of inheriting
+        one from a `gunicorn --preload` master. After a failure the next use
+        tries again, at most every INIT_RETRY_SECONDS.
+        """
+        with self._client_lock:
+            pid = os.getpid()
+            if self._client_pid == pid:
+                return
+            if self._retry_at is not None and self._retry_at[0] == pid and time.monotonic() < self._retry_at[1]:
+                return
+            self._app = self._client = None
+            app = None
+            try:
+                with boot_phase('firestore_client'):
+                    cred = credentials.Certificate(FIREBASE_CONFIG['serviceAccountKey'])
+                    app = firebase_admin.initialize_app(cred, name=f'appointmentpro-{pid}')
+                    self._client = firestore.client(app)
+                    self._app = app
+                self._client_pid = pid
+                self._retry_at = None
+            except Exception as e:
+                print(f"Firebase initialization error: {e}")
+                if app is not None:
+                    firebase_admin.delete_app(app)
+                self._client = None
+                self._retry_at = (pid, time.monotonic() + INIT_RETRY_SECONDS)
+    
+    def connect(self):
+        """Create this process's Firestore client ahead of the first request"""
+        self.initialize()
     
     # ============ APPOINTMENT OPERATIONS ============
     
     def create_appointment(self, service_type, client_data, appointment_data):
-        """Create a new appointment"""
+        """Create a new appointment (counted in, but not limited by, slot capacity)"""
         try:
-            appointment_number = self.generate_appointment_number()
-            
-            appointment = {
-                'appointment_number': appointment_number,
-                'service_type': service_type,
-                'client_name': client_data.get('client_name'),
-                'client_email': client_data.get('client_email'),
-                'client_phone': client_data.get('client_phone'),
-                'appointment_date': appointment_data.get('appointment_date'),
-                'appointment_time': appointment_data.get('appointment_time'),
-                'purpose': appointment_data.get('purpose', ''),
-                'status': 'Pending',
-                'created_at': datetime.now().isoformat(),
-                'updated_at': datetime.now().isoformat()
-            }
-            
-            # Save to Firestore
-            doc_ref = self.db.collection('appointments').document()
-            doc_ref.set(appointment)
-            
-            return {
-                'success': True,
-                'appointment_number': appointment_number,
-                'appointment_id': doc_ref.id,
-                'data': appointment
-            }
+            return self.book(service_type, client_data, appointment_data, admit=False)
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
-    def get_appointments(self, service_type=None, status=None, date=None):
-        """Retrieve appointments with optional filters"""
+    def reserve_appointment(self, service_type, client_data, appointment_data):
+        """Atomically claim a place in a time slot and create the appointment in it.
+        
+        The slot's counter and one of the day's counter shards are read and
+        updated in the same transaction as the appointment is written, so
+        concurrent bookings cannot overfill a slot or the day.
+        """
         try:
-            query = self.db.collection('appointments')
-            
-            if service_type:
-                query = query.where('service_type', '==', service_type)
-            if status:
-                query = query.where('status', '==', status)
-            if date:
-                query = query.where('appointment_date', '==', date)
-            
-            docs = query.stream()
+            return self.book(service_type, client_data, appointment_data, admit=True)
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+    
+    def book(self, service_type, client_data, appointment_data, admit):
+        """Create an appointment and count it, refusing it when `admit` and
+        there is no room"""
+        appointment = self.build_appointment(service_type, client_data, appointment_data)
+        doc_ref = self.db.collection('appointments').document()
+        
+        @firestore.transactional
+        def book(transaction):
+            stats = self.stat_state(transaction)
+            counts = self.read_capacity(
+                transaction, service_type, appointment['appointment_date'], appointment['appointment_time']
+            )
+            if admit:
+                refused = self.capacity_admission_error(counts)
+                if refused is not None:
+                    return refused
+            self.reservation_writes(self.db, transaction, doc_ref, appointment, counts, stats)
+            return None
+        
+        count_datastore_call()
+        refused = book(self.db.transaction())
+        if refused is not None:
+            return refused
+        return self.appointment_created(doc_ref.id, appointment)
+    
+    def reservation_writes(self, client, writer, doc_ref, appointment, counts, stats):
+        """Queue an appointment, its number mapping and its counts on a transaction
+        (stats: the statistics write state read in it, see stat_state)"""
+        appointment['capacity_shard'] = counts['shard']
+        self.counters.record_create(client, writer, appointment, stats)
+        writer.set(doc_ref, appointment)
+        writer.set(self.number_ref(client, appointment['appointment_number']), {'appointment_id': doc_ref.id})
+        self.write_capacity(writer, counts, 1)
+    
+    def appointment_created(self, appointment_id, appointment):
+        """Index, cache and announce a committed appointment"""
+        self.slot_index.add(
+            appointment_id,
+            appointment['service_type'],
+            appointment['appointment_date'],
+            appointment['appointment_time']
+        )
+        self.appointment_cache.put(appointment_id, dict(appointment, id=appointment_id))
+        self.number_index.put(appointment['appointment_number'], appointment_id)
+        self.single_flight.invalidate()
+        self.notify_listeners('appointment_created', appointment_id, dict(appointment, id=appointment_id))
+        
+        return {
+            'success': True,
+            'appointment_number': appointment['appointment_number'],
+            'appointment_id': appointment_id,
+            'data': appointment
+        }
+    
+    def get_appointments(self, service_type=None, status=None, date=None,
+                         limit=None, start_after=None, order_by=None, fields=None):
+        """Retrieve appointments with optional filters.
+        
+        With `limit` the result is one page; pass the returned `next_cursor`
+        back as `start_after` for the next one. `order_by` is a field name,
+        prefixed with '-' for descending, and `fields` limits the returned
+        fields of each appointment.
+        """
+        try:
+            query, page = self.appointments_query(
+                self.db, service_type, status, date, limit, start_after, order_by, fields
+            )
+            count_datastore_call()
+            return self.appointments_page(query.stream(), fields, page)
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+    
+    def stream_appointments(self, service_type=None, status=None, date=None,
+                            limit=None, start_after=None, order_by=None, fields=None):
+        """Matching appointments, converted one document at a time as Firestore streams them"""
+        query, page = self.appointments_query(
+            self.db, service_type, status, date, limit, start_after, order_by, fields, capped=False
+        )
+        count_datastore_call()
+        return (self.appointment_from_doc(doc, fields, page) for doc in query.stream())
+    
+    def appointments_query(self, client, service_type, status, date, limit, start_after, order_by, fields,
+                           capped=True):
+        """Build the get_appointments query.
+        
+        Returns (query, page), where page is (order_field, page_size) for a
+        paginated listing and None otherwise. `capped` applies max_page_size.
+        """
+        query = client.collection('appointments')
+        
+        if service_type:
+            query = query.where('service_type', '==', service_type)
+        if status:
+            query = query.where('status', '==', status)
+        if date:
+            query = query.where('appointment_date', '==', date)
+        
+        page = None
+        if limit is not None or start_after or order_by:
+            order_field, descending = self.parse_order_by(order_by or 'created_at')
+            direction = firestore.Query.DESCENDING if descending else firestore.Query.ASCENDING
+            query = query.order_by(order_field, direction=direction) \
+                         .order_by(firestore.FieldPath.document_id(), direction=direction)
+            if start_after:
+                cursor_field, cursor_value, cursor_id = self.decode_cursor(start_after)
+                if cursor_field != order_field:
+                    raise ValueError('Cursor does not match order_by')
+                query = query.start_after({order_field: cursor_value, '__name__': cursor_id})
+            page_size = None
+            if limit is not None:
+                page_size = min(int(limit), APP_SETTINGS['max_page_size']) if capped else int(limit)
+                query = query.limit(page_size)
+            page = (order_field, page_size)
+        
+        if fields:
+            selected = list(fields)
+            if page and page[0] not in selected:
+                selected.append(page[0])
+            query = query.select(selected)
+        return query, page
+    
+    def appointments_page(self, docs, fields, page):
+        """get_appointments result (with next_cursor when paginated) from query results"""
+        appointments = []
+        last = None
+        for doc in docs:
+            if page:
+                last = (doc.get(page[0]), doc.id)
+            appointments.append(self.appointment_from_doc(doc, fields, page))
+        
+        result = {'success': True, 'data': appointments}
+        if page:
+            order_field, page_size = page
+            full_page = page_size is not None and last is not None and len(appointments) == page_size
+            result['next_cursor'] = self.encode_cursor(order_field, *last) if full_page else None
+        return result
+    
+    def appointment_from_doc(self, doc, fields, page):
+        """Listing entry for one document (the sort field is only fetched for paging)"""
+        appt = doc.to_dict()
+        if page and fields and page[0] not in fields:
+            appt.pop(page[0], None)
+        appt['id'] = doc.id
+        return appt
+    
+    def watch_appointments(self, callback, service_type=None, status=None, date=None):
+        """Follow matching appointments with a Firestore snapshot listener.
+        
+        Sees every writer's changes; callback runs on the listener's thread.
+        Returns a function that stops the listener.
+        """
+        query, _ = self.appointments_query(self.db, service_type, status, date, None, None, None, None)
+        
+        def on_snapshot(docs, changes, read_time):
+            callback([
+                (change.type.name.lower(), change.document.id,
+                 self.appointment_from_doc(change.document, None, None))
+                for change in changes
+            ])
+        
+        count_datastore_call()
+        return query.on_snapshot(on_snapshot).unsubscribe
+    
+    def get_appointment_by_id(self, appointment_id, fresh=False):
+        """Get a specific appointment (served from the cache when possible, unless fresh)"""
+        try:
+            appt = None if fresh else self.appointment_cache.get(appointment_id)
+            if appt is None:
+                appt = self.read_appointment(appointment_id)
+            if appt is not None:
+                return {'success': True, 'data': appt}
+            else:
+                return {'success': False, 'error': 'Appointment not found'}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+    
+    def get_appointment_by_number(self, appointment_number):
+        """Get an appointment by its appointment_number.
+        
+        The appointment_numbers/<number> document written with each
+        appointment maps the number to the document id, so a lookup is a
+        point read (none when the id and appointment are cached).
+        """
+        try:
+            appointment_id = self.number_index.get(appointment_number)
+            if appointment_id is None:
+                count_datastore_call()
+                mapping = self.number_ref(self.db, appointment_number).get()
+                if mapping.exists:
+                    appointment_id = mapping.get('appointment_id')
+                else:
+                    appointment_id = self.backfill_number(self.number_lookup_query(self.db, appointment_number).stream())
+                if appointment_id is None:
+                    return {'success': False, 'error': 'Appointment not found'}
+                self.number_index.put(appointment_number, appointment_id)
+            return self.get_appointment_by_id(appointment_id)
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+    
+    def number_ref(self, client, appointment_number):
+        """Index document mapping an appointment_number to its appointment"""
+        return client.collection('appointment_numbers').document(quote(appointment_number, safe=''))
+    
+    def number_lookup_query(self, client, appointment_number):
+        """Field query for appointments written before the number index existed"""
+        count_datastore_call()
+        return client.collection('appointments').where('appointment_number', '==', appointment_number).limit(1)
+    
+    def backfill_number(self, docs):
+        """Index the first of `docs` (the number_lookup_query results); returns its id or None"""
+        for doc in docs:
+            count_datastore_call()
+            self.number_ref(self.db, doc.get('appointment_number')).set({'appointment_id': doc.id})
+            self.cache_appointment(doc.id, doc)
+            return doc.id
+        return None
+    
+    def get_upcoming_appointments(self, start_date, end_date):
+        """Pending/Confirmed appointments dated start_date..end_date inclusive"""
+        try:
+            count_datastore_call()
+            docs = self.db.collection('appointments') \
+                          .where('appointment_date', '>=', start_date) \
+                          .where('appointment_date', '<=', end_date) \
+                          .where('status', 'in', list(ACTIVE_STATUSES)) \
+                          .stream()
             appointments = []
             for doc in docs:
                 appt = doc.to_dict()
@@ -79,65 +360,395 @@ class FirebaseDB:
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
-    def get_appointment_by_id(self, appointment_id):
-        """Get a specific appointment"""
+    def update_appointment_status(self, appointment_id, new_status):
+        """Update appointment status.
+        
+        The appointment is re-read inside the transaction, so the counter
+        deltas (statistics, and the slot's place when the change frees or
+        takes one) always follow from the status actually being replaced.
+        """
         try:
-            doc = self.db.collection('appointments').document(appointment_id).get()
-            if doc.exists:
-                appt = doc.to_dict()
-                appt['id'] = doc.id
-                return {'success': True, 'data': appt}
-            else:
+            doc_ref = self.db.collection('appointments').document(appointment_id)
+            
+            @firestore.transactional
+            def update(transaction):
+                count_datastore_call()
+                current = self.cache_appointment(appointment_id, doc_ref.get(transaction=transaction))
+                if current is None:
+                    return None, None, None
+                stats = self.stat_state(transaction)
+                counts = None
+                was_active = current.get('status') in ACTIVE_STATUSES
+                if was_active != (new_status in ACTIVE_STATUSES):
+                    # Freeing a place releases the shard it holds; taking one back looks for room
+                    counts = self.read_capacity(
+                        transaction, current['service_type'], current['appointment_date'],
+                        current['appointment_time'], self.holder_shard(appointment_id, current) if was_active else None
+                    )
+                    if not was_active:
+                        refused = self.capacity_admission_error(counts)
+                        if refused is not None:
+                            return current, None, refused
+                changes = self.status_writes(self.db, transaction, appointment_id, current, new_status, stats, counts)
+                return current, changes, None
+            
+            count_datastore_call()
+            current, changes, refused = update(self.db.transaction())
+            if current is None:
                 return {'success': False, 'error': 'Appointment not found'}
+            if refused is not None:
+                return refused
+            return self.status_updated(appointment_id, current, changes)
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
-    def update_appointment_status(self, appointment_id, new_status):
-        """Update appointment status"""
-        try:
-            self.db.collection('appointments').document(appointment_id).update({
-                'status': new_status,
-                'updated_at': datetime.now().isoformat()
-            })
-            return {'success': True, 'message': f'Appointment updated to {new_status}'}
-        except Exception as e:
-            return {'success': False, 'error': str(e)}
+    def status_writes(self, client, writer, appointment_id, current, new_status, stats, counts=None):
+        """Queue the writes moving `current` (read in the same transaction, as
+        was the statistics write state `stats`) to new_status; returns the
+        changes. Pass the capacity counts (read_capacity) when the change frees
+        or takes a place."""
+        changes = {
+            'status': new_status,
+            'updated_at': datetime.now().isoformat()
+        }
+        was_active = current.get('status') in ACTIVE_STATUSES
+        is_active = new_status in ACTIVE_STATUSES
+        if counts is not None and is_active and not was_active:
+            changes['capacity_shard'] = counts['shard']
+        changes.update(self.counters.record_status_change(
+            client, writer, current, current.get('status'), new_status, stats
+        ))
+        writer.update(client.collection('appointments').document(appointment_id), changes)
+        
+        if counts is not None and was_active != is_active:
+            self.write_capacity(writer, counts, 1 if is_active else -1)
+        # Appointments reserved before capacity counters hold a slot lock document
+        if current.get('slot_lock') and was_active and not is_active:
+            writer.delete(client.collection('slot_locks').document(current['slot_lock']))
+        return changes
+    
+    def status_updated(self, appointment_id, current, changes):
+        """Index, cache and announce a committed status change"""
+        self.slot_index.set_status(appointment_id, changes['status'])
+        current.update(changes)
+        self.appointment_cache.patch(appointment_id, changes)
+        self.single_flight.invalidate()
+        self.notify_listeners('appointment_updated', appointment_id, dict(current))
+        return {
+            'success': True,
+            'message': f"Appointment updated to {changes['status']}",
+            'data': current
+        }
     
     def delete_appointment(self, appointment_id):
         """Delete/cancel an appointment"""
         try:
-            self.db.collection('appointments').document(appointment_id).delete()
+            doc_ref = self.db.collection('appointments').document(appointment_id)
+            
+            @firestore.transactional
+            def delete(transaction):
+                count_datastore_call()
+                current = self.cache_appointment(appointment_id, doc_ref.get(transaction=transaction))
+                if current is None:
+                    return None
+                stats = self.stat_state(transaction)
+                counts = None
+                if current.get('status') in ACTIVE_STATUSES:
+                    counts = self.read_capacity(
+                        transaction, current['service_type'], current['appointment_date'],
+                        current['appointment_time'], self.holder_shard(appointment_id, current)
+                    )
+                
+                transaction.delete(doc_ref)
+                if current.get('appointment_number'):
+                    transaction.delete(self.number_ref(self.db, current['appointment_number']))
+                tombstone = self.tombstone(appointment_id, current)
+                # Firestore's TTL policy on expire_at removes old tombstones
+                tombstone['expire_at'] = datetime.now() + timedelta(days=APP_SETTINGS['tombstone_retention_days'])
+                transaction.set(self.db.collection('appointment_tombstones').document(appointment_id), tombstone)
+                self.counters.record_delete(self.db, transaction, current, stats)
+                if counts is not None:
+                    self.write_capacity(transaction, counts, -1)
+                    if current.get('slot_lock'):
+                        transaction.delete(self.db.collection('slot_locks').document(current['slot_lock']))
+                return current
+            
+            count_datastore_call()
+            current = delete(self.db.transaction())
+            
+            self.slot_index.remove(appointment_id)
+            self.appointment_cache.evict(appointment_id)
+            self.single_flight.invalidate()
+            if current is not None:
+                if current.get('appointment_number'):
+                    self.number_index.evict(current['appointment_number'])
+                self.notify_listeners('appointment_deleted', appointment_id, current)
             return {'success': True, 'message': 'Appointment deleted'}
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
     def check_availability(self, service_type, appointment_date, appointment_time):
-        """Check if a time slot is available"""
+        """Whether a slot can take another booking (from the slot index)"""
         try:
-            query = self.db.collection('appointments').where('service_type', '==', service_type) \
-                                                       .where('appointment_date', '==', appointment_date) \
-                                                       .where('appointment_time', '==', appointment_time) \
-                                                       .where('status', 'in', ['Pending', 'Confirmed'])
-            docs = query.stream()
-            count = len(list(docs))
-            
-            return {
-                'success': True,
-                'available': count == 0,
-                'booked_count': count
-            }
+            self.ensure_day_indexed(service_type, appointment_date)
+            slot_counts = self.slot_index.slot_counts(service_type, appointment_date)
+            return self.slot_check(
+                service_type, appointment_date, appointment_time,
+                slot_counts.get(appointment_time, 0), sum(slot_counts.values())
+            )
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
+    def ensure_day_indexed(self, service_type, appointment_date):
+        """Load a day's bookings into the slot index unless already indexed
+        (concurrent callers for the same day share one query)"""
+        if self.slot_index.is_loaded(service_type, appointment_date):
+            return
+        
+        def load():
+            pending = self.slot_index.begin_load(service_type, appointment_date)
+            try:
+                count_datastore_call()
+                booked = [
+                    (doc.id, doc.get('appointment_time'), doc.get('status'))
+                    for doc in self.booked_query(self.db, service_type, appointment_date).stream()
+                ]
+            except BaseException:
+                self.slot_index.cancel_load(service_type, appointment_date, pending)
+                raise
+            self.slot_index.load_day(service_type, appointment_date, booked, pending)
+        
+        self.single_flight.do(('day', service_type, appointment_date), load)
+    
+    def booked_query(self, client, service_type, appointment_date):
+        """Active appointments for one service and day"""
+        return client.collection('appointments') \
+                     .where('service_type', '==', service_type) \
+                     .where('appointment_date', '==', appointment_date) \
+                     .where('status', 'in', list(ACTIVE_STATUSES))
+    
+    # ============ SLOT CAPACITY ============
+    
+    def capacity_reads(self, client, service_type, appointment_date, appointment_time, shard=None):
+        """The reads behind read_capacity, shared with the async store.
+        
+        A generator: it yields a document reference to be read (or None for
+        the day's booked appointments), is sent the snapshot (or the list of
+        booked snapshots) and returns the counts. The slot's document is read,
+        then the day's shards from a random one until one has room under its
+        share of max_per_day (or just `shard`, the one a booking being freed
+        holds). A document that does not exist yet is counted from the
+        booked appointments.
+        """
+        slot_ref = client.collection(SLOT_CAPACITY_COLLECTION).document(
+            quote(f"{service_type}|{appointment_date}|{appointment_time}", safe='')
+        )
+        booked = None
+        snapshot = yield slot_ref
+        if snapshot.exists:
+            slot_count = snapshot.get('count')
+        else:
+            booked = yield None
+            slot_count = sum(1 for doc in booked if doc.get('appointment_time') == appointment_time)
+        
+        counts = {
+            'service_type': service_type,
+            'appointment_date': appointment_date,
+            'appointment_time': appointment_time,
+            'slot_ref': slot_ref,
+            'slot': slot_count,
+            'day_full': False
+        }
+        # A place being freed only needs the shard it is counted in
+        max_per_day = None if shard is not None else schedules.for_service(service_type).max_per_day
+        if shard is None:
+            first = random.randrange(self.capacity_shards)
+            shards = [(first + i) % self.capacity_shards for i in range(self.capacity_shards)]
+        else:
+            shards = [shard]
+        for shard in shards:
+            shard_ref = client.collection(DAY_CAPACITY_COLLECTION).document(
+                quote(f"{service_type}|{appointment_date}|{shard}", safe='')
+            )
+            snapshot = yield shard_ref
+            if snapshot.exists:
+                shard_count = snapshot.get('count')
+            else:
+                if booked is None:
+                    booked = yield None
+                shard_count = sum(1 for doc in booked if self.holder_shard(doc.id, doc.to_dict()) == shard)
+            counts.update(shard=shard, shard_ref=shard_ref, shard_count=shard_count)
+            if not max_per_day or shard_count < self.shard_quota(max_per_day, shard):
+                return counts
+        counts['day_full'] = True
+        return counts
+    
+    def read_capacity(self, transaction, service_type, appointment_date, appointment_time, shard=None):
+        """Capacity counts for one more (or, given its shard, one fewer) booking
+        at appointment_time, read in `transaction` (see capacity_reads)"""
+        reads = self.capacity_reads(self.db, service_type, appointment_date, appointment_time, shard)
+        try:
+            ref = next(reads)
+            while True:
+                count_datastore_call()
+                if ref is None:
+                    ref = reads.send(list(
+                        self.booked_query(self.db, service_type, appointment_date).stream(transaction=transaction)
+                    ))
+                else:
+                    ref = reads.send(ref.get(transaction=transaction))
+        except StopIteration as done:
+            return done.value
+    
+    def shard_quota(self, max_per_day, shard):
+        """The share of max_per_day one day shard may admit"""
+        return max_per_day // self.capacity_shards + (1 if shard < max_per_day % self.capacity_shards else 0)
+    
+    def stat_state(self, transaction):
+        """The statistics counters' write state, read in `transaction` (every
+        transaction that counts appointments reads it first)"""
+        count_datastore_call()
+        return self.counters.write_state(self.counters.meta_ref(self.db).get(transaction=transaction))
+    
+    def holder_shard(self, appointment_id, appointment):
+        """The day shard an appointment's place is counted in (appointments
+        booked before shards existed are spread by a hash of their id)"""
+        shard = appointment.get('capacity_shard')
+        if shard is None:
+            shard = zlib.crc32(appointment_id.encode()) % self.capacity_shards
+        return shard
+    
+    def capacity_admission_error(self, counts):
+        """admission_error for the booking counts were read for"""
+        # The shards decided whether the day is full; the day total is never summed
+        max_per_day = schedules.for_service(counts['service_type']).max_per_day
+        return self.admission_error(
+            counts['service_type'], counts['appointment_date'], counts['appointment_time'],
+            counts['slot'], max_per_day if counts['day_full'] else 0
+        )
+    
+    def write_capacity(self, writer, counts, delta):
+        """Queue the slot's and the shard's counts, adjusted by delta bookings"""
+        updated_at = datetime.now().isoformat()
+        writer.set(counts['slot_ref'], {
+            'service_type': counts['service_type'],
+            'appointment_date': counts['appointment_date'],
+            'appointment_time': counts['appointment_time'],
+            'count': max(counts['slot'] + delta, 0),
+            'updated_at': updated_at
+        })
+        writer.set(counts['shard_ref'], {
+            'service_type': counts['service_type'],
+            'appointment_date': counts['appointment_date'],
+            'shard': counts['shard'],
+            'count': max(counts['shard_count'] + delta, 0),
+            'updated_at': updated_at
+        })
+    
+    def claim_reminder(self, appointment_id):
+        """Record that a reminder is being sent; False if one already was"""
+        try:
+            count_datastore_call()
+            self.db.collection('reminders_sent').document(appointment_id).create({
+                'appointment_id': appointment_id,
+                'sent_at': datetime.now().isoformat()
+            })
+            return True
+        except api_exceptions.AlreadyExists:
+            return False
+    
+    # ============ DELTA SYNC ============
+    
+    def get_changed_appointments(self, after=None, service_type=None, date=None, limit=500):
+        """Appointments by (updated_at, id) after a watermark"""
+        docs = self.changes_query('appointments', 'updated_at', after, service_type, date, limit).stream()
+        return [self.appointment_from_doc(doc, None, None) for doc in docs]
+    
+    def get_tombstones(self, after=None, service_type=None, date=None, limit=500):
+        """Deleted appointments by (deleted_at, id) after a watermark"""
+        docs = self.changes_query('appointment_tombstones', 'deleted_at', after, service_type, date, limit).stream()
+        tombstones = []
+        for doc in docs:
+            tomb = doc.to_dict()
+            tomb.pop('expire_at', None)
+            tomb['id'] = doc.id
+            tombstones.append(tomb)
+        return tombstones
+    
+    def changes_query(self, collection, time_field, after, service_type, date, limit):
+        """Query over `collection` ordered by (time_field, document id), following `after`"""
+        query = self.db.collection(collection)
+        if service_type:
+            query = query.where('service_type', '==', service_type)
+        if date:
+            query = query.where('appointment_date', '==', date)
+        if after and not after[1]:
+            query = query.where(time_field, '>=', after[0])
+        query = query.order_by(time_field).order_by(firestore.FieldPath.document_id())
+        if after and after[1]:
+            query = query.start_after({time_field: after[0], '__name__': after[1]})
+        count_datastore_call()
+        return query.limit(limit)
+    
+    # ============ EXPORTS ============
+    
+    def get_export_page(self, start_date, end_date, service_type=None, status=None,
+                        after=None, limit=1000):
+        """One keyset page of an export, filtered and ordered by Firestore"""
+        query = self.db.collection('appointments') \
+                       .where('appointment_date', '>=', start_date) \
+                       .where('appointment_date', '<=', end_date)
+        if service_type:
+            query = query.where('service_type', '==', service_type)
+        if status:
+            query = query.where('status', '==', status)
+        query = query.order_by('appointment_date') \
+                     .order_by(firestore.FieldPath.document_id())
+        if after:
+            query = query.start_after({'appointment_date': after[0], '__name__': after[1]})
+        
+        count_datastore_call()
+        return [self.appointment_from_doc(doc, None, None) for doc in query.limit(limit).stream()]
+    
+    def save_export_checkpoint(self, export_id, checkpoint):
+        """Store (replace) an export's progress dict"""
+        count_datastore_call()
+        self.db.collection('export_checkpoints').document(export_id).set(checkpoint)
+    
+    def get_export_checkpoint(self, export_id):
+        """An export's progress dict, or None"""
+        count_datastore_call()
+        doc = self.db.collection('export_checkpoints').document(export_id).get()
+        return doc.to_dict() if doc.exists else None
+    
+    # ============ SEQUENCES ============
+    
+    def lease_sequence_block(self, name, size):
+        """Reserve the next `size` numbers of a counter document in a transaction"""
+        ref = self.db.collection('sequences').document(name)
+        
+        @firestore.transactional
+        def lease(transaction):
+            count_datastore_call()
+            snapshot = ref.get(transaction=transaction)
+            start = snapshot.get('next') if snapshot.exists else 1
+            transaction.set(ref, {'next': start + size, 'updated_at': datetime.now().isoformat()})
+            return start
+        
+        count_datastore_call()
+        return lease(self.db.transaction())
+    
     # ============ USER OPERATIONS ============
     
     def create_client_user(self, email, password, name, phone):
         """Create a new client user"""
         try:
+            count_datastore_call(2)
             user = auth.create_user(
                 email=email,
                 password=password,
-                display_name=name
+                display_name=name,
+                app=self.app
             )
             
             # Store additional user data in Firestore
@@ -157,10 +768,12 @@ class FirebaseDB:
     def create_staff_user(self, email, password, name, phone, role):
         """Create a new staff user"""
         try:
+            count_datastore_call(2)
             user = auth.create_user(
                 email=email,
                 password=password,
-                display_name=name
+                display_name=name,
+                app=self.app
             )
             
             self.db.collection('staff').document(user.uid).set({
@@ -176,10 +789,23 @@ class FirebaseDB:
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
+    def authenticate_user(self, email, password, user_type='client'):
+        """Look up a Firebase Auth user by email.
+        
+        Passwords are verified by the Firebase client SDK, not here.
+        """
+        try:
+            count_datastore_call()
+            user = auth.get_user_by_email(email, app=self.app)
+            return {'success': True, 'uid': user.uid}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+    
     def get_user_by_email(self, email, user_type='client'):
         """Get user by email"""
         try:
             collection = 'clients' if user_type == 'client' else 'staff'
+            count_datastore_call()
             docs = self.db.collection(collection).where('email', '==', email).stream()
             
             for doc in docs:
@@ -195,6 +821,7 @@ class FirebaseDB:
         """Get user by UID"""
         try:
             collection = 'clients' if user_type == 'client' else 'staff'
+            count_datastore_call()
             doc = self.db.collection(collection).document(uid).get()
             
             if doc.exists:
@@ -207,72 +834,73 @@ class FirebaseDB:
     
     # ============ UTILITY FUNCTIONS ============
     
-    def generate_appointment_number(self):
-        """Generate a unique appointment number (APP-YYYYMMDD-XXXX)"""
-        from datetime import datetime
-        date_str = datetime.now().strftime('%Y%m%d')
-        unique_id = str(uuid.uuid4())[:4].upper()
-        return f"APP-{date_str}-{unique_id}"
+    def read_appointment(self, appointment_id):
+        """Current appointment document as a dict, or None if it does not exist.
+        
+        Always reads Firestore (write paths need the authoritative status) and
+        refreshes the cache with the result.
+        """
+        count_datastore_call()
+        doc = self.db.collection('appointments').document(appointment_id).get()
+        return self.cache_appointment(appointment_id, doc)
+    
+    def cache_appointment(self, appointment_id, doc):
+        """Refresh the cache from a freshly read snapshot; returns it as a dict or None"""
+        if not doc.exists:
+            self.appointment_cache.evict(appointment_id)
+            return None
+        appt = doc.to_dict()
+        appt['id'] = doc.id
+        self.appointment_cache.put(appointment_id, appt)
+        return appt
     
     def get_available_slots(self, service_type, appointment_date, duration_mins=30):
-        """Get available time slots for a given date"""
+        """Times with room for another booking, and each slot's remaining capacity"""
         try:
-            from config import APP_SETTINGS
-            
-            # Get all booked appointments for the date
-            booked = self.db.collection('appointments') \
-                           .where('service_type', '==', service_type) \
-                           .where('appointment_date', '==', appointment_date) \
-                           .where('status', 'in', ['Pending', 'Confirmed']) \
-                           .stream()
-            
-            booked_times = set()
-            for doc in booked:
-                booked_times.add(doc.get('appointment_time'))
-            
-            # Generate available slots
-            slots = []
-            start_hour = APP_SETTINGS['business_hours_start']
-            end_hour = APP_SETTINGS['business_hours_end']
-            slot_duration = APP_SETTINGS['slot_duration_minutes']
+            def available_slots():
+                self.ensure_day_indexed(service_type, appointment_date)
+                slot_counts = self.slot_index.slot_counts(service_type, appointment_date)
+                return self.slot_availability(service_type, appointment_date, slot_counts, sum(slot_counts.values()))
             
-            current_time = datetime.strptime(f"{start_hour:02d}:00", "%H:%M")
-            end_time = datetime.strptime(f"{end_hour:02d}:00", "%H:%M")
-            
-            while current_time < end_time:
-                time_str = current_time.strftime("%H:%M")
-                if time_str not in booked_times:
-                    slots.append(time_str)
-                current_time += timedelta(minutes=slot_duration)
-            
-            return {'success': True, 'slots': slots}
+            return self.single_flight.do(('slots', service_type, appointment_date), available_slots)
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
-    def get_statistics(self):
-        """Get appointment statistics"""
+    def get_statistics(self, start_date=None, end_date=None):
+        """Get appointment statistics from the maintained counters.
+        
+        Per-day figures are keyed by appointment_date and default to the
+        coming week.
+        """
         try:
-            # Total appointments
-            total = len(list(self.db.collection('appointments').stream()))
-            
-            # Pending appointments
-            pending = len(list(self.db.collection('appointments').where('status', '==', 'Pending').stream()))
+            if not start_date or not end_date:
+                default_start, default_end = self.default_statistics_range()
+                start_date = start_date or default_start
+                end_date = end_date or default_end
             
-            # Confirmed appointments
-            confirmed = len(list(self.db.collection('appointments').where('status', '==', 'Confirmed').stream()))
-            
-            # Completed appointments
-            completed = len(list(self.db.collection('appointments').where('status', '==', 'Completed').stream()))
+            counts = self.single_flight.do(
+                ('statistics', start_date, end_date),
+                lambda: self.counters.read(self.db, start_date, end_date)
+            )
             
             return {
                 'success': True,
-                'total_appointments': total,
-                'pending': pending,
-                'confirmed': confirmed,
-                'completed': completed
+                'total_appointments': counts['total'],
+                'pending': counts['status'].get('Pending', 0),
+                'confirmed': counts['status'].get('Confirmed', 0),
+                'completed': counts['status'].get('Completed', 0),
+                'by_status': counts['status'],
+                'by_service': counts['service'],
+                'by_day': counts['by_day']
             }
         except Exception as e:
             return {'success': False, 'error': str(e)}
-
-# Initialize database
-firebase_db = FirebaseDB()
+    
+    def rebuild_statistics(self):
+        """Recount all appointments into the statistics counters (full scan)"""
+        try:
+            days = self.counters.rebuild(self.db)
+            self.single_flight.invalidate()
+            return {'success': True, 'message': f'Statistics rebuilt ({days} days)'}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
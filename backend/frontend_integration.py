@@ -50,6 +50,45 @@ class AppointmentProAPI {
         }
     }
 
+    // Bring a local copy of the appointments up to date, transferring only
+    // what changed since the last call. The copy and its watermark are kept
+    // in localStorage under `key`; returns the appointments keyed by id.
+    async syncAppointments(filters = {}, key = 'appointmentSync') {
+        const saved = JSON.parse(localStorage.getItem(key) || 'null');
+        const sameFilters = saved && JSON.stringify(saved.filters) === JSON.stringify(filters);
+        let appointments = sameFilters ? saved.appointments : {};
+        let watermark = sameFilters ? saved.watermark : '';
+        try {
+            while (true) {
+                const params = new URLSearchParams({ ...filters, since: watermark }).toString();
+                const response = await fetch(`${API_BASE_URL}/appointments?${params}`, {
+                    method: 'GET',
+                    headers: {
+                        'Authorization': `Bearer ${this.token}`
+                    }
+                });
+                if (response.status === 410 && watermark) {
+                    // Watermark too old to know what was deleted: start over
+                    appointments = {};
+                    watermark = '';
+                    continue;
+                }
+                const data = await response.json();
+                if (!data.success) return data;
+
+                data.data.forEach((appt) => { appointments[appt.id] = appt; });
+                data.deleted.forEach((id) => { delete appointments[id]; });
+                watermark = data.watermark;
+                if (!data.has_more) break;
+            }
+            localStorage.setItem(key, JSON.stringify({ filters, watermark, appointments }));
+            return { success: true, data: appointments };
+        } catch (error) {
+            console.error('Sync appointments error:', error);
+            return { success: false, error: error.message };
+        }
+    }
+
     async getAppointment(appointmentId) {
         try {
             const response = await fetch(`${API_BASE_URL}/appointments/${appointmentId}`, {
@@ -219,6 +258,29 @@ class AppointmentProAPI {
         }
     }
 
+    // ============ LIVE UPDATES ============
+
+    // Follow appointments over Server-Sent Events (staff only). handlers may
+    // define onSnapshot(appointments), onAdded(appt), onModified(appt) and
+    // onRemoved(appt). Returns the EventSource; call .close() to stop.
+    watchAppointments(filters = {}, handlers = {}) {
+        const params = new URLSearchParams({ ...filters, jwt: this.token }).toString();
+        const source = new EventSource(`${API_BASE_URL}/appointments/stream?${params}`);
+        const on = (event, handler) => source.addEventListener(event, (e) => {
+            if (handler) handler(JSON.parse(e.data));
+        });
+        on('snapshot', (data) => handlers.onSnapshot && handlers.onSnapshot(data.appointments));
+        on('added', handlers.onAdded);
+        on('modified', handlers.onModified);
+        on('removed', handlers.onRemoved);
+        // Sent when this client fell too far behind; reconnect for a fresh snapshot
+        source.addEventListener('reset', () => {
+            source.close();
+            setTimeout(() => this.watchAppointments(filters, handlers), 1000);
+        });
+        return source;
+    }
+
     async healthCheck() {
         try {
             const response = await fetch(`${API_BASE_URL}/health`, {
@@ -257,6 +319,17 @@ const update = await api.updateAppointmentStatus(appointmentId, 'Confirmed');
 
 // Client login
 const login = await api.clientLogin('user@example.com', 'password123');
+
+// Keep a local copy of one service's appointments current
+const synced = await api.syncAppointments({ service_type: 'Bank' });
+
+// Staff dashboard: live appointment list
+const feed = api.watchAppointments({ service_type: 'Bank' }, {
+    onSnapshot: (appointments) => renderAppointments(appointments),
+    onAdded: (appt) => console.log('New appointment', appt.appointment_number),
+    onModified: (appt) => console.log('Updated', appt.appointment_number, appt.status),
+    onRemoved: (appt) => console.log('Removed', appt.appointment_number)
+});
 */
 """
 
@@ -0,0 +1,13 @@
+"""
+Gunicorn Settings
+
+Read by gunicorn when it is started from backend/ (`gunicorn app:app`). Safe
+with --preload: the master imports the app but opens no Firestore client and
+starts no threads. Each worker connects and starts its reminders once forked.
+"""
+
+
+def post_worker_init(worker):
+    """Runs in each worker after the app is loaded (post-fork)"""
+    import boot
+    boot.start_worker()
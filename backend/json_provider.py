@@ -0,0 +1,104 @@
+"""
+JSON Serialization
+
+FastJSONProvider makes jsonify() and request.get_json() use orjson when it is
+installed, with the stdlib encoder as the fallback (and for anything orjson
+rejects, such as integers over 64 bits). The ndjson helpers write one
+document per line in socket-sized chunks for streamed responses.
+"""
+import logging
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# Bytes of NDJSON collected before a chunk is handed to the server
+NDJSON_CHUNK_SIZE = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson, producing the same JSON as the default one"""
+
+    def _options(self, indent=False):
+        # Dates go through DefaultJSONProvider.default so they keep Flask's format
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dump_bytes(self, obj, indent=False):
+        """Serialize to UTF-8 bytes"""
+        if orjson is not None:
+            try:
+                return orjson.dumps(obj, default=self.default, option=self._options(indent))
+            except (orjson.JSONEncodeError, TypeError):
+                pass
+        if indent:
+            return super().dumps(obj, indent=2).encode('utf-8')
+        return super().dumps(obj, separators=(',', ':')).encode('utf-8')
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or set(kwargs) - {'indent', 'separators'}:
+            return super().dumps(obj, **kwargs)
+        return self.dump_bytes(obj, indent=bool(kwargs.get('indent'))).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = self._app.debug if self.compact is None else not self.compact
+        return self._app.response_class(self.dump_bytes(obj, indent) + b'\n', mimetype=self.mimetype)
+
+
+def prefers_ndjson(accept_mimetypes):
+    """True if the client's Accept header ranks NDJSON above plain JSON"""
+    return accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def ndjson_chunks(rows, dump_bytes):
+    """NDJSON for an iterable of documents, yielded in chunks of about NDJSON_CHUNK_SIZE.
+
+    A failure part-way through ends the stream with an error line, since the
+    status code has already been sent.
+    """
+    buffer = bytearray()
+    try:
+        for row in rows:
+            buffer += dump_bytes(row)
+            buffer += b'\n'
+            if len(buffer) >= NDJSON_CHUNK_SIZE:
+                yield bytes(buffer)
+                buffer.clear()
+    except Exception as e:
+        logger.error("NDJSON stream error: %s", e)
+        buffer += dump_bytes({'success': False, 'error': str(e)}) + b'\n'
+    if buffer:
+        yield bytes(buffer)
+
+
+async def ndjson_chunks_async(rows, dump_bytes):
+    """ndjson_chunks for an async iterable of documents"""
+    buffer = bytearray()
+    try:
+        async for row in rows:
+            buffer += dump_bytes(row)
+            buffer += b'\n'
+            if len(buffer) >= NDJSON_CHUNK_SIZE:
+                yield bytes(buffer)
+                buffer.clear()
+    except Exception as e:
+        logger.error("NDJSON stream error: %s", e)
+        buffer += dump_bytes({'success': False, 'error': str(e)}) + b'\n'
+    if buffer:
+        yield bytes(buffer)
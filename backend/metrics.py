@@ -0,0 +1,366 @@
+"""
+Request, Datastore and Notification Metrics
+
+Fixed-bucket latency histograms and counters exposed in the Prometheus text
+format at /api/metrics. Every thread records into its own shard of each
+series, so recording is a list index increment with no lock; the shards are
+only summed (under a lock) when the endpoint is scraped.
+"""
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+
+# Seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Series:
+    """One label combination; each thread adds into its own list of slots"""
+
+    def __init__(self, size):
+        self._size = size
+        self._local = threading.local()
+        self._shards = []              # (thread, shard)
+        self._retired = [0] * size     # folded-in shards of finished threads
+        self._sweep_at = 64
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = [0] * self._size
+        with self._lock:
+            if len(self._shards) >= self._sweep_at:
+                self._sweep()
+            self._shards.append((threading.current_thread(), shard))
+        self._local.shard = shard
+        return shard
+
+    def _sweep(self):
+        """Fold shards of threads that have exited; callers hold the lock.
+
+        Servers that start a thread per connection would otherwise grow a
+        shard per connection.
+        """
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                for i, value in enumerate(shard):
+                    self._retired[i] += value
+        self._shards = live
+        self._sweep_at = max(64, 2 * len(live))
+
+    def totals(self):
+        with self._lock:
+            self._sweep()
+            totals = list(self._retired)
+            shards = [shard for _, shard in self._shards]
+        for shard in shards:
+            for i, value in enumerate(shard):
+                totals[i] += value
+        return totals
+
+
+class HistogramSeries(_Series):
+    def __init__(self, buckets):
+        # One slot per bucket, one for +Inf, then the running sum
+        super().__init__(len(buckets) + 2)
+        self._buckets = buckets
+        self._sum_slot = len(buckets) + 1
+
+    def observe(self, seconds):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._shard()
+        shard[bisect_left(self._buckets, seconds)] += 1
+        shard[self._sum_slot] += seconds
+
+
+class CounterSeries(_Series):
+    def __init__(self):
+        super().__init__(1)
+
+    def inc(self, amount=1):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._shard()
+        shard[0] += amount
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """The series for these label values; look it up once and keep it where possible"""
+        series = self._series.get(values)
+        if series is None:
+            with self._lock:
+                series = self._series.get(values)
+                if series is None:
+                    series = self._new_series()
+                    self._series[values] = series
+        return series
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._series.items())
+        for values, series in items:
+            lines.extend(self._render_series(values, series.totals()))
+        return lines
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_series(self):
+        return HistogramSeries(self.buckets)
+
+    def _render_series(self, values, totals):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), totals):
+            cumulative += count
+            le = 'le="+Inf"' if bound == '+Inf' else f'le="{bound}"'
+            lines.append(f'{self.name}_bucket{_labels(self.labelnames, values, le)} {cumulative}')
+        lines.append(f'{self.name}_sum{_labels(self.labelnames, values)} {totals[-1]}')
+        lines.append(f'{self.name}_count{_labels(self.labelnames, values)} {cumulative}')
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_series(self):
+        return CounterSeries()
+
+    def _render_series(self, values, totals):
+        return [f'{self.name}_total{_labels(self.labelnames, values)} {totals[0]}']
+
+
+class CollectedMetric:
+    """Values read from a callback at scrape time (cache and queue statistics)"""
+
+    def __init__(self, name, help_text, kind, labelnames, collect):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def render(self):
+        suffix = '_total' if self.kind == 'counter' else ''
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+        try:
+            samples = self.collect()
+        except Exception as e:
+            print(f"Metric collection error ({self.name}): {e}")
+            return []
+        for values, value in samples:
+            lines.append(f'{self.name}{suffix}{_labels(self.labelnames, values)} {value}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.register(Counter(name, help_text, labelnames))
+
+    def collected(self, name, help_text, kind, labelnames, collect):
+        return self.register(CollectedMetric(name, help_text, kind, labelnames, collect))
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# ============ INSTRUMENTATION ============
+
+registry = MetricsRegistry()
+
+request_duration = registry.histogram(
+    'appointmentpro_http_request_duration_seconds',
+    'Time spent handling API requests', ('method', 'route'))
+requests_total = registry.counter(
+    'appointmentpro_http_requests',
+    'API requests by response status', ('method', 'route', 'status'))
+datastore_duration = registry.histogram(
+    'appointmentpro_datastore_call_duration_seconds',
+    'Time spent in storage backend methods', ('method',))
+datastore_errors = registry.counter(
+    'appointmentpro_datastore_errors',
+    'Storage backend calls that raised or failed', ('method',))
+notification_duration = registry.histogram(
+    'appointmentpro_notification_send_duration_seconds',
+    'Time spent delivering one email or SMS', ('channel',))
+notification_errors = registry.counter(
+    'appointmentpro_notification_send_errors',
+    'Email/SMS deliveries that failed', ('channel',))
+
+
+# (method, route, status) -> (duration series, count series); routes are URL
+# rules, so this stays as small as the set of endpoints
+_request_series = {}
+
+
+def observe_request(method, route, status, seconds):
+    """Record one finished request (route is the URL rule, not the raw path)"""
+    key = (method, route, status)
+    series = _request_series.get(key)
+    if series is None:
+        series = _request_series[key] = (request_duration.labels(method, route),
+                                          requests_total.labels(method, route, status))
+    series[0].observe(seconds)
+    series[1].inc()
+
+
+def _timed(fn, histogram_series, error_series):
+    """Wrap a result-dict method (plain or async) with a timer and an error counter"""
+    def finish(start, result):
+        histogram_series.observe(time.perf_counter() - start)
+        # A slot that is already taken is an answer, not a failure
+        if isinstance(result, dict) and result.get('success') is False and not result.get('slot_taken'):
+            error_series.inc()
+        return result
+
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = await fn(*args, **kwargs)
+            except BaseException:
+                histogram_series.observe(time.perf_counter() - start)
+                error_series.inc()
+                raise
+            return finish(start, result)
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException:
+            histogram_series.observe(time.perf_counter() - start)
+            error_series.inc()
+            raise
+        return finish(start, result)
+    return wrapper
+
+
+def instrument_store(store, method_names):
+    """Time the given public methods of a storage backend instance (sync or async)"""
+    for name in method_names:
+        setattr(store, name, _timed(
+            getattr(store, name), datastore_duration.labels(name), datastore_errors.labels(name)
+        ))
+
+
+def instrument_notifications(service):
+    """Time send_email/send_sms (the calls that leave the process)"""
+    for name, channel in (('send_email', 'email'), ('send_sms', 'sms')):
+        setattr(service, name, _timed(
+            getattr(service, name), notification_duration.labels(channel), notification_errors.labels(channel)
+        ))
+
+
+def register_boot_metrics(boot_timings):
+    """Seconds this process spent starting up, by phase (see boot.py)"""
+    registry.collected(
+        'appointmentpro_boot_seconds', 'Seconds spent in each start-up phase of this process',
+        'gauge', ('phase',), lambda: [((phase,), seconds) for phase, seconds in sorted(boot_timings().items())])
+
+
+def register_state_metrics(store, notification_service, change_feed=None, rate_limiter=None):
+    """Cache, queue, connection pool, change feed and admission figures, read at scrape time"""
+    cache = getattr(store, 'appointment_cache', None)
+    if cache is not None:
+        registry.collected(
+            'appointmentpro_appointment_cache_lookups', 'Appointment cache lookups by outcome',
+            'counter', ('result',),
+            lambda: [(('hit',), cache.hits), (('miss',), cache.misses)])
+        registry.collected(
+            'appointmentpro_appointment_cache_entries', 'Appointments currently cached',
+            'gauge', (), lambda: [((), cache.stats()['size'])])
+
+    single_flight = getattr(store, 'single_flight', None)
+    if single_flight is not None:
+        registry.collected(
+            'appointmentpro_coalesced_reads', 'Availability and statistics reads by how they were answered',
+            'counter', ('outcome',),
+            lambda: [((outcome,), single_flight.stats()[outcome]) for outcome in ('executed', 'shared', 'cached')])
+        registry.collected(
+            'appointmentpro_coalesced_read_waiters', 'Callers waiting on another caller\'s in-flight read',
+            'gauge', (), lambda: [((), single_flight.stats()['waiting'])])
+
+    def queue_counts():
+        stats = notification_service.queue_stats()
+        return [((outcome,), stats[outcome]) for outcome in ('enqueued', 'sent', 'failed', 'retried', 'dropped')]
+
+    registry.collected(
+        'appointmentpro_notification_jobs', 'Notification queue jobs by outcome',
+        'counter', ('outcome',), queue_counts)
+    registry.collected(
+        'appointmentpro_notification_queue_depth', 'Notifications waiting for a worker',
+        'gauge', (), lambda: [((), notification_service.queue_stats()['depth'])])
+    registry.collected(
+        'appointmentpro_smtp_connections', 'Pooled SMTP connections by state',
+        'gauge', ('state',),
+        lambda: [((state,), notification_service.smtp_pool.pool_stats()[state]) for state in ('open', 'idle')])
+    if change_feed is not None:
+        registry.collected(
+            'appointmentpro_change_feed_watches', 'Store watches shared by change feed subscribers',
+            'gauge', (), lambda: [((), change_feed.stats()['feeds'])])
+        registry.collected(
+            'appointmentpro_change_feed_subscribers', 'Open /api/appointments/stream connections',
+            'gauge', (), lambda: [((), change_feed.stats()['subscribers'])])
+    if rate_limiter is not None:
+        registry.collected(
+            'appointmentpro_requests_rejected', 'Requests refused with 429 by reason',
+            'counter', ('reason',),
+            lambda: [(('shed',), rate_limiter.shed), (('throttled',), rate_limiter.throttled)])
+        registry.collected(
+            'appointmentpro_requests_in_flight', 'Requests counted against the concurrency cap',
+            'gauge', (), lambda: [((), rate_limiter.in_flight)])
+        registry.collected(
+            'appointmentpro_rate_limit_buckets', 'Rate limit buckets held',
+            'gauge', (), lambda: [((), rate_limiter.store.size())])
@@ -1,29 +1,68 @@
 """
 Notification System for Email and SMS
 """
-import smtplib
+import atexit
+import os
+import queue
+import threading
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from config import NOTIFICATION_CONFIG
+from smtp_pool import SMTPConnectionPool
+from boot import boot_phase
 from datetime import datetime
 
 class NotificationService:
     def __init__(self):
         self.email_config = NOTIFICATION_CONFIG
-        self.twilio_client = None
-        self.initialize_twilio()
+        # Twilio is imported and its client created on the first SMS in each process
+        self._twilio_client = None
+        self._twilio_pid = None
+        self._twilio_lock = threading.Lock()
+        self.smtp_pool = SMTPConnectionPool(
+            self.email_config['smtp_server'],
+            self.email_config['smtp_port'],
+            self.email_config['smtp_username'],
+            self.email_config['smtp_password'],
+            max_size=self.email_config['smtp_pool_size'],
+            idle_timeout=self.email_config['smtp_idle_timeout_seconds'],
+            max_messages_per_connection=self.email_config['smtp_max_messages_per_connection'],
+            noop_after=self.email_config['smtp_noop_after_seconds']
+        )
+        
+        # Background delivery queue; workers start on first use in each process
+        self.async_dispatch = NOTIFICATION_CONFIG['async_dispatch']
+        self._queue = None
+        self._workers = []
+        self._retry_timers = set()
+        self._pid = None
+        self._accepting = False
+        self._state_lock = threading.Lock()
+        self._counts = {'enqueued': 0, 'sent': 0, 'failed': 0, 'retried': 0, 'dropped': 0}
+        atexit.register(self.shutdown)
+    
+    @property
+    def twilio_client(self):
+        """This process's Twilio client (None when SMS is simulated)"""
+        if self._twilio_pid != os.getpid():
+            with self._twilio_lock:
+                if self._twilio_pid != os.getpid():
+                    self._twilio_client = self.initialize_twilio()
+                    self._twilio_pid = os.getpid()
+        return self._twilio_client
     
     def initialize_twilio(self):
-        """Initialize Twilio client if credentials are available"""
+        """Create a Twilio client if credentials are available"""
         try:
             if self.email_config['twilio_account_sid'] and self.email_config['twilio_auth_token']:
                 from twilio.rest import Client
-                self.twilio_client = Client(
+                return Client(
                     self.email_config['twilio_account_sid'],
                     self.email_config['twilio_auth_token']
                 )
         except Exception as e:
             print(f"Twilio initialization failed: {e}. SMS notifications will be simulated.")
+        return None
     
     def send_appointment_confirmation(self, appointment_data, send_email=True, send_sms=True):
         """Send appointment confirmation via email and SMS"""
@@ -56,21 +95,23 @@ AppointmentPro Team
             results = {}
             
             if send_email and client_email:
-                results['email'] = self.send_email(
+                results['email'] = self.dispatch(
+                    'send_email',
                     to_email=client_email,
                     subject=f"Appointment Confirmation - {appointment_number}",
                     body=message_body
                 )
             
             if send_sms and client_phone:
-                results['sms'] = self.send_sms(
+                results['sms'] = self.dispatch(
+                    'send_sms',
                     phone_number=client_phone,
                     message=f"AppointmentPro: Your appointment {appointment_number} is confirmed for {appointment_date} at {appointment_time}."
                 )
             
             return {
                 'success': True,
-                'message': 'Notifications sent successfully',
+                'message': 'Notifications queued' if self.async_dispatch else 'Notifications sent successfully',
                 'results': results
             }
         except Exception as e:
@@ -88,17 +129,7 @@ AppointmentPro Team
                 
                 msg.attach(MIMEText(body, 'plain'))
                 
-                server = smtplib.SMTP(
-                    self.email_config['smtp_server'],
-                    self.email_config['smtp_port']
-                )
-                server.starttls()
-                server.login(
-                    self.email_config['smtp_username'],
-                    self.email_config['smtp_password']
-                )
-                server.send_message(msg)
-                server.quit()
+                self.smtp_pool.send_message(msg)
                 
                 return {'success': True, 'message': f'Email sent to {to_email}'}
             else:
@@ -147,21 +178,23 @@ AppointmentPro Team
             results = {}
             
             if client_email:
-                results['email'] = self.send_email(
+                results['email'] = self.dispatch(
+                    'send_email',
                     to_email=client_email,
                     subject=f"Appointment Reminder - {appointment_number}",
                     body=reminder_message
                 )
             
             if client_phone:
-                results['sms'] = self.send_sms(
+                results['sms'] = self.dispatch(
+                    'send_sms',
                     phone_number=client_phone,
                     message=reminder_message
                 )
             
             return {
                 'success': True,
-                'message': 'Reminders sent successfully',
+                'message': 'Reminders queued' if self.async_dispatch else 'Reminders sent successfully',
                 'results': results
             }
         except Exception as e:
@@ -182,7 +215,8 @@ AppointmentPro Team
             """
             
             if client_email:
-                return self.send_email(
+                return self.dispatch(
+                    'send_email',
                     to_email=client_email,
                     subject=f"Appointment Status Update - {appointment_number}",
                     body=message_body
@@ -192,5 +226,127 @@ AppointmentPro Team
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    # ============ DELIVERY QUEUE ============
+    
+    def dispatch(self, method_name, **kwargs):
+        """Deliver via send_email/send_sms, in the background when async dispatch is on"""
+        if not self.async_dispatch:
+            return getattr(self, method_name)(**kwargs)
+        
+        self._ensure_workers()
+        if not self._accepting:
+            return {'success': False, 'error': 'Notification queue is shut down'}
+        try:
+            self._queue.put_nowait((method_name, kwargs, 0))
+        except queue.Full:
+            self._count('dropped')
+            print(f"Notification queue full, dropped {method_name}")
+            return {'success': False, 'error': 'Notification queue is full'}
+        self._count('enqueued')
+        return {'success': True, 'message': f'{method_name} queued'}
+    
+    def _ensure_workers(self):
+        """Start the worker pool in this process (again after a fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._state_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.email_config['queue_max_size'])
+            self._retry_timers = set()
+            self._workers = [
+                threading.Thread(target=self._worker, name=f'notification-worker-{i}', daemon=True)
+                for i in range(self.email_config['queue_workers'])
+            ]
+            for worker in self._workers:
+                worker.start()
+            self._accepting = True
+            self._pid = os.getpid()
+    
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                self._run(*job)
+            finally:
+                self._queue.task_done()
+    
+    def _run(self, method_name, kwargs, attempt):
+        try:
+            result = getattr(self, method_name)(**kwargs)
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+        
+        if result.get('success'):
+            self._count('sent')
+        elif attempt < self.email_config['max_retries'] and self._accepting:
+            delay = self.email_config['retry_backoff_seconds'] * (2 ** attempt)
+            self._count('retried')
+            timer = threading.Timer(delay, self._retry, args=((method_name, kwargs, attempt + 1),))
+            timer.daemon = True
+            with self._state_lock:
+                self._retry_timers.add(timer)
+            timer.start()
+        else:
+            self._count('failed')
+            print(f"Notification {method_name} failed after {attempt + 1} attempts: {result.get('error')}")
+    
+    def _retry(self, job):
+        with self._state_lock:
+            self._retry_timers.discard(threading.current_thread())
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self._count('dropped')
+    
+    def _count(self, name):
+        with self._state_lock:
+            self._counts[name] += 1
+    
+    def shutdown(self, timeout=None):
+        """Stop accepting jobs and let the workers drain what is queued"""
+        if self._pid != os.getpid() or not self._accepting:
+            return
+        self._accepting = False
+        if timeout is None:
+            timeout = self.email_config['queue_drain_timeout_seconds']
+        
+        # Pending retries get their last attempt now if the queue has room
+        with self._state_lock:
+            timers, self._retry_timers = self._retry_timers, set()
+        for timer in timers:
+            timer.cancel()
+            try:
+                self._queue.put_nowait(timer.args[0])
+            except queue.Full:
+                self._count('dropped')
+                print(f"Notification queue full at shutdown, dropped retry of {timer.args[0][0]}")
+        
+        # A worker stuck on a send must not hold up exit: give up after the timeout
+        for _ in self._workers:
+            try:
+                self._queue.put(None, timeout=timeout)
+            except queue.Full:
+                break
+        for worker in self._workers:
+            worker.join(timeout)
+        self.smtp_pool.close_all()
+    
+    def queue_stats(self):
+        """Queue depth and delivery counters for this process"""
+        with self._state_lock:
+            stats = dict(self._counts)
+            pending_retries = len(self._retry_timers)
+        stats.update({
+            'depth': self._queue.qsize() if self._queue is not None else 0,
+            'max_size': self.email_config['queue_max_size'],
+            'workers': sum(1 for w in self._workers if w.is_alive()),
+            'pending_retries': pending_retries
+        })
+        return stats
+
 # Initialize notification service
-notification_service = NotificationService()
+with boot_phase('notifications'):
+    notification_service = NotificationService()
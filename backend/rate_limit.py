@@ -0,0 +1,213 @@
+"""
+Rate Limiting and Admission Control
+
+Every request first takes a place under the worker's concurrency cap
+(RATE_LIMIT_CONFIG['max_concurrent_requests']); past the cap it is shed with
+a 429 before any datastore call. Requests to a rate-limited route then take a
+token from the client's bucket for that route: the signed-in user's when the
+request carries a valid access token, otherwise the caller's IP address. A
+bucket holds `requests` tokens and refills at requests / per_seconds, so a
+client can burst up to the limit and is then held to the average rate.
+
+Buckets live in memory (per worker, least recently used evicted past
+max_buckets) or in a SQLite file shared by every worker on the host
+(store = 'sqlite'). A bucket store that fails lets the request through.
+RATE_LIMIT_CONFIG['enabled'] = False turns off both the buckets and the cap.
+"""
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def _take(tokens, updated, capacity, rate, now):
+    """Refill a bucket to `now` and take one token: (tokens left, 0) or,
+    when it is empty, (tokens, seconds until a token is available)"""
+    tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0
+    return tokens, (1 - tokens) / rate
+
+
+def client_key(identity, remote_addr, forwarded_for=None):
+    """A request's bucket owner: its user, else its address. With a trusted proxy,
+    forwarded_for is its X-Forwarded-For header, whose last entry is the address
+    the proxy saw (earlier entries are whatever the client sent)."""
+    if identity:
+        return f"user:{identity}"
+    if forwarded_for:
+        return f"ip:{forwarded_for.rsplit(',', 1)[-1].strip()}"
+    return f"ip:{remote_addr}"
+
+
+class MemoryBucketStore:
+    """This worker's buckets, least recently used first"""
+
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self.evicted = 0
+        self._buckets = OrderedDict()     # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate, now):
+        """Seconds to wait before `key` has a token (0: one was taken)"""
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens, wait = _take(tokens, updated, capacity, rate, now)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                # The least recently used bucket has had the longest to refill
+                self._buckets.popitem(last=False)
+                self.evicted += 1
+            return wait
+
+    def size(self):
+        return len(self._buckets)
+
+
+class SQLiteBucketStore:
+    """Buckets in a SQLite file, shared by the workers on one host"""
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path, max_keys, idle_seconds):
+        self.path = path
+        self.max_keys = max_keys
+        self.idle_seconds = idle_seconds     # a bucket untouched this long is full again
+        self.evicted = 0
+        self._local = threading.local()
+        self._takes = 0
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            " key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS buckets_updated ON buckets (updated)")
+
+    def _conn(self):
+        # One connection per thread, opened again in a forked child
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def take(self, key, capacity, rate, now):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (capacity, now)
+            tokens, wait = _take(tokens, updated, capacity, rate, now)
+            conn.execute(
+                "INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?)"
+                " ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (key, tokens, now)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        self._takes += 1
+        if self._takes % self.PRUNE_EVERY == 0:
+            self.prune(now)
+        return wait
+
+    def prune(self, now=None):
+        """Drop buckets idle long enough to be full, then the oldest past max_keys"""
+        now = time.time() if now is None else now
+        conn = self._conn()
+        conn.execute("DELETE FROM buckets WHERE updated < ?", (now - self.idle_seconds,))
+        cursor = conn.execute(
+            "DELETE FROM buckets WHERE key IN ("
+            " SELECT key FROM buckets ORDER BY updated DESC LIMIT -1 OFFSET ?)",
+            (self.max_keys,)
+        )
+        self.evicted += max(cursor.rowcount, 0)
+
+    def size(self):
+        return self._conn().execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+
+
+class RateLimiter:
+    def __init__(self, limits, store, max_concurrent=0, exempt=(), enabled=True):
+        """limits: {(method, rule): (requests, per_seconds)}; max_concurrent 0 = no cap;
+        exempt: rules (e.g. long-lived streams) outside the concurrency cap;
+        enabled False admits every request"""
+        self.limits = {route: (float(requests), requests / per_seconds)
+                       for route, (requests, per_seconds) in limits.items()}
+        self.store = store
+        self.max_concurrent = max_concurrent
+        self.exempt = frozenset(exempt)
+        self.enabled = enabled
+        self.in_flight = 0
+        self.shed = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings):
+        limits = settings['limits']
+        if settings['store'] == 'sqlite':
+            idle_seconds = max((per_seconds for _, per_seconds in limits.values()), default=0)
+            store = SQLiteBucketStore(settings['sqlite_path'], settings['max_buckets'], idle_seconds)
+        else:
+            store = MemoryBucketStore(settings['max_buckets'])
+        return cls(limits, store, settings['max_concurrent_requests'],
+                   settings['concurrency_exempt'], settings['enabled'])
+
+    def admit(self, method, rule, client):
+        """None if the request may go ahead (release(rule) once it is done),
+        otherwise (error, retry_after_seconds) for a 429.
+        client() is called only for rate-limited routes."""
+        if not self.enabled:
+            return None
+        counted = self._counted(rule)
+        if counted:
+            with self._lock:
+                if self.in_flight >= self.max_concurrent:
+                    self.shed += 1
+                    return 'Server is busy, please retry shortly', 1
+                self.in_flight += 1
+
+        limit = self.limits.get((method, rule))
+        if limit is None:
+            return None
+        try:
+            wait = self.store.take(f"{method} {rule}|{client()}", limit[0], limit[1], time.time())
+        except Exception as e:
+            logger.error("Rate limit store error, admitting request: %s", e)
+            return None
+        if not wait:
+            return None
+
+        with self._lock:
+            self.throttled += 1
+        if counted:
+            self.release(rule)
+        return 'Too many requests, please retry later', max(1, math.ceil(wait))
+
+    def release(self, rule):
+        if self._counted(rule):
+            with self._lock:
+                self.in_flight -= 1
+
+    def _counted(self, rule):
+        return self.enabled and self.max_concurrent and rule not in self.exempt
+
+    def stats(self):
+        return {
+            'in_flight': self.in_flight,
+            'shed': self.shed,
+            'throttled': self.throttled,
+            'buckets': self.store.size(),
+            'evicted': self.store.evicted
+        }
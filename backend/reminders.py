@@ -0,0 +1,178 @@
+"""
+Appointment Reminder Scheduler
+
+Keeps upcoming Pending/Confirmed appointments in a heap ordered by reminder
+time and sends each reminder when it falls due. The heap is loaded once with
+a date-range query, extended one day at a time as the clock moves, and kept
+current by FirebaseDB write events, so the collection is never polled.
+"""
+import heapq
+import os
+import threading
+from datetime import datetime, timedelta
+
+ACTIVE_STATUSES = ('Pending', 'Confirmed')
+
+
+def appointment_start(appointment):
+    """Appointment start as a datetime, or None if the date/time are unusable"""
+    try:
+        return datetime.strptime(
+            f"{appointment.get('appointment_date')} {appointment.get('appointment_time')}",
+            '%Y-%m-%d %H:%M'
+        )
+    except (TypeError, ValueError):
+        return None
+
+
+class ReminderScheduler:
+    def __init__(self, database, notification_service, reminder_hours):
+        self.database = database
+        self.notification_service = notification_service
+        self.lead_time = timedelta(hours=reminder_hours)
+
+        self._heap = []            # (fire_at, appointment_id)
+        self._scheduled = {}       # appointment_id -> fire_at of its live heap entry
+        self._loaded_through = None
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        self.stats = {'scheduled': 0, 'sent': 0, 'skipped': 0, 'errors': 0}
+
+    # ============ LIFECYCLE ============
+
+    def start(self):
+        """Load the upcoming window and start the timer thread (once per process)"""
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            self._heap = []
+            self._scheduled = {}
+            self._loaded_through = None
+            self._stopping = False
+            self._pid = os.getpid()
+        self.database.add_listener(self)
+        self._extend_window(datetime.now(), missed=True)
+        self._thread = threading.Thread(target=self._run, name='reminder-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+
+    def _extend_window(self, now, missed=False):
+        """Load every date whose reminders can fall due before tomorrow"""
+        last_date = (now + self.lead_time + timedelta(days=1)).date()
+        first_date = now.date() if self._loaded_through is None else self._loaded_through + timedelta(days=1)
+        if first_date > last_date:
+            return
+        result = self.database.get_upcoming_appointments(
+            first_date.strftime('%Y-%m-%d'),
+            last_date.strftime('%Y-%m-%d')
+        )
+        if not result['success']:
+            print(f"Reminder window load failed: {result['error']}")
+            return
+        with self._cond:
+            self._loaded_through = last_date
+            for appointment in result['data']:
+                self._schedule(appointment['id'], appointment, now, missed)
+            self._cond.notify()
+
+    # ============ APPOINTMENT EVENTS ============
+
+    def appointment_created(self, appointment_id, appointment):
+        with self._cond:
+            self._schedule(appointment_id, appointment, datetime.now(), missed=False)
+            self._cond.notify()
+
+    def appointment_updated(self, appointment_id, appointment):
+        with self._cond:
+            if appointment.get('status') in ACTIVE_STATUSES:
+                self._schedule(appointment_id, appointment, datetime.now(), missed=False)
+            else:
+                self._scheduled.pop(appointment_id, None)
+            self._cond.notify()
+
+    def appointment_deleted(self, appointment_id, appointment):
+        with self._cond:
+            self._scheduled.pop(appointment_id, None)
+
+    def _schedule(self, appointment_id, appointment, now, missed):
+        """Queue a reminder; callers hold the lock.
+
+        Reminders already past due are only queued for a window load
+        (missed=True), i.e. ones this process may have slept through; a booking
+        made inside the lead time gets its confirmation and no reminder.
+        """
+        if appointment.get('status') not in ACTIVE_STATUSES or appointment_id in self._scheduled:
+            return
+        start = appointment_start(appointment)
+        if start is None or start <= now:
+            return
+        if self._loaded_through is None or start.date() > self._loaded_through:
+            return
+        fire_at = start - self.lead_time
+        if fire_at <= now and not missed:
+            return
+        self._scheduled[appointment_id] = fire_at
+        heapq.heappush(self._heap, (fire_at, appointment_id))
+        self.stats['scheduled'] += 1
+
+    # ============ TIMER THREAD ============
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stopping:
+                    return
+                due = self._pop_due(datetime.now())
+                if not due:
+                    now = datetime.now()
+                    # Wake for the next reminder, or at midnight to load a new day
+                    wake_at = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+                    if self._heap:
+                        wake_at = min(wake_at, self._heap[0][0])
+                    self._cond.wait(max((wake_at - now).total_seconds(), 0.01))
+                    if self._stopping:
+                        return
+                    due = self._pop_due(datetime.now())
+
+            self._extend_window(datetime.now())
+            for appointment_id in due:
+                self._send(appointment_id)
+
+    def _pop_due(self, now):
+        """Remove and return ids whose reminder time has come; callers hold the lock"""
+        due = []
+        while self._heap and (self._heap[0][0] <= now or
+                              self._scheduled.get(self._heap[0][1]) != self._heap[0][0]):
+            fire_at, appointment_id = heapq.heappop(self._heap)
+            # Entries for cancelled or deleted appointments are skipped lazily
+            if self._scheduled.get(appointment_id) == fire_at:
+                del self._scheduled[appointment_id]
+                due.append(appointment_id)
+        return due
+
+    def _send(self, appointment_id):
+        """Send one reminder if it is still wanted and no other worker has sent it"""
+        try:
+            # Uncached: a cancellation in another worker must stop the reminder
+            result = self.database.get_appointment_by_id(appointment_id, fresh=True)
+            if not result['success'] or result['data'].get('status') not in ACTIVE_STATUSES:
+                self.stats['skipped'] += 1
+                return
+            if not self.database.claim_reminder(appointment_id):
+                self.stats['skipped'] += 1
+                return
+            self.notification_service.send_reminder(result['data'])
+            self.stats['sent'] += 1
+        except Exception as e:
+            self.stats['errors'] += 1
+            print(f"Reminder error for {appointment_id}: {e}")
+
+    def reminder_stats(self):
+        with self._cond:
+            return dict(self.stats, pending=len(self._scheduled))
@@ -0,0 +1,194 @@
+"""
+Service Schedules
+
+Each service's bookable slots, compiled once from APP_SETTINGS and the optional
+schedule file (APP_SETTINGS['schedule_file'], JSON) into immutable tables.
+Availability and admission look a service's table up instead of building the
+day's slot list on every request. The file is checked for changes at most every
+schedule_check_seconds, and a changed file is compiled into a new set of tables
+that replaces the old one in a single assignment, so a request sees either the
+old schedules or the new ones, never a mix. A file that fails to compile is
+logged and the current tables are kept.
+
+The file holds "default" settings and per-service overrides:
+
+    {
+      "default": {"open": "09:00", "close": "17:00", "slot_minutes": 30,
+                  "breaks": [["13:00", "14:00"]], "closed_weekdays": ["sun"],
+                  "holidays": ["2026-12-25"], "slot_capacity": 1, "max_per_day": 20},
+      "services": {"Hospital": {"open": "08:00", "close": "20:00", "slot_minutes": 15,
+                                "slot_capacity": 4, "max_per_day": 150}}
+    }
+
+A service's settings override the defaults, except holidays, which are added
+to the default ones.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import date
+
+from config import APP_SETTINGS
+
+WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+SETTINGS = ('open', 'close', 'slot_minutes', 'breaks', 'closed_weekdays', 'holidays',
+            'slot_capacity', 'max_per_day')
+
+logger = logging.getLogger(__name__)
+
+
+def _minutes(value):
+    """'HH:MM' -> minutes after midnight"""
+    hours, minutes = str(value).split(':')
+    total = int(hours) * 60 + int(minutes)
+    if not 0 <= total <= 24 * 60:
+        raise ValueError(f"Invalid time of day: {value}")
+    return total
+
+
+def _weekday(value):
+    if isinstance(value, int) and 0 <= value < 7:
+        return value
+    if str(value).lower()[:3] in WEEKDAYS:
+        return WEEKDAYS.index(str(value).lower()[:3])
+    raise ValueError(f"Invalid weekday: {value}")
+
+
+class ServiceSchedule:
+    """One service's compiled schedule"""
+    __slots__ = ('slot_times', '_slot_set', 'closed_weekdays', 'holidays', 'slot_capacity', 'max_per_day')
+
+    def __init__(self, settings):
+        open_at, close_at = _minutes(settings['open']), _minutes(settings['close'])
+        length = int(settings['slot_minutes'])
+        if length <= 0 or open_at >= close_at:
+            raise ValueError('A schedule needs open < close and slot_minutes > 0')
+        breaks = [(_minutes(start), _minutes(end)) for start, end in settings.get('breaks') or ()]
+
+        # Slots start every slot_minutes, end by closing time and miss every break
+        slot_times = []
+        for start in range(open_at, close_at - length + 1, length):
+            if not any(start < break_end and start + length > break_start for break_start, break_end in breaks):
+                slot_times.append(f"{start // 60:02d}:{start % 60:02d}")
+
+        self.slot_times = tuple(slot_times)
+        self._slot_set = frozenset(slot_times)
+        self.closed_weekdays = frozenset(_weekday(day) for day in settings.get('closed_weekdays') or ())
+        self.holidays = frozenset(date.fromisoformat(day).isoformat() for day in settings.get('holidays') or ())
+        self.slot_capacity = int(settings['slot_capacity'])
+        self.max_per_day = int(settings['max_per_day'] or 0)
+
+    def is_open(self, appointment_date):
+        """False on holidays and closed weekdays (appointment_date is 'YYYY-MM-DD')"""
+        try:
+            weekday = date.fromisoformat(appointment_date).weekday()
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid appointment date: {appointment_date}")
+        return appointment_date not in self.holidays and weekday not in self.closed_weekdays
+
+    def times_on(self, appointment_date):
+        """The date's slot times (none when closed)"""
+        return self.slot_times if self.is_open(appointment_date) else ()
+
+    def is_bookable(self, appointment_date, appointment_time):
+        return appointment_time in self._slot_set and self.is_open(appointment_date)
+
+
+def compile_schedules(config, defaults):
+    """{service_type or None (everything else): ServiceSchedule} from a schedule
+    file's contents and the default settings"""
+    config = config or {}
+    unknown = set(config) - {'default', 'services'}
+    if unknown:
+        raise ValueError(f"Unknown schedule sections: {', '.join(sorted(unknown))}")
+
+    sections = dict(config.get('services') or {})
+    sections[None] = config.get('default') or {}
+    for service_type, overrides in sections.items():
+        unknown = set(overrides) - set(SETTINGS)
+        if unknown:
+            raise ValueError(f"Unknown settings for {service_type or 'default'}: {', '.join(sorted(unknown))}")
+
+    base = dict(defaults, **sections.pop(None))
+    tables = {None: ServiceSchedule(base)}
+    for service_type, overrides in sections.items():
+        settings = dict(base, **overrides)
+        settings['holidays'] = list(base.get('holidays') or ()) + list(overrides.get('holidays') or ())
+        tables[service_type] = ServiceSchedule(settings)
+    return tables
+
+
+class ScheduleRegistry:
+    def __init__(self, path, defaults, check_seconds=5):
+        self.path = path
+        self.defaults = defaults
+        self.check_seconds = check_seconds
+        self._version = None            # (mtime_ns, size) of the file last read
+        self._checked_at = time.monotonic()
+        self._reload_lock = threading.Lock()
+        self._tables = compile_schedules(None, defaults)
+        try:
+            self.reload()
+        except Exception as e:
+            print(f"Schedule file error ({path}): {e}")
+
+    @classmethod
+    def from_settings(cls):
+        return cls(APP_SETTINGS['schedule_file'], {
+            'open': f"{APP_SETTINGS['business_hours_start']:02d}:00",
+            'close': f"{APP_SETTINGS['business_hours_end']:02d}:00",
+            'slot_minutes': APP_SETTINGS['slot_duration_minutes'],
+            'slot_capacity': APP_SETTINGS['slot_capacity'],
+            'max_per_day': APP_SETTINGS['max_appointments_per_day'],
+        }, APP_SETTINGS['schedule_check_seconds'])
+
+    def for_service(self, service_type):
+        """The service's ServiceSchedule (the default one for unlisted services)"""
+        if self.check_seconds and time.monotonic() - self._checked_at >= self.check_seconds:
+            self._check()
+        tables = self._tables
+        return tables.get(service_type) or tables[None]
+
+    def _check(self):
+        # One thread checks; the others carry on with the current tables
+        if not self._reload_lock.acquire(blocking=False):
+            return
+        try:
+            self._checked_at = time.monotonic()
+            self._reload_locked()
+        except Exception as e:
+            logger.error("Schedule reload failed, keeping the current schedules: %s", e)
+        finally:
+            self._reload_lock.release()
+
+    def reload(self):
+        """Compile the schedule file if it changed since the last compile;
+        True when new tables were installed. Errors are raised."""
+        with self._reload_lock:
+            return self._reload_locked()
+
+    def _reload_locked(self):
+        try:
+            stat = os.stat(self.path)
+            version = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            version = None
+        if version == self._version:
+            return False
+        # A file that fails to compile is not retried until it changes again
+        self._version = version
+
+        config = None
+        if version is not None:
+            with open(self.path, encoding='utf-8') as f:
+                config = json.load(f)
+        tables = compile_schedules(config, self.defaults)
+        self._tables = tables
+        logger.info("Schedules loaded from %s (%s services)", self.path, len(tables) - 1)
+        return True
+
+
+schedules = ScheduleRegistry.from_settings()
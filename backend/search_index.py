@@ -0,0 +1,381 @@
+"""
+Appointment Search Index
+
+An in-memory prefix index over client name, email, phone and appointment
+number for staff lookups (/api/appointments/search). It answers a query with
+a few bisections of a sorted token list instead of a scan.
+
+The index is loaded page by page through the store's get_changes, then kept
+current from this process's write listeners and, at most every
+refresh_seconds, from get_changes again (which brings in other workers'
+writes and deletes). There is no listener on the whole collection.
+
+Memory is kept compact: each appointment is one tuple in a list and is
+referred to by its position (its slot); a token's postings are one int
+(slot << 3 | field weight) or an array of them; phone numbers are matched as
+substrings of one bytearray of digits rather than through suffix tokens.
+Replaced and removed appointments leave dead slots, which are skipped and
+dropped in one pass once they outnumber the live ones. This is about 1 KB
+per appointment per worker.
+"""
+import heapq
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+
+# Token changes in one update above which the sorted token list is rebuilt in
+# one pass rather than edited token by token
+REBUILD_ABOVE = 64
+
+# Once this few appointments match the terms so far, the remaining terms are
+# checked against each one's fields instead of walking their postings
+CANDIDATE_CHECK_BELOW = 2000
+
+# Dead slots are dropped once there are more of them than this and than live ones
+COMPACT_ABOVE = 1000
+
+# Appointments read per get_changes call while loading and refreshing
+LOAD_PAGE_SIZE = 1000
+
+# Relative weight of a match in each field; an exact token match counts double
+FIELD_WEIGHTS = {
+    'appointment_number': 4,
+    'client_name': 3,
+    'client_phone': 2,
+    'client_email': 1,
+}
+
+# Kept per appointment and returned with each result
+RESULT_FIELDS = (
+    'id', 'appointment_number', 'client_name', 'client_email', 'client_phone',
+    'service_type', 'appointment_date', 'appointment_time', 'status'
+)
+
+# Few distinct values: one shared string each
+_INTERNED = ('service_type', 'appointment_date', 'appointment_time', 'status')
+
+# Fields matched through the token index (the phone is matched by its digits)
+_WORD_FIELDS = tuple((RESULT_FIELDS.index(field), weight)
+                     for field, weight in FIELD_WEIGHTS.items() if field != 'client_phone')
+_PHONE = RESULT_FIELDS.index('client_phone')
+_SERVICE_TYPE = RESULT_FIELDS.index('service_type')
+_STATUS = RESULT_FIELDS.index('status')
+_DATE = RESULT_FIELDS.index('appointment_date')
+
+_WORD = re.compile(r'[^\W_]+')
+
+logger = logging.getLogger(__name__)
+
+
+def _words(value):
+    return set(_WORD.findall(str(value).lower())) if value else set()
+
+
+def _digits(value):
+    return re.sub(r'\D', '', str(value)) if value else ''
+
+
+def _row(appointment_id, appointment):
+    """The tuple kept for an appointment, in RESULT_FIELDS order"""
+    values = []
+    for field in RESULT_FIELDS:
+        value = appointment_id if field == 'id' else appointment.get(field)
+        if field in _INTERNED and isinstance(value, str):
+            value = sys.intern(value)
+        values.append(value)
+    return tuple(values)
+
+
+def query_terms(q):
+    """Search terms in q: words, plus digit runs with separators removed
+    (so '555-01' matches the phone 5550123)"""
+    q = (q or '').lower()
+    terms = set(_WORD.findall(q))
+    digits = re.sub(r'[\s().+-]', '', q)
+    if digits.isdigit():
+        terms = {digits}
+    return sorted(terms)
+
+
+class AppointmentSearchIndex:
+    def __init__(self, store, ready_timeout=10, refresh_seconds=5):
+        self.store = store
+        self.ready_timeout = ready_timeout
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._pid = None
+        self._reset()
+        self._ready = threading.Event()
+        self._watermark = None
+        self._refreshed_at = 0
+
+    def _reset(self):
+        self._rows = []                  # slot -> row tuple, None once replaced or removed
+        self._slots = {}                 # appointment id -> its live slot
+        self._postings = {}              # token -> slot << 3 | weight, or an array of them
+        self._sorted = []                # every token, sorted
+        self._phones = bytearray()       # each slot's phone digits, one line per slot
+
+    # ============ MAINTENANCE ============
+
+    def start(self):
+        """Start loading the index and following writes (once per process)"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # A forked child loads its own copy
+            self._pid = os.getpid()
+            self._reset()
+            self._ready = threading.Event()
+            self._watermark = None
+            self.store.add_listener(self)
+        threading.Thread(target=self._load, name='search-index-load', daemon=True).start()
+
+    def stop(self):
+        with self._lock:
+            self.store.remove_listener(self)
+            self._pid = None
+
+    def _load(self):
+        try:
+            with self._refresh_lock:
+                self._refresh()
+            self._ready.set()
+        except Exception as e:
+            logger.error("Search index load error: %s", e)
+            self.stop()     # the next search starts over
+
+    def refresh(self):
+        """Apply writes made since the last refresh (by any worker)"""
+        if not self._refresh_lock.acquire(blocking=False):
+            return      # another thread is refreshing
+        try:
+            self._refresh()
+        finally:
+            self._refresh_lock.release()
+
+    def _refresh(self):
+        while True:
+            result = self.store.get_changes(since=self._watermark, limit=LOAD_PAGE_SIZE)
+            if result.get('expired'):
+                # Deletes older than the tombstones may be missing: load afresh
+                with self._lock:
+                    self._reset()
+                self._watermark = None
+                continue
+            if not result['success']:
+                raise RuntimeError(result['error'])
+
+            changes = [('modified', appt['id'], appt) for appt in result['data']]
+            changes.extend(('removed', appointment_id, None) for appointment_id in result['deleted'])
+            self.apply(changes)
+            self._watermark = result['watermark']
+            if not result['has_more']:
+                break
+        self._refreshed_at = time.monotonic()
+
+    def appointment_created(self, appointment_id, appointment):
+        self.apply([('added', appointment_id, appointment)])
+
+    def appointment_updated(self, appointment_id, appointment):
+        self.apply([('modified', appointment_id, appointment)])
+
+    def appointment_deleted(self, appointment_id, appointment):
+        self.apply([('removed', appointment_id, None)])
+
+    def apply(self, changes):
+        """Index (kind, appointment_id, appointment) changes; kind 'removed' drops it"""
+        with self._lock:
+            if self._pid != os.getpid():
+                return      # not started in this process
+            added = set()   # tokens given their first posting
+            for kind, appointment_id, appointment in changes:
+                if kind == 'removed':
+                    self._remove(appointment_id)
+                else:
+                    self._add(appointment_id, appointment, added)
+            self._update_sorted(added)
+            if len(self._rows) - len(self._slots) > max(COMPACT_ABOVE, len(self._slots)):
+                self._compact()
+
+    def _update_sorted(self, added):
+        if len(added) > REBUILD_ABOVE:
+            self._sorted.extend(sorted(added))
+            self._sorted.sort()     # two sorted runs: merged in linear time
+            return
+        for token in added:
+            insort(self._sorted, token)
+
+    def _add(self, appointment_id, appointment, added):
+        row = _row(appointment_id, appointment)
+        slot = self._slots.get(appointment_id)
+        if slot is not None:
+            old = self._rows[slot]
+            if all(old[i] == row[i] for i, _ in _WORD_FIELDS) and old[_PHONE] == row[_PHONE]:
+                self._rows[slot] = row      # nothing indexed changed (a status update)
+                return
+            self._rows[slot] = None
+
+        slot = len(self._rows)
+        self._rows.append(row)
+        self._slots[appointment_id] = slot
+        self._phones += _digits(row[_PHONE]).encode() + b'\n'
+
+        weights = {}
+        for i, weight in _WORD_FIELDS:
+            for token in _words(row[i]):
+                weights[token] = max(weights.get(token, 0), weight)
+        for token, weight in weights.items():
+            entry = slot << 3 | weight
+            posting = self._postings.get(token)
+            if posting is None:
+                self._postings[token] = entry
+                added.add(token)
+            elif isinstance(posting, int):
+                self._postings[token] = array('q', (posting, entry))
+            else:
+                posting.append(entry)
+
+    def _remove(self, appointment_id):
+        slot = self._slots.pop(appointment_id, None)
+        if slot is not None:
+            self._rows[slot] = None
+
+    def _compact(self):
+        """Re-index the live appointments, dropping dead slots and unused tokens"""
+        rows = [row for row in self._rows if row is not None]
+        self._reset()
+        added = set()
+        for row in rows:
+            self._add(row[0], dict(zip(RESULT_FIELDS, row)), added)
+        self._sorted = sorted(added)
+
+    # ============ QUERIES ============
+
+    def _postings_for(self, token):
+        posting = self._postings[token]
+        return (posting,) if isinstance(posting, int) else posting
+
+    def _phone_matches(self, term):
+        """(slot, exact) for each phone whose digits contain term; exact if they end with it"""
+        needle = term.encode()
+        phones = self._phones
+        slot, counted = 0, 0
+        at = phones.find(needle)
+        while at != -1:
+            # Matches come in order, so the slot is found by counting the lines passed
+            slot += phones.count(b'\n', counted, at)
+            counted = at
+            yield slot, phones[at + len(needle)] == ord('\n')
+            at = phones.find(needle, at + 1)
+
+    def _term_scores(self, term):
+        """slot -> best score for one term (exact matches score double)"""
+        scores = {}
+        best = scores.get
+        tokens = self._sorted
+        i = bisect_left(tokens, term)
+        while i < len(tokens) and tokens[i].startswith(term):
+            factor = 2 if tokens[i] == term else 1
+            if not scores:
+                scores = {entry >> 3: (entry & 7) * factor for entry in self._postings_for(tokens[i])}
+                best = scores.get
+            else:
+                for entry in self._postings_for(tokens[i]):
+                    score = (entry & 7) * factor
+                    if score > best(entry >> 3, 0):
+                        scores[entry >> 3] = score
+            i += 1
+        if term.isdigit():
+            for slot, exact in self._phone_matches(term):
+                score = FIELD_WEIGHTS['client_phone'] * (2 if exact else 1)
+                if score > best(slot, 0):
+                    scores[slot] = score
+        if len(self._rows) > len(self._slots):
+            rows = self._rows
+            scores = {slot: score for slot, score in scores.items() if rows[slot] is not None}
+        return scores
+
+    def _candidate_score(self, slot, term):
+        """_term_scores for one appointment (0 if the term does not match it)"""
+        row = self._rows[slot]
+        best = 0
+        for i, weight in _WORD_FIELDS:
+            if not row[i] or term not in str(row[i]).lower():
+                continue
+            for token in _words(row[i]):
+                if token.startswith(term):
+                    best = max(best, weight * (2 if token == term else 1))
+        if term.isdigit():
+            digits = _digits(row[_PHONE])
+            if term in digits:
+                best = max(best, FIELD_WEIGHTS['client_phone'] * (2 if digits.endswith(term) else 1))
+        return best
+
+    def search(self, q, service_type=None, status=None, limit=20, offset=0):
+        """Appointments matching every term of q as a prefix, best matches first
+        (then by appointment_date, latest first)"""
+        try:
+            self.start()
+            if not self._ready.wait(self.ready_timeout):
+                return {'success': False, 'loading': True, 'error': 'Search index is still loading'}
+
+            terms = query_terms(q)
+            if not terms:
+                return {'success': False, 'error': 'q is required'}
+
+            if time.monotonic() - self._refreshed_at >= self.refresh_seconds:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.error("Search index refresh error: %s", e)   # answer from what is indexed
+
+            with self._lock:
+                # Longest (most selective) term first
+                terms = sorted(terms, key=len, reverse=True)
+                scores = self._term_scores(terms[0])
+                for term in terms[1:]:
+                    if not scores:
+                        break
+                    if len(scores) < CANDIDATE_CHECK_BELOW:
+                        scores = {slot: score + term_score
+                                  for slot, score in scores.items()
+                                  for term_score in (self._candidate_score(slot, term),)
+                                  if term_score}
+                    else:
+                        term_scores = self._term_scores(term)
+                        scores = {slot: score + term_scores[slot]
+                                  for slot, score in scores.items() if slot in term_scores}
+
+                rows = self._rows
+                if service_type or status:
+                    scores = {slot: score for slot, score in scores.items()
+                              if (not service_type or rows[slot][_SERVICE_TYPE] == service_type)
+                              and (not status or rows[slot][_STATUS] == status)}
+                date = _DATE
+                matches = [(score, rows[slot][date] or '', slot) for slot, score in scores.items()]
+                page = heapq.nlargest(offset + limit, matches)[offset:]
+                data = [dict(zip(RESULT_FIELDS, rows[slot]), score=score) for score, _, slot in page]
+
+            return {
+                'success': True,
+                'data': data,
+                'total': len(matches),
+                'next_offset': offset + limit if offset + limit < len(matches) else None
+            }
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    def stats(self):
+        with self._lock:
+            return {
+                'appointments': len(self._slots),
+                'dead_slots': len(self._rows) - len(self._slots),
+                'tokens': len(self._sorted)
+            }
@@ -0,0 +1,83 @@
+"""
+Block-Leased Sequences
+
+Appointment numbers end in a per-day sequence number. Each process leases a
+block of numbers from a counter in the store (one write per block), hands
+them out from memory, and leases the next block in the background before the
+current one runs out, so a booking does not wait on the store. Blocks never
+overlap, so numbers are unique across processes; numbers left over when a
+process exits or the day changes are skipped, so a day's sequence has gaps.
+"""
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class _Block:
+    def __init__(self):
+        self.next = 0
+        self.end = 0              # exclusive
+        self.pending = None       # (start, end) leased ahead of time
+        self.prefetching = False
+
+
+class BlockSequence:
+    """Unique integers per key from lease(key, size) -> first number of a new block"""
+
+    def __init__(self, lease, block_size, prefetch_fraction=0.2):
+        self.lease = lease
+        self.block_size = block_size
+        self.prefetch_below = max(1, int(block_size * prefetch_fraction))
+        self._blocks = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def next(self, key):
+        """The next number for `key`"""
+        with self._lock:
+            if self._pid != os.getpid():
+                # A forked child must not hand out numbers from its parent's blocks
+                self._blocks = {}
+                self._pid = os.getpid()
+            block = self._blocks.get(key)
+            if block is None:
+                # A new key (a new day) retires the others
+                self._blocks = {key: _Block()}
+                block = self._blocks[key]
+
+            if block.next >= block.end and block.pending is not None:
+                block.next, block.end = block.pending
+                block.pending = None
+            if block.next < block.end:
+                number = block.next
+                block.next += 1
+                if block.end - block.next <= self.prefetch_below and block.pending is None \
+                        and not block.prefetching:
+                    block.prefetching = True
+                    threading.Thread(target=self._prefetch, args=(key, block), daemon=True).start()
+                return number
+
+        # Out of numbers with nothing leased ahead: lease while the caller waits
+        start = self.lease(key, self.block_size)
+        with self._lock:
+            if self._blocks.get(key) is block and block.next >= block.end:
+                block.next, block.end = start + 1, start + self.block_size
+            elif self._blocks.get(key) is block and block.pending is None:
+                block.pending = (start + 1, start + self.block_size)
+        return start
+
+    def _prefetch(self, key, block):
+        try:
+            start = self.lease(key, self.block_size)
+        except Exception as e:
+            logger.error("Sequence block lease failed (%s): %s", key, e)
+            start = None
+        with self._lock:
+            block.prefetching = False
+            if start is not None and self._blocks.get(key) is block and self._pid == os.getpid():
+                if block.next >= block.end:
+                    block.next, block.end = start, start + self.block_size
+                else:
+                    block.pending = (start, start + self.block_size)
@@ -0,0 +1,152 @@
+"""
+Single-Flight Reads
+
+Identical reads made at the same time share one datastore call: the first
+caller for a key runs it and the others wait for its result. A successful
+result is also kept for window_seconds, so a burst that arrives just after
+it (a popular service opening a new date) is answered from memory.
+
+Every write made through this process bumps the write generation. That drops
+the kept results, and new callers stop joining reads that started before the
+write, so a read that follows a write in this process sees it. Writes made by
+other processes show up once the window has passed.
+"""
+import asyncio
+import copy
+import os
+import threading
+import time
+
+# Kept results above this many trigger a sweep of the expired ones
+SWEEP_ABOVE = 1000
+
+
+class _Flight:
+    """One in-flight read and the callers waiting for it"""
+    __slots__ = ('generation', 'done', 'waiters', 'result', 'error')
+
+    def __init__(self, generation, done):
+        self.generation = generation
+        self.done = done            # threading.Event, or an asyncio.Future for coroutines
+        self.waiters = 0
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, window_seconds):
+        self.window_seconds = window_seconds
+        self.generation = 0
+        self.executed = 0           # reads run
+        self.shared = 0             # callers that waited for another caller's read
+        self.cached = 0             # callers answered from a kept result
+        self._flights = {}          # key -> _Flight, for threads
+        self._async_flights = {}    # key -> _Flight, for coroutines on the event loop
+        self._results = {}          # key -> (expires_at, result)
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def do(self, key, fn):
+        """fn()'s result, shared with the threads reading the same key"""
+        flight, leader = self._join(key, self._flights, threading.Event)
+        if not isinstance(flight, _Flight):
+            return flight
+        if not leader:
+            flight.done.wait()
+            return self._outcome(flight)
+
+        try:
+            flight.result = fn()
+        except Exception as e:
+            flight.error = e
+        except BaseException:
+            # KeyboardInterrupt, SystemExit: the waiters must not block forever
+            flight.error = RuntimeError('The shared read was interrupted')
+            raise
+        finally:
+            self._finish(key, flight, self._flights)
+            flight.done.set()
+        return self._outcome(flight)
+
+    async def do_async(self, key, fn):
+        """do() for a coroutine function, shared with coroutines on this event loop"""
+        flight, leader = self._join(key, self._async_flights, asyncio.get_running_loop().create_future)
+        if not isinstance(flight, _Flight):
+            return flight
+        if not leader:
+            # A waiter that is cancelled must not cancel the read the others wait for
+            await asyncio.shield(flight.done)
+            return self._outcome(flight)
+
+        try:
+            flight.result = await fn()
+        except Exception as e:
+            flight.error = e
+        except BaseException:
+            flight.error = RuntimeError('The shared read was cancelled')
+            raise
+        finally:
+            self._finish(key, flight, self._async_flights)
+            flight.done.set_result(None)
+        return self._outcome(flight)
+
+    def _join(self, key, flights, new_done):
+        """(kept result, False), (flight, False) to wait for, or (new flight, True) to run"""
+        with self._lock:
+            if self._pid != os.getpid():
+                # A forked child must not wait on reads its parent's threads were running
+                self._flights, self._async_flights, self._results = {}, {}, {}
+                self._pid = os.getpid()
+
+            kept = self._results.get(key)
+            if kept is not None and kept[0] > time.monotonic():
+                self.cached += 1
+                return copy.deepcopy(kept[1]), False
+
+            flight = flights.get(key)
+            if flight is not None and flight.generation == self.generation:
+                flight.waiters += 1
+                self.shared += 1
+                return flight, False
+
+            flight = flights[key] = _Flight(self.generation, new_done())
+            self.executed += 1
+            return flight, True
+
+    def _finish(self, key, flight, flights):
+        # Failures are shared with the callers already waiting, but not kept
+        failed = flight.error is not None or \
+            (isinstance(flight.result, dict) and flight.result.get('success') is False)
+        kept = None if failed or self.window_seconds <= 0 else copy.deepcopy(flight.result)
+        with self._lock:
+            if flights.get(key) is flight:
+                del flights[key]
+            if not failed and self.window_seconds > 0 and flight.generation == self.generation:
+                now = time.monotonic()
+                if len(self._results) >= SWEEP_ABOVE:
+                    self._results = {k: entry for k, entry in self._results.items() if entry[0] > now}
+                self._results[key] = (now + self.window_seconds, kept)
+
+    def _outcome(self, flight):
+        # Each caller gets its own copy, so it can change the result freely
+        if flight.error is not None:
+            raise flight.error
+        return copy.deepcopy(flight.result)
+
+    def invalidate(self):
+        """After a write: drop kept results and start new reads afresh"""
+        with self._lock:
+            self.generation += 1
+            self._results = {}
+
+    def stats(self):
+        with self._lock:
+            flights = list(self._flights.values()) + list(self._async_flights.values())
+            return {
+                'in_flight': len(flights),
+                'waiting': sum(flight.waiters for flight in flights),
+                'kept': len(self._results),
+                'executed': self.executed,
+                'shared': self.shared,
+                'cached': self.cached
+            }
@@ -0,0 +1,170 @@
+"""
+In-process Slot Occupancy Index
+
+Keeps, per (service_type, appointment_date), the number of active bookings in
+each time slot so availability checks can be answered from memory instead of a
+Firestore query. (Admission itself is checked against the day's capacity
+counter document.)
+
+A day is loaded from a query that runs outside the lock. Changes this process
+makes to the day while the query runs (add, set_status, remove) are recorded
+against the load (begin_load) and replayed onto its result, so a result read
+before them does not undo them.
+"""
+import threading
+import time
+from datetime import datetime
+
+ACTIVE_STATUSES = ('Pending', 'Confirmed')
+
+
+class _DayOccupancy:
+    """Occupancy of one service on one date"""
+    __slots__ = ('counts', 'members', 'loaded_at')
+
+    def __init__(self):
+        self.counts = {}         # appointment_time -> active booking count
+        self.members = {}        # appointment_id -> [appointment_time, status]
+        self.loaded_at = time.monotonic()
+
+
+class SlotOccupancyIndex:
+    def __init__(self, ttl_seconds=0):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._days = {}           # (service_type, appointment_date) -> _DayOccupancy
+        self._appointments = {}   # appointment_id -> (service_type, appointment_date)
+        self._loading = {}        # (service_type, appointment_date) -> [pending changes of each load]
+
+    # ============ LOOKUPS ============
+
+    def is_loaded(self, service_type, appointment_date):
+        """True when the day is indexed and has not expired"""
+        day = self._days.get((service_type, appointment_date))
+        if day is None:
+            return False
+        if self.ttl_seconds and time.monotonic() - day.loaded_at > self.ttl_seconds:
+            return False
+        return True
+
+    def slot_counts(self, service_type, appointment_date):
+        """appointment_time -> active bookings, for slots with any (day must be loaded)"""
+        with self._lock:
+            day = self._days.get((service_type, appointment_date))
+            return dict(day.counts) if day is not None else {}
+
+    # ============ MAINTENANCE ============
+
+    def begin_load(self, service_type, appointment_date):
+        """Call before querying a day; pass the result to load_day (or cancel_load)"""
+        pending = []
+        with self._lock:
+            self._loading.setdefault((service_type, appointment_date), []).append(pending)
+        return pending
+
+    def cancel_load(self, service_type, appointment_date, pending):
+        """Abandon a load started with begin_load"""
+        with self._lock:
+            self._end_load((service_type, appointment_date), pending)
+
+    def load_day(self, service_type, appointment_date, appointments, pending=None):
+        """Replace a day's occupancy from (appointment_id, appointment_time, status)
+        tuples, then replay the changes recorded since begin_load returned `pending`"""
+        key = (service_type, appointment_date)
+        day = _DayOccupancy()
+        for appointment_id, appointment_time, status in appointments:
+            day.members[appointment_id] = [appointment_time, status]
+            if status in ACTIVE_STATUSES:
+                self._increment(day, appointment_time, 1)
+        with self._lock:
+            if pending is not None:
+                self._end_load(key, pending)
+                for change in pending:
+                    self._apply(day, *change)
+            old = self._days.get(key)
+            if old is not None:
+                for appointment_id in old.members:
+                    self._appointments.pop(appointment_id, None)
+            self._days[key] = day
+            for appointment_id in day.members:
+                self._appointments[appointment_id] = key
+            self._prune(datetime.now().strftime('%Y-%m-%d'), keep=key)
+
+    def add(self, appointment_id, service_type, appointment_date, appointment_time, status='Pending'):
+        """Record a newly created appointment on an indexed day"""
+        key = (service_type, appointment_date)
+        with self._lock:
+            for pending in self._loading.get(key, ()):
+                pending.append(('add', appointment_id, appointment_time, status))
+            day = self._days.get(key)
+            if day is None or appointment_id in day.members:
+                return
+            self._apply(day, 'add', appointment_id, appointment_time, status)
+            self._appointments[appointment_id] = key
+
+    def set_status(self, appointment_id, new_status):
+        """Apply a status change, freeing or re-occupying the slot as needed"""
+        with self._lock:
+            # The appointment's day is not known unless it is indexed
+            self._record_pending(('status', appointment_id, new_status))
+            day = self._days.get(self._appointments.get(appointment_id))
+            if day is not None:
+                self._apply(day, 'status', appointment_id, new_status)
+
+    def remove(self, appointment_id):
+        """Forget a deleted appointment"""
+        with self._lock:
+            self._record_pending(('remove', appointment_id))
+            day = self._days.get(self._appointments.pop(appointment_id, None))
+            if day is not None:
+                self._apply(day, 'remove', appointment_id)
+
+    def _record_pending(self, change):
+        for loads in self._loading.values():
+            for pending in loads:
+                pending.append(change)
+
+    def _end_load(self, key, pending):
+        loads = [other for other in self._loading.get(key, ()) if other is not pending]
+        if loads:
+            self._loading[key] = loads
+        else:
+            self._loading.pop(key, None)
+
+    def _apply(self, day, kind, appointment_id, *args):
+        """Apply one change to a day's occupancy (changes to appointments that
+        are not on the day are ignored); callers hold the lock"""
+        if kind == 'add':
+            appointment_time, status = args
+            if appointment_id not in day.members:
+                day.members[appointment_id] = [appointment_time, status]
+                if status in ACTIVE_STATUSES:
+                    self._increment(day, appointment_time, 1)
+            return
+        member = day.members.get(appointment_id)
+        if member is None:
+            return
+        was_active = member[1] in ACTIVE_STATUSES
+        if kind == 'remove':
+            del day.members[appointment_id]
+            is_active = False
+        else:
+            member[1] = args[0]
+            is_active = args[0] in ACTIVE_STATUSES
+        if was_active and not is_active:
+            self._increment(day, member[0], -1)
+        elif is_active and not was_active:
+            self._increment(day, member[0], 1)
+
+    def _prune(self, today, keep):
+        """Drop past days other than `keep`; callers hold the lock"""
+        for key in [k for k in self._days if k[1] < today and k != keep]:
+            for appointment_id in self._days.pop(key).members:
+                self._appointments.pop(appointment_id, None)
+
+    def _increment(self, day, appointment_time, delta):
+        count = max(day.counts.get(appointment_time, 0) + delta, 0)
+        if count:
+            day.counts[appointment_time] = count
+        else:
+            day.counts.pop(appointment_time, None)
@@ -0,0 +1,208 @@
+"""
+Pooled SMTP Connections
+
+Keeps authenticated SMTP sessions open and reuses them across messages so a
+send costs one MAIL/RCPT/DATA exchange instead of connect + STARTTLS + login.
+Sessions left idle for idle_timeout are closed, by release() and by a sweep
+timer that runs while any are idle, so a quiet pool does not hold them open.
+"""
+import os
+import smtplib
+import threading
+import time
+from collections import deque
+
+
+class _PooledConnection:
+    __slots__ = ('smtp', 'messages_sent', 'last_used')
+
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.messages_sent = 0
+        self.last_used = time.monotonic()
+
+
+class SMTPConnectionPool:
+    def __init__(self, host, port, username, password, max_size=4, idle_timeout=60,
+                 max_messages_per_connection=100, noop_after=15, connect_timeout=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_messages_per_connection = max_messages_per_connection
+        self.noop_after = noop_after
+        self.connect_timeout = connect_timeout
+
+        self._cond = threading.Condition()
+        self._reset()
+
+    def _reset(self):
+        """Forget every connection; sockets inherited across fork are not ours to close"""
+        self._idle = deque()
+        self._open = 0
+        self._sweep = None          # timer closing idle sessions
+        self._pid = os.getpid()
+        self.stats = {'connects': 0, 'reuses': 0, 'reconnects': 0, 'closed': 0}
+
+    # ============ SENDING ============
+
+    def send_message(self, msg):
+        """Send on a pooled connection, reconnecting once if the session has died"""
+        conn = self._acquire()
+        try:
+            conn.smtp.send_message(msg)
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError):
+            # The message was rejected; the session itself is still usable
+            self._release(conn)
+            raise
+        except OSError:
+            # A stale session (server-side timeout, dropped socket): retry on a new one
+            self._discard(conn)
+            self._count('reconnects')
+            conn = self._acquire(fresh=True)
+            try:
+                conn.smtp.send_message(msg)
+            except Exception:
+                self._discard(conn)
+                raise
+        except Exception:
+            self._discard(conn)
+            raise
+        conn.messages_sent += 1
+        self._release(conn)
+
+    # ============ POOL MANAGEMENT ============
+
+    def _acquire(self, fresh=False):
+        """Take an idle session (checking it is still usable) or open a new one"""
+        while True:
+            conn = None
+            with self._cond:
+                if self._pid != os.getpid():
+                    self._reset()
+                if fresh and self._open < self.max_size:
+                    self._open += 1
+                elif self._idle:
+                    # Most recently used first; a fresh request recycles the oldest
+                    conn = self._idle.popleft() if fresh else self._idle.pop()
+                elif self._open < self.max_size:
+                    self._open += 1
+                else:
+                    self._cond.wait(self.connect_timeout)
+                    continue
+
+            if conn is None:
+                break
+            idle_for = time.monotonic() - conn.last_used
+            if fresh or idle_for > self.idle_timeout or \
+                    (idle_for > self.noop_after and not self._healthy(conn)):
+                self._discard(conn)
+                continue
+            self._count('reuses')
+            return conn
+
+        try:
+            smtp = self._connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+        self._count('connects')
+        return _PooledConnection(smtp)
+
+    def _count(self, name):
+        with self._cond:
+            self.stats[name] += 1
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.connect_timeout)
+        try:
+            smtp.starttls()
+            smtp.login(self.username, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        return smtp
+
+    def _healthy(self, conn):
+        try:
+            return conn.smtp.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _release(self, conn):
+        if conn.messages_sent >= self.max_messages_per_connection:
+            self._discard(conn)
+            return
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            conn.last_used = time.monotonic()
+            self._idle.append(conn)
+            self._cond.notify()
+            stale = self._take_stale(conn.last_used)
+            self._schedule_sweep()
+        for conn in stale:
+            self._discard(conn)
+
+    def close_idle(self):
+        """Close the sessions idle for longer than idle_timeout"""
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            self._sweep = None
+            stale = self._take_stale(time.monotonic())
+            self._schedule_sweep()
+        for conn in stale:
+            self._discard(conn)
+
+    def _take_stale(self, now):
+        """Remove and return the idle sessions past idle_timeout; callers hold the lock"""
+        stale = []
+        # Released sessions are appended, so the oldest are on the left
+        while self._idle and now - self._idle[0].last_used > self.idle_timeout:
+            stale.append(self._idle.popleft())
+        return stale
+
+    def _schedule_sweep(self):
+        """Run close_idle once the oldest idle session can expire; callers hold the lock"""
+        if self._sweep is not None or not self._idle:
+            return
+        delay = self._idle[0].last_used + self.idle_timeout - time.monotonic()
+        self._sweep = threading.Timer(max(delay, 0) + 1, self.close_idle)
+        self._sweep.daemon = True
+        self._sweep.start()
+
+    def _discard(self, conn):
+        """Drop a connection from the pool and close it outside the lock"""
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            self._open -= 1
+            self.stats['closed'] += 1
+            self._cond.notify()
+        try:
+            conn.smtp.quit()
+        except Exception:
+            try:
+                conn.smtp.close()
+            except Exception:
+                pass
+
+    def close_all(self):
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            idle, self._idle = list(self._idle), deque()
+            if self._sweep is not None:
+                self._sweep.cancel()
+                self._sweep = None
+        for conn in idle:
+            self._discard(conn)
+
+    def pool_stats(self):
+        with self._cond:
+            return dict(self.stats, open=self._open, idle=len(self._idle), max_size=self.max_size)
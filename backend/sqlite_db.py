@@ -0,0 +1,823 @@
+"""
+SQLite Storage Backend
+
+A local, single-site alternative to Firestore: one database file in WAL mode,
+a connection per thread, parameterised statements (compiled once and reused
+from each connection's statement cache) and composite indexes matching the
+API's lookups. Statistics and slot admission read counts tables kept by
+triggers.
+"""
+import contextlib
+import hashlib
+import hmac
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timedelta
+from config import APP_SETTINGS
+from storage import AppointmentStore, ACTIVE_STATUSES
+from access_log import count_datastore_call
+
+APPOINTMENT_COLUMNS = (
+    'id', 'appointment_number', 'service_type', 'client_name', 'client_email',
+    'client_phone', 'appointment_date', 'appointment_time', 'purpose', 'status',
+    'created_at', 'updated_at'
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS appointments (
+    id TEXT PRIMARY KEY,
+    appointment_number TEXT NOT NULL,
+    service_type TEXT NOT NULL,
+    client_name TEXT,
+    client_email TEXT,
+    client_phone TEXT,
+    appointment_date TEXT NOT NULL,
+    appointment_time TEXT NOT NULL,
+    purpose TEXT DEFAULT '',
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_appointments_slot
+    ON appointments (service_type, appointment_date, appointment_time, status);
+CREATE INDEX IF NOT EXISTS idx_appointments_date_status
+    ON appointments (appointment_date, status);
+CREATE INDEX IF NOT EXISTS idx_appointments_status_created
+    ON appointments (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_appointments_created
+    ON appointments (created_at);
+CREATE INDEX IF NOT EXISTS idx_appointments_number
+    ON appointments (appointment_number);
+CREATE INDEX IF NOT EXISTS idx_appointments_date_id
+    ON appointments (appointment_date, id);
+CREATE INDEX IF NOT EXISTS idx_appointments_updated_id
+    ON appointments (updated_at, id);
+
+CREATE TABLE IF NOT EXISTS appointment_counts (
+    service_type TEXT NOT NULL,
+    appointment_date TEXT NOT NULL,
+    status TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (service_type, appointment_date, status)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS trg_appointments_count_insert AFTER INSERT ON appointments
+BEGIN
+    INSERT INTO appointment_counts (service_type, appointment_date, status, count)
+    VALUES (NEW.service_type, NEW.appointment_date, NEW.status, 1)
+    ON CONFLICT (service_type, appointment_date, status) DO UPDATE SET count = count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_appointments_count_delete AFTER DELETE ON appointments
+BEGIN
+    UPDATE appointment_counts SET count = count - 1
+    WHERE service_type = OLD.service_type AND appointment_date = OLD.appointment_date
+      AND status = OLD.status;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_appointments_count_status AFTER UPDATE OF status ON appointments
+WHEN OLD.status IS NOT NEW.status
+BEGIN
+    UPDATE appointment_counts SET count = count - 1
+    WHERE service_type = OLD.service_type AND appointment_date = OLD.appointment_date
+      AND status = OLD.status;
+    INSERT INTO appointment_counts (service_type, appointment_date, status, count)
+    VALUES (NEW.service_type, NEW.appointment_date, NEW.status, 1)
+    ON CONFLICT (service_type, appointment_date, status) DO UPDATE SET count = count + 1;
+END;
+
+CREATE TABLE IF NOT EXISTS appointment_totals (
+    service_type TEXT NOT NULL,
+    status TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (service_type, status)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS trg_appointments_total_insert AFTER INSERT ON appointments
+BEGIN
+    INSERT INTO appointment_totals (service_type, status, count)
+    VALUES (NEW.service_type, NEW.status, 1)
+    ON CONFLICT (service_type, status) DO UPDATE SET count = count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_appointments_total_delete AFTER DELETE ON appointments
+BEGIN
+    UPDATE appointment_totals SET count = count - 1
+    WHERE service_type = OLD.service_type AND status = OLD.status;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_appointments_total_status AFTER UPDATE OF status ON appointments
+WHEN OLD.status IS NOT NEW.status
+BEGIN
+    UPDATE appointment_totals SET count = count - 1
+    WHERE service_type = OLD.service_type AND status = OLD.status;
+    INSERT INTO appointment_totals (service_type, status, count)
+    VALUES (NEW.service_type, NEW.status, 1)
+    ON CONFLICT (service_type, status) DO UPDATE SET count = count + 1;
+END;
+
+CREATE TABLE IF NOT EXISTS slot_counts (
+    service_type TEXT NOT NULL,
+    appointment_date TEXT NOT NULL,
+    appointment_time TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (service_type, appointment_date, appointment_time)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS trg_appointments_slot_insert AFTER INSERT ON appointments
+WHEN NEW.status IN ('Pending', 'Confirmed')
+BEGIN
+    INSERT INTO slot_counts (service_type, appointment_date, appointment_time, count)
+    VALUES (NEW.service_type, NEW.appointment_date, NEW.appointment_time, 1)
+    ON CONFLICT (service_type, appointment_date, appointment_time) DO UPDATE SET count = count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_appointments_slot_delete AFTER DELETE ON appointments
+WHEN OLD.status IN ('Pending', 'Confirmed')
+BEGIN
+    UPDATE slot_counts SET count = count - 1
+    WHERE service_type = OLD.service_type AND appointment_date = OLD.appointment_date
+      AND appointment_time = OLD.appointment_time;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_appointments_slot_release AFTER UPDATE OF status ON appointments
+WHEN OLD.status IN ('Pending', 'Confirmed') AND NEW.status NOT IN ('Pending', 'Confirmed')
+BEGIN
+    UPDATE slot_counts SET count = count - 1
+    WHERE service_type = OLD.service_type AND appointment_date = OLD.appointment_date
+      AND appointment_time = OLD.appointment_time;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_appointments_slot_claim AFTER UPDATE OF status ON appointments
+WHEN OLD.status NOT IN ('Pending', 'Confirmed') AND NEW.status IN ('Pending', 'Confirmed')
+BEGIN
+    INSERT INTO slot_counts (service_type, appointment_date, appointment_time, count)
+    VALUES (NEW.service_type, NEW.appointment_date, NEW.appointment_time, 1)
+    ON CONFLICT (service_type, appointment_date, appointment_time) DO UPDATE SET count = count + 1;
+END;
+
+CREATE TABLE IF NOT EXISTS reminders_sent (
+    appointment_id TEXT PRIMARY KEY,
+    sent_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS appointment_tombstones (
+    id TEXT PRIMARY KEY,
+    service_type TEXT,
+    appointment_date TEXT,
+    deleted_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tombstones_deleted_id
+    ON appointment_tombstones (deleted_at, id);
+
+CREATE TABLE IF NOT EXISTS sequences (
+    name TEXT PRIMARY KEY,
+    next INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS export_checkpoints (
+    export_id TEXT PRIMARY KEY,
+    checkpoint TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS clients (
+    uid TEXT PRIMARY KEY,
+    email TEXT NOT NULL UNIQUE,
+    name TEXT,
+    phone TEXT,
+    role TEXT NOT NULL DEFAULT 'client',
+    password_hash TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS staff (
+    uid TEXT PRIMARY KEY,
+    email TEXT NOT NULL UNIQUE,
+    name TEXT,
+    phone TEXT,
+    role TEXT,
+    password_hash TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+"""
+
+INSERT_APPOINTMENT = (
+    "INSERT INTO appointments (" + ", ".join(APPOINTMENT_COLUMNS) + ") "
+    "VALUES (" + ", ".join('?' * len(APPOINTMENT_COLUMNS)) + ")"
+)
+SELECT_APPOINTMENT = "SELECT * FROM appointments WHERE id = ?"
+# Active bookings, read from the counters the triggers keep
+SLOT_COUNT = (
+    "SELECT count FROM slot_counts WHERE service_type = ? AND appointment_date = ? "
+    "AND appointment_time = ?"
+)
+DAY_SLOT_COUNTS = (
+    "SELECT appointment_time, count FROM slot_counts WHERE service_type = ? "
+    "AND appointment_date = ? AND count > 0"
+)
+DAY_COUNT = (
+    "SELECT COALESCE(SUM(count), 0) FROM appointment_counts WHERE service_type = ? "
+    "AND appointment_date = ? AND status IN ('Pending', 'Confirmed')"
+)
+# Counts for bookings made before slot_counts existed
+BACKFILL_SLOT_COUNTS = (
+    "INSERT INTO slot_counts (service_type, appointment_date, appointment_time, count) "
+    "SELECT service_type, appointment_date, appointment_time, COUNT(*) FROM appointments "
+    "WHERE status IN ('Pending', 'Confirmed') "
+    "GROUP BY service_type, appointment_date, appointment_time"
+)
+# Totals for appointments made before appointment_totals existed
+BACKFILL_APPOINTMENT_TOTALS = (
+    "INSERT INTO appointment_totals (service_type, status, count) "
+    "SELECT service_type, status, COUNT(*) FROM appointments GROUP BY service_type, status"
+)
+PASSWORD_ITERATIONS = 200000
+
+
+class _Rows:
+    """Fully fetched result of a statement on a shared connection"""
+
+    def __init__(self, rows, rowcount):
+        self._rows = rows
+        self.rowcount = rowcount
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return self._rows
+
+    def __iter__(self):
+        return iter(self._rows)
+
+
+class _SharedConnection:
+    """One connection used by every thread, one statement or transaction at a time.
+
+    Used for ':memory:' databases, which exist only inside a single connection.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.lock = threading.RLock()
+
+    def execute(self, sql, params=()):
+        with self.lock:
+            cursor = self._conn.execute(sql, params)
+            return _Rows(cursor.fetchall(), cursor.rowcount)
+
+    def executescript(self, script):
+        with self.lock:
+            return self._conn.executescript(script)
+
+
+class SQLiteDB(AppointmentStore):
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._local = threading.local()
+        self._shared = _SharedConnection(self._connect()) if path == ':memory:' else None
+        self.initialize()
+
+    def initialize(self):
+        """Create tables, indexes and triggers"""
+        try:
+            conn = self._conn()
+            existing = {row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' "
+                "AND name IN ('slot_counts', 'appointment_totals')"
+            )}
+            conn.executescript(SCHEMA)
+            if 'slot_counts' not in existing:
+                conn.execute(BACKFILL_SLOT_COUNTS)
+            if 'appointment_totals' not in existing:
+                conn.execute(BACKFILL_APPOINTMENT_TOTALS)
+        except Exception as e:
+            print(f"SQLite initialization error: {e}")
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=30,
+            isolation_level=None,        # explicit BEGIN/COMMIT below
+            check_same_thread=False,
+            cached_statements=256
+        )
+        conn.row_factory = sqlite3.Row
+        if self.path != ':memory:':
+            conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def _conn(self):
+        """This thread's connection (opened again in a forked child).
+
+        Each use is one query or transaction, counted as one datastore call.
+        """
+        count_datastore_call()
+        if self._shared is not None:
+            return self._shared
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _write(self, fn):
+        """Run fn(conn) in an IMMEDIATE transaction (takes the write lock up front)"""
+        conn = self._conn()
+        with self._shared.lock if self._shared is not None else contextlib.nullcontext():
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(conn)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            return result
+
+    # ============ APPOINTMENT OPERATIONS ============
+
+    def create_appointment(self, service_type, client_data, appointment_data):
+        """Create a new appointment"""
+        try:
+            appointment = self.build_appointment(service_type, client_data, appointment_data)
+            appointment_id = uuid.uuid4().hex[:20]
+            self._write(lambda conn: conn.execute(INSERT_APPOINTMENT, self._row(appointment_id, appointment)))
+            return self._created(appointment_id, appointment)
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    def reserve_appointment(self, service_type, client_data, appointment_data):
+        """Atomically claim a place in a time slot and create the appointment in it"""
+        try:
+            appointment = self.build_appointment(service_type, client_data, appointment_data)
+            appointment_id = uuid.uuid4().hex[:20]
+
+            def reserve(conn):
+                refused = self._admission_error(
+                    conn, service_type, appointment['appointment_date'], appointment['appointment_time']
+                )
+                if refused is None:
+                    conn.execute(INSERT_APPOINTMENT, self._row(appointment_id, appointment))
+                return refused
+
+            refused = self._write(reserve)
+            if refused is not None:
+                return refused
+            return self._created(appointment_id, appointment)
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    def _admission_error(self, conn, service_type, appointment_date, appointment_time):
+        """admission_error from the counters (call inside the write transaction)"""
+        slot_row = conn.execute(SLOT_COUNT, (service_type, appointment_date, appointment_time)).fetchone()
+        day_count = conn.execute(DAY_COUNT, (service_type, appointment_date)).fetchone()[0]
+        return self.admission_error(
+            service_type, appointment_date, appointment_time, slot_row[0] if slot_row else 0, day_count
+        )
+
+    def _created(self, appointment_id, appointment):
+        self.notify_listeners('appointment_created', appointment_id, dict(appointment, id=appointment_id))
+        return {
+            'success': True,
+            'appointment_number': appointment['appointment_number'],
+            'appointment_id': appointment_id,
+            'data': appointment
+        }
+
+    def _row(self, appointment_id, appointment):
+        return tuple(appointment_id if c == 'id' else appointment.get(c) for c in APPOINTMENT_COLUMNS)
+
+    def get_appointments(self, service_type=None, status=None, date=None,
+                         limit=None, start_after=None, order_by=None, fields=None):
+        """Retrieve appointments with optional filters, paging and projection"""
+        try:
+            sql, params, page = self._appointments_query(
+                service_type, status, date, limit, start_after, order_by, fields
+            )
+            rows = self._conn().execute(sql, params).fetchall()
+            appointments = [self._listing_entry(row, fields, page) for row in rows]
+
+            result = {'success': True, 'data': appointments}
+            if page:
+                order_field, page_size = page
+                full_page = page_size is not None and rows and len(rows) == page_size
+                result['next_cursor'] = self.encode_cursor(
+                    order_field, rows[-1][order_field], rows[-1]['id']
+                ) if full_page else None
+            return result
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    def stream_appointments(self, service_type=None, status=None, date=None,
+                            limit=None, start_after=None, order_by=None, fields=None):
+        """Matching appointments, read from the cursor as they are consumed"""
+        sql, params, page = self._appointments_query(
+            service_type, status, date, limit, start_after, order_by, fields, capped=False
+        )
+        cursor = self._conn().execute(sql, params)
+        return (self._listing_entry(row, fields, page) for row in cursor)
+
+    def _appointments_query(self, service_type, status, date, limit, start_after, order_by, fields,
+                            capped=True):
+        """SQL for a listing; page is (order_field, page_size) when paginated, else None"""
+        where, params = [], []
+        for column, value in (('service_type', service_type), ('status', status),
+                              ('appointment_date', date)):
+            if value:
+                where.append(f"{column} = ?")
+                params.append(value)
+
+        if fields:
+            unknown = [f for f in fields if f not in APPOINTMENT_COLUMNS]
+            if unknown:
+                raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+            columns = ['id'] + [f for f in fields if f != 'id']
+        else:
+            columns = list(APPOINTMENT_COLUMNS)
+
+        page = None
+        order_sql = ''
+        if limit is not None or start_after or order_by:
+            order_field, descending = self.parse_order_by(order_by or 'created_at')
+            if order_field not in columns:
+                columns.append(order_field)
+            op, direction = ('<', 'DESC') if descending else ('>', 'ASC')
+            if start_after:
+                cursor_field, cursor_value, cursor_id = self.decode_cursor(start_after)
+                if cursor_field != order_field:
+                    raise ValueError('Cursor does not match order_by')
+                where.append(f"({order_field} {op} ? OR ({order_field} = ? AND id {op} ?))")
+                params.extend([cursor_value, cursor_value, cursor_id])
+            order_sql = f" ORDER BY {order_field} {direction}, id {direction}"
+            page_size = None
+            if limit is not None:
+                page_size = min(int(limit), APP_SETTINGS['max_page_size']) if capped else int(limit)
+                order_sql += " LIMIT ?"
+                params.append(page_size)
+            page = (order_field, page_size)
+
+        sql = f"SELECT {', '.join(columns)} FROM appointments"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        return sql + order_sql, params, page
+
+    def _listing_entry(self, row, fields, page):
+        appt = dict(row)
+        if page and fields and page[0] not in fields:
+            appt.pop(page[0], None)
+        return appt
+
+    def get_appointment_by_id(self, appointment_id, fresh=False):
+        """Get a specific appointment (always a fresh read: there is no cache)"""
+        try:
+            row = self._conn().execute(SELECT_APPOINTMENT, (appointment_id,)).fetchone()
+            if row is not None:
+                return {'success': True, 'data': dict(row)}
+            else:
+                return {'success': False, 'error': 'Appointment not found'}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    def get_appointment_by_number(self, appointment_number):
+        """Get an appointment by its appointment_number (idx_appointments_number)"""
+        try:
+            row = self._conn().execute(
+                "SELECT * FROM appointments WHERE appointment_number = ?", (appointment_number,)
+            ).fetchone()
+            if row is not None:
+                return {'success': True, 'data': dict(row)}
+            return {'success': False, 'error': 'Appointment not found'}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    def get_upcoming_appointments(self, start_date, end_date):
+        """Pending/Confirmed appointments dated start_date..end_date inclusive"""
+        try:
+            rows = self._conn().execute(
+                "SELECT * FROM appointments WHERE appointment_date BETWEEN ? AND ? "
+                "AND status IN ('Pending', 'Confirmed')",
+                (start_date, end_date)
+            ).fetchall()
+            return {'success': True, 'data': [dict(row) for row in rows]}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    def update_appointment_status(self, appointment_id, new_status):
+        """Update appointment status"""
+        try:
+            updated_at = datetime.now().isoformat()
+
+            def update(conn):
+                row = conn.execute(SELECT_APPOINTMENT, (appointment_id,)).fetchone()
+                if row is None:
+                    return None, None
+                current = dict(row)
+                if new_status in ACTIVE_STATUSES and current['status'] not in ACTIVE_STATUSES:
+                    # Reactivating takes a place in the slot again
+                    refused = self._admission_error(
+                        conn, current['service_type'], current['appointment_date'], current['appointment_time']
+                    )
+                    if refused is not None:
+                        return current, refused
+                conn.execute(
+                    "UPDATE appointments SET status = ?, updated_at = ? WHERE id = ?",
+                    (new_status, updated_at, appointment_id)
+                )
+                current.update({'status': new_status, 'updated_at': updated_at})
+                return current, None
+
+            current, refused = self._write(update)
+            if current is None:
+                return {'success': False, 'error': 'Appointment not found'}
+            if refused is not None:
+                return refused
+
+            self.notify_listeners('appointment_updated', appointment_id, dict(current))
+            return {
+                'success': True,
+                'message': f'Appointment updated to {new_status}',
+                'data': current
+            }
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    def delete_appointment(self, appointment_id):
+        """Delete/cancel an appointment"""
+        try:
+            def delete(conn):
+                row = conn.execute(SELECT_APPOINTMENT, (appointment_id,)).fetchone()
+                if row is not None:
+                    conn.execute("DELETE FROM appointments WHERE id = ?", (appointment_id,))
+                    tombstone = self.tombstone(appointment_id, dict(row))
+                    conn.execute(
+                        "INSERT OR REPLACE INTO appointment_tombstones "
+                        "(id, service_type, appointment_date, deleted_at) VALUES (?, ?, ?, ?)",
+                        (tombstone['id'], tombstone['service_type'], tombstone['appointment_date'],
+                         tombstone['deleted_at'])
+                    )
+                    horizon = datetime.now() - timedelta(days=APP_SETTINGS['tombstone_retention_days'])
+                    conn.execute("DELETE FROM appointment_tombstones WHERE deleted_at < ?", (horizon.isoformat(),))
+                return row
+
+            row = self._write(delete)
+            if row is not None:
+                self.notify_listeners('appointment_deleted', appointment_id, dict(row))
+            return {'success': True, 'message': 'Appointment deleted'}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    def check_availability(self, service_type, appointment_date, appointment_time):
+        """Whether a slot can take another booking"""
+        try:
+            conn = self._conn()
+            slot_row = conn.execute(SLOT_COUNT, (service_type, appointment_date, appointment_time)).fetchone()
+            day_count = conn.execute(DAY_COUNT, (service_type, appointment_date)).fetchone()[0]
+            return self.slot_check(
+                service_type, appointment_date, appointment_time, slot_row[0] if slot_row else 0, day_count
+            )
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    def get_available_slots(self, service_type, appointment_date, duration_mins=30):
+        """Times with room for another booking, and each slot's remaining capacity"""
+        try:
+            conn = self._conn()
+            slot_counts = dict(conn.execute(DAY_SLOT_COUNTS, (service_type, appointment_date)).fetchall())
+            day_count = conn.execute(DAY_COUNT, (service_type, appointment_date)).fetchone()[0]
+            return self.slot_availability(service_type, appointment_date, slot_counts, day_count)
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    def claim_reminder(self, appointment_id):
+        """Record that a reminder is being sent; False if one already was"""
+        cursor = self._conn().execute(
+            "INSERT OR IGNORE INTO reminders_sent (appointment_id, sent_at) VALUES (?, ?)",
+            (appointment_id, datetime.now().isoformat())
+        )
+        return cursor.rowcount == 1
+
+    # ============ DELTA SYNC ============
+
+    def get_changed_appointments(self, after=None, service_type=None, date=None, limit=500):
+        """Appointments by (updated_at, id) after a watermark"""
+        sql, params = self._changes_query('appointments', 'updated_at', after, service_type, date, limit)
+        return [dict(row) for row in self._conn().execute(sql, params).fetchall()]
+
+    def get_tombstones(self, after=None, service_type=None, date=None, limit=500):
+        """Deleted appointments by (deleted_at, id) after a watermark"""
+        sql, params = self._changes_query('appointment_tombstones', 'deleted_at', after, service_type, date, limit)
+        return [dict(row) for row in self._conn().execute(sql, params).fetchall()]
+
+    def _changes_query(self, table, time_column, after, service_type, date, limit):
+        where, params = [], []
+        for column, value in (('service_type', service_type), ('appointment_date', date)):
+            if value:
+                where.append(f"{column} = ?")
+                params.append(value)
+        if after:
+            where.append(f"({time_column}, id) > (?, ?)")
+            params.extend(after)
+        sql = f"SELECT * FROM {table}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        params.append(limit)
+        return sql + f" ORDER BY {time_column}, id LIMIT ?", params
+
+    # ============ EXPORTS ============
+
+    def get_export_page(self, start_date, end_date, service_type=None, status=None,
+                        after=None, limit=1000):
+        """One keyset page of an export (a range scan of idx_appointments_date_id)"""
+        where = ["appointment_date BETWEEN ? AND ?"]
+        params = [start_date, end_date]
+        for column, value in (('service_type', service_type), ('status', status)):
+            if value:
+                where.append(f"{column} = ?")
+                params.append(value)
+        if after:
+            where.append("(appointment_date, id) > (?, ?)")
+            params.extend(after)
+        params.append(limit)
+
+        rows = self._conn().execute(
+            "SELECT * FROM appointments WHERE " + " AND ".join(where) +
+            " ORDER BY appointment_date, id LIMIT ?",
+            params
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def save_export_checkpoint(self, export_id, checkpoint):
+        """Store (replace) an export's progress dict"""
+        self._conn().execute(
+            "INSERT INTO export_checkpoints (export_id, checkpoint) VALUES (?, ?) "
+            "ON CONFLICT (export_id) DO UPDATE SET checkpoint = excluded.checkpoint",
+            (export_id, json.dumps(checkpoint))
+        )
+
+    def get_export_checkpoint(self, export_id):
+        """An export's progress dict, or None"""
+        row = self._conn().execute(
+            "SELECT checkpoint FROM export_checkpoints WHERE export_id = ?", (export_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    # ============ SEQUENCES ============
+
+    def lease_sequence_block(self, name, size):
+        """Reserve the next `size` numbers of a named counter"""
+        def lease(conn):
+            row = conn.execute("SELECT next FROM sequences WHERE name = ?", (name,)).fetchone()
+            start = row[0] if row is not None else 1
+            conn.execute(
+                "INSERT INTO sequences (name, next) VALUES (?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET next = excluded.next",
+                (name, start + size)
+            )
+            return start
+
+        return self._write(lease)
+
+    # ============ STATISTICS ============
+
+    def get_statistics(self, start_date=None, end_date=None):
+        """Get appointment statistics from the trigger-maintained counts tables:
+        running totals per service and status, and per-day counts for the range"""
+        try:
+            if not start_date or not end_date:
+                default_start, default_end = self.default_statistics_range()
+                start_date = start_date or default_start
+                end_date = end_date or default_end
+
+            conn = self._conn()
+            totals = {'total': 0, 'status': {}, 'service': {}}
+            for row in conn.execute(
+                "SELECT service_type, status, count FROM appointment_totals WHERE count > 0"
+            ):
+                _add_count(totals, row[0], row[1], row[2])
+
+            by_day = {}
+            count_datastore_call()
+            for row in conn.execute(
+                "SELECT appointment_date, service_type, status, count FROM appointment_counts "
+                "WHERE appointment_date BETWEEN ? AND ? AND count > 0 ORDER BY appointment_date",
+                (start_date, end_date)
+            ):
+                day = by_day.setdefault(row[0], {'total': 0, 'status': {}, 'service': {}})
+                _add_count(day, row[1], row[2], row[3])
+
+            return {
+                'success': True,
+                'total_appointments': totals['total'],
+                'pending': totals['status'].get('Pending', 0),
+                'confirmed': totals['status'].get('Confirmed', 0),
+                'completed': totals['status'].get('Completed', 0),
+                'by_status': totals['status'],
+                'by_service': totals['service'],
+                'by_day': by_day
+            }
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    def rebuild_statistics(self):
+        """Recount all appointments into the counts tables"""
+        try:
+            def rebuild(conn):
+                conn.execute("DELETE FROM slot_counts")
+                conn.execute(BACKFILL_SLOT_COUNTS)
+                conn.execute("DELETE FROM appointment_totals")
+                conn.execute(BACKFILL_APPOINTMENT_TOTALS)
+                conn.execute("DELETE FROM appointment_counts")
+                conn.execute(
+                    "INSERT INTO appointment_counts (service_type, appointment_date, status, count) "
+                    "SELECT service_type, appointment_date, status, COUNT(*) FROM appointments "
+                    "GROUP BY service_type, appointment_date, status"
+                )
+                return conn.execute("SELECT COUNT(DISTINCT appointment_date) FROM appointment_counts").fetchone()[0]
+
+            days = self._write(rebuild)
+            return {'success': True, 'message': f'Statistics rebuilt ({days} days)'}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    # ============ USER OPERATIONS ============
+
+    def create_client_user(self, email, password, name, phone):
+        """Create a new client user"""
+        return self._create_user('clients', email, password, name, phone, 'client')
+
+    def create_staff_user(self, email, password, name, phone, role):
+        """Create a new staff user"""
+        return self._create_user('staff', email, password, name, phone, role)
+
+    def _create_user(self, table, email, password, name, phone, role):
+        try:
+            uid = uuid.uuid4().hex[:28]
+            self._conn().execute(
+                f"INSERT INTO {table} (uid, email, name, phone, role, password_hash, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (uid, email, name, phone, role, _hash_password(password), datetime.now().isoformat())
+            )
+            return {'success': True, 'uid': uid}
+        except sqlite3.IntegrityError:
+            return {'success': False, 'error': 'A user with this email already exists'}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    def authenticate_user(self, email, password, user_type='client'):
+        """Check an email/password pair against the stored hash"""
+        try:
+            table = 'clients' if user_type == 'client' else 'staff'
+            row = self._conn().execute(
+                f"SELECT uid, password_hash FROM {table} WHERE email = ?", (email,)
+            ).fetchone()
+            if row is None or not _check_password(password, row['password_hash']):
+                return {'success': False, 'error': 'Invalid credentials'}
+            return {'success': True, 'uid': row['uid']}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    def get_user_by_email(self, email, user_type='client'):
+        """Get user by email"""
+        return self._get_user('email', email, user_type, include_id=True)
+
+    def get_user_by_uid(self, uid, user_type='client'):
+        """Get user by UID"""
+        return self._get_user('uid', uid, user_type)
+
+    def _get_user(self, column, value, user_type, include_id=False):
+        try:
+            table = 'clients' if user_type == 'client' else 'staff'
+            row = self._conn().execute(
+                f"SELECT uid, email, name, phone, role, created_at FROM {table} WHERE {column} = ?",
+                (value,)
+            ).fetchone()
+            if row is None:
+                return {'success': False, 'error': 'User not found'}
+            user = dict(row)
+            if include_id:
+                user['id'] = user['uid']
+            return {'success': True, 'data': user}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+
+def _add_count(counts, service_type, status, count):
+    service = counts['service'].setdefault(service_type, {'total': 0})
+    counts['total'] += count
+    counts['status'][status] = counts['status'].get(status, 0) + count
+    service['total'] += count
+    service[status] = service.get(status, 0) + count
+
+
+def _hash_password(password):
+    salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, PASSWORD_ITERATIONS)
+    return f"pbkdf2_sha256${PASSWORD_ITERATIONS}${salt.hex()}${digest.hex()}"
+
+
+def _check_password(password, stored):
+    try:
+        _, iterations, salt, digest = stored.split('$')
+        candidate = hashlib.pbkdf2_hmac('sha256', password.encode(), bytes.fromhex(salt), int(iterations))
+        return hmac.compare_digest(candidate.hex(), digest)
+    except ValueError:
+        return False
@@ -0,0 +1,249 @@
+"""
+Sharded Appointment Counters
+
+Appointment statistics are kept in a few counter documents that are updated in
+the same transaction as the appointment write, so reading them never scans the
+appointments collection. Each write picks a random shard to spread contention.
+
+The counters belong to a generation, named in the stat_meta document that every
+counter write reads in its transaction. A rebuild counts into a new generation
+while the current one stays live: writes made during the rebuild go to both,
+and each appointment notes (stat_gen) once its current state is counted in the
+new one, so the scan and the writes never count it twice. One write to
+stat_meta then switches readers to the new generation.
+"""
+import random
+from access_log import count_datastore_call
+from boot import lazy_import
+
+firestore = lazy_import('firebase_admin.firestore')
+
+SHARD_COLLECTION = 'stat_shards'
+DAY_COLLECTION = 'stat_days'
+META_COLLECTION = 'stat_meta'
+
+# Appointments counted per rebuild transaction (each one is marked, and
+# Firestore transactions are limited to 500 writes)
+REBUILD_PAGE_SIZE = 200
+
+
+class ShardedCounters:
+    def __init__(self, num_shards):
+        self.num_shards = num_shards
+
+    def meta_ref(self, db):
+        """{'generation': g} and, while a rebuild runs, 'building': its generation"""
+        return db.collection(META_COLLECTION).document('statistics')
+
+    def write_state(self, snapshot):
+        """(generation, building generation or None) from a stat_meta snapshot;
+        counter writes must read it in their transaction"""
+        if not snapshot.exists:
+            return 0, None
+        meta = snapshot.to_dict()
+        return meta.get('generation', 0), meta.get('building')
+
+    # ============ WRITES ============
+
+    def record_create(self, db, batch, appointment, state):
+        """Count a new appointment (call before the appointment is written:
+        it may mark it as counted in a generation being built)"""
+        generation, building = state
+        self._increment(db, batch, appointment, appointment.get('status'), 1, generation, total=1)
+        if building is not None:
+            self._increment(db, batch, appointment, appointment.get('status'), 1, building, total=1)
+            appointment['stat_gen'] = building
+
+    def record_status_change(self, db, batch, appointment, old_status, new_status, state):
+        """Move an appointment from one status bucket to another; returns
+        fields to write to the appointment with the change"""
+        if old_status == new_status:
+            return {}
+        generation, building = state
+        self._increment(db, batch, appointment, old_status, -1, generation)
+        self._increment(db, batch, appointment, new_status, 1, generation)
+        if building is None:
+            return {}
+        if appointment.get('stat_gen') == building:
+            self._increment(db, batch, appointment, old_status, -1, building)
+            self._increment(db, batch, appointment, new_status, 1, building)
+            return {}
+        # Not scanned yet: count its new state now, and the scan will skip it
+        self._increment(db, batch, appointment, new_status, 1, building, total=1)
+        return {'stat_gen': building}
+
+    def record_delete(self, db, batch, appointment, state):
+        """Uncount a deleted appointment"""
+        generation, building = state
+        self._increment(db, batch, appointment, appointment.get('status'), -1, generation, total=-1)
+        if building is not None and appointment.get('stat_gen') == building:
+            self._increment(db, batch, appointment, appointment.get('status'), -1, building, total=-1)
+
+    def _increment(self, db, batch, appointment, status, delta, generation, total=0):
+        service_type = appointment.get('service_type')
+        counts = {
+            'total': total,
+            'status': {status: delta},
+            'service': {service_type: {status: delta, 'total': total}}
+        }
+        days = {appointment['appointment_date']: counts} if appointment.get('appointment_date') else {}
+        self._write(db, batch, counts, days, generation)
+
+    def _write(self, db, batch, counts, days, generation):
+        """Queue counts (and per-day counts) as increments to one random shard"""
+        shard = random.randrange(self.num_shards)
+        suffix = f'@{generation}' if generation else ''
+        marker = {'generation': generation} if generation else {}
+        batch.set(db.collection(SHARD_COLLECTION).document(f"{shard}{suffix}"),
+                  dict(_increments(counts), **marker), merge=True)
+        for date, day_counts in days.items():
+            batch.set(db.collection(DAY_COLLECTION).document(f"{date}_{shard}{suffix}"),
+                      dict(_increments(day_counts), date=date, **marker), merge=True)
+
+    # ============ READS ============
+
+    def read(self, db, start_date, end_date):
+        """Sum the current generation's shards; per-day figures cover
+        start_date..end_date inclusive"""
+        count_datastore_call(3)
+        generation, _ = self.write_state(self.meta_ref(db).get())
+        totals = _empty()
+        for doc in db.collection(SHARD_COLLECTION).stream():
+            data = doc.to_dict()
+            if data.get('generation', 0) == generation:
+                _merge(totals, data)
+
+        by_day = {}
+        day_docs = db.collection(DAY_COLLECTION) \
+                     .where('date', '>=', start_date) \
+                     .where('date', '<=', end_date) \
+                     .stream()
+        for doc in day_docs:
+            data = doc.to_dict()
+            if data.get('generation', 0) == generation:
+                _merge(by_day.setdefault(data['date'], _empty()), data)
+
+        totals['by_day'] = dict(sorted(by_day.items()))
+        return totals
+
+    # ============ MAINTENANCE ============
+
+    def rebuild(self, db):
+        """Recount every appointment into a new generation and switch to it.
+
+        This is the one full scan, run to seed counters for appointments
+        created before they existed (or to repair drift). Statistics stay
+        readable, and bookings keep being counted, while it runs.
+        """
+        building = self.start_rebuild(db)
+        days = self.count_appointments(db, building)
+        self.finish_rebuild(db, building)
+        return days
+
+    def start_rebuild(self, db):
+        """Open a new generation; from now on counter writes go to it as well"""
+        meta_ref = self.meta_ref(db)
+
+        @firestore.transactional
+        def start(transaction):
+            generation, building = self.write_state(meta_ref.get(transaction=transaction))
+            # An interrupted rebuild's generation is abandoned
+            building = max(generation, building or 0) + 1
+            transaction.set(meta_ref, {'generation': generation, 'building': building})
+            return building
+
+        count_datastore_call()
+        return start(db.transaction())
+
+    def count_appointments(self, db, building):
+        """Count every appointment not yet counted in `building`; returns the
+        number of days seen"""
+        query = db.collection('appointments').order_by(firestore.FieldPath.document_id())
+
+        @firestore.transactional
+        def count_page(transaction, after):
+            page = query.start_after(after) if after is not None else query
+            docs = list(page.limit(REBUILD_PAGE_SIZE).stream(transaction=transaction))
+            counts = _empty()
+            days = {}
+            for doc in docs:
+                appointment = doc.to_dict()
+                if appointment.get('appointment_date'):
+                    seen.add(appointment['appointment_date'])
+                if appointment.get('stat_gen') == building:
+                    continue        # counted by a write made since the rebuild started
+                _add(counts, appointment)
+                if appointment.get('appointment_date'):
+                    _add(days.setdefault(appointment['appointment_date'], _empty()), appointment)
+                transaction.update(doc.reference, {'stat_gen': building})
+            if counts['total']:
+                self._write(db, transaction, counts, days, building)
+            return docs[-1] if len(docs) == REBUILD_PAGE_SIZE else None
+
+        seen = set()
+        after = None
+        while True:
+            count_datastore_call()
+            after = count_page(db.transaction(), after)
+            if after is None:
+                return len(seen)
+
+    def finish_rebuild(self, db, building):
+        """Switch readers (and writers) to `building`, then drop the other generations"""
+        meta_ref = self.meta_ref(db)
+
+        @firestore.transactional
+        def switch(transaction):
+            _, current = self.write_state(meta_ref.get(transaction=transaction))
+            if current != building:
+                raise RuntimeError('A newer statistics rebuild has started')
+            transaction.set(meta_ref, {'generation': building})
+
+        count_datastore_call()
+        switch(db.transaction())
+
+        # Firestore batches are limited to 500 writes
+        stale = [doc.reference for name in (SHARD_COLLECTION, DAY_COLLECTION)
+                 for doc in db.collection(name).stream() if doc.to_dict().get('generation', 0) != building]
+        for i in range(0, len(stale), 500):
+            batch = db.batch()
+            for ref in stale[i:i + 500]:
+                batch.delete(ref)
+            batch.commit()
+
+
+def _empty():
+    return {'total': 0, 'status': {}, 'service': {}}
+
+
+def _add(counts, appointment):
+    status = appointment.get('status')
+    statuses = counts.setdefault('status', {})
+    service = counts.setdefault('service', {}).setdefault(appointment.get('service_type'), {'total': 0})
+    counts['total'] = counts.get('total', 0) + 1
+    statuses[status] = statuses.get(status, 0) + 1
+    service['total'] += 1
+    service[status] = service.get(status, 0) + 1
+
+
+def _increments(counts):
+    """counts with each non-zero number as a Firestore increment"""
+    increments = {}
+    for key, value in counts.items():
+        if isinstance(value, dict):
+            nested = _increments(value)
+            if nested:
+                increments[key] = nested
+        elif value:
+            increments[key] = firestore.Increment(value)
+    return increments
+
+
+def _merge(into, shard):
+    into['total'] += shard.get('total', 0)
+    for status, count in (shard.get('status') or {}).items():
+        into['status'][status] = into['status'].get(status, 0) + count
+    for service_type, counts in (shard.get('service') or {}).items():
+        service = into['service'].setdefault(service_type, {})
+        for key, count in counts.items():
+            service[key] = service.get(key, 0) + count
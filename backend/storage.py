@@ -0,0 +1,437 @@
+"""
+Storage Backend Interface
+
+Every storage engine (Firestore, SQLite) implements AppointmentStore, and the
+app talks to whichever one STORAGE_CONFIG selects through `database`.
+"""
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+import base64
+import json
+import threading
+from config import APP_SETTINGS, STORAGE_CONFIG
+from schedules import schedules
+from sequences import BlockSequence
+from boot import boot_phase
+
+ACTIVE_STATUSES = ('Pending', 'Confirmed')
+
+# Fields get_appointments can order (and so paginate) by
+SORTABLE_FIELDS = (
+    'created_at', 'updated_at', 'appointment_date', 'appointment_time',
+    'appointment_number', 'client_name', 'service_type', 'status'
+)
+
+
+class AppointmentStore(ABC):
+    """Operations the API needs from a storage backend.
+
+    Methods return the usual {'success': bool, ...} result dicts.
+    """
+
+    def __init__(self):
+        self.listeners = []
+        self.appointment_numbers = BlockSequence(
+            lambda day, size: self.lease_sequence_block(f'appointment_number-{day}', size),
+            APP_SETTINGS['appointment_number_block_size']
+        )
+
+    # ============ APPOINTMENT OPERATIONS ============
+
+    @abstractmethod
+    def create_appointment(self, service_type, client_data, appointment_data):
+        """Create a new appointment"""
+
+    @abstractmethod
+    def reserve_appointment(self, service_type, client_data, appointment_data):
+        """Atomically claim a place in a time slot and create the appointment in it.
+
+        Admission checks the time against the service's schedule and the
+        slot's and the day's active booking counters against its capacities;
+        a full slot or day returns {'success': False, 'slot_taken': True, ...}."""
+
+    @abstractmethod
+    def get_appointments(self, service_type=None, status=None, date=None,
+                         limit=None, start_after=None, order_by=None, fields=None):
+        """Retrieve appointments with optional filters, paging and projection"""
+
+    @abstractmethod
+    def stream_appointments(self, service_type=None, status=None, date=None,
+                            limit=None, start_after=None, order_by=None, fields=None):
+        """Iterator over matching appointments, read as it is consumed.
+        
+        Takes get_appointments' arguments, without the page size cap. Invalid
+        arguments raise ValueError here, before anything is read.
+        """
+
+    @abstractmethod
+    def get_appointment_by_id(self, appointment_id, fresh=False):
+        """Get a specific appointment; fresh=True skips any cache and reads the datastore"""
+
+    @abstractmethod
+    def get_appointment_by_number(self, appointment_number):
+        """Get an appointment by its appointment_number, without scanning"""
+
+    @abstractmethod
+    def get_upcoming_appointments(self, start_date, end_date):
+        """Pending/Confirmed appointments dated start_date..end_date inclusive"""
+
+    @abstractmethod
+    def update_appointment_status(self, appointment_id, new_status):
+        """Update appointment status; the result carries the updated appointment"""
+
+    @abstractmethod
+    def delete_appointment(self, appointment_id):
+        """Delete/cancel an appointment"""
+
+    @abstractmethod
+    def check_availability(self, service_type, appointment_date, appointment_time):
+        """Whether a slot can take another booking (see slot_check)"""
+
+    @abstractmethod
+    def get_available_slots(self, service_type, appointment_date, duration_mins=30):
+        """Times with room for another booking, and each slot's remaining
+        capacity (see slot_availability)"""
+
+    @abstractmethod
+    def claim_reminder(self, appointment_id):
+        """Record that a reminder is being sent; False if one already was"""
+
+    # ============ DELTA SYNC ============
+
+    @abstractmethod
+    def get_changed_appointments(self, after=None, service_type=None, date=None, limit=500):
+        """Up to `limit` appointments ordered by (updated_at, id), following the
+        `after` pair (an empty id means everything updated at or after that time)"""
+
+    @abstractmethod
+    def get_tombstones(self, after=None, service_type=None, date=None, limit=500):
+        """Deleted appointments as {'id', 'deleted_at', ...}, ordered and paged
+        like get_changed_appointments by (deleted_at, id)"""
+
+    # ============ EXPORTS ============
+
+    @abstractmethod
+    def get_export_page(self, start_date, end_date, service_type=None, status=None,
+                        after=None, limit=1000):
+        """Up to `limit` appointments dated start_date..end_date inclusive,
+        ordered by (appointment_date, id) and following the `after` pair"""
+
+    @abstractmethod
+    def save_export_checkpoint(self, export_id, checkpoint):
+        """Store (replace) an export's progress dict"""
+
+    @abstractmethod
+    def get_export_checkpoint(self, export_id):
+        """An export's progress dict, or None"""
+
+    # ============ SEQUENCES ============
+
+    @abstractmethod
+    def lease_sequence_block(self, name, size):
+        """Atomically reserve the next `size` numbers of a named counter
+        (starting from 1); returns the first"""
+
+    # ============ STATISTICS ============
+
+    @abstractmethod
+    def get_statistics(self, start_date=None, end_date=None):
+        """Totals plus by_status, by_service and by_day breakdowns"""
+
+    @abstractmethod
+    def rebuild_statistics(self):
+        """Recount all appointments into the statistics counters"""
+
+    # ============ USER OPERATIONS ============
+
+    @abstractmethod
+    def create_client_user(self, email, password, name, phone):
+        """Create a new client user"""
+
+    @abstractmethod
+    def create_staff_user(self, email, password, name, phone, role):
+        """Create a new staff user"""
+
+    @abstractmethod
+    def authenticate_user(self, email, password, user_type='client'):
+        """Resolve login credentials to {'success': True, 'uid': ...}"""
+
+    @abstractmethod
+    def get_user_by_email(self, email, user_type='client'):
+        """Get user by email"""
+
+    @abstractmethod
+    def get_user_by_uid(self, uid, user_type='client'):
+        """Get user by UID"""
+
+    # ============ SHARED HELPERS ============
+
+    def connect(self):
+        """Open this process's datastore connection ahead of the first request
+        (backends that connect on first use need nothing here)"""
+
+    def generate_appointment_number(self):
+        """Generate a unique appointment number (APP-YYYYMMDD-NNNN, from a per-day sequence)"""
+        date_str = datetime.now().strftime('%Y%m%d')
+        return f"APP-{date_str}-{self.appointment_numbers.next(date_str):04d}"
+
+    def build_appointment(self, service_type, client_data, appointment_data):
+        """Build a new Pending appointment document"""
+        return {
+            'appointment_number': self.generate_appointment_number(),
+            'service_type': service_type,
+            'client_name': client_data.get('client_name'),
+            'client_email': client_data.get('client_email'),
+            'client_phone': client_data.get('client_phone'),
+            'appointment_date': appointment_data.get('appointment_date'),
+            'appointment_time': appointment_data.get('appointment_time'),
+            'purpose': appointment_data.get('purpose', ''),
+            'status': 'Pending',
+            'created_at': datetime.now().isoformat(),
+            'updated_at': datetime.now().isoformat()
+        }
+
+    def admission_error(self, service_type, appointment_date, appointment_time, slot_count, day_count):
+        """Result refusing one more booking given the slot's and the day's active
+        booking counts, or None if there is room"""
+        schedule = schedules.for_service(service_type)
+        if not schedule.is_bookable(appointment_date, appointment_time):
+            return {'success': False, 'error': f'{service_type} does not take appointments at that time'}
+        if slot_count >= schedule.slot_capacity:
+            return {'success': False, 'slot_taken': True, 'error': 'Time slot is not available'}
+        if schedule.max_per_day and day_count >= schedule.max_per_day:
+            return {'success': False, 'slot_taken': True, 'day_full': True,
+                    'error': 'No more appointments can be booked on this date'}
+        return None
+
+    def slot_availability(self, service_type, appointment_date, slot_counts, day_count):
+        """get_available_slots result from a day's active booking counts per time"""
+        schedule = schedules.for_service(service_type)
+        slot_limit = schedule.slot_capacity
+        day_remaining = max(schedule.max_per_day - day_count, 0) if schedule.max_per_day else None
+        capacity = []
+        for slot_time in schedule.times_on(appointment_date):
+            booked = slot_counts.get(slot_time, 0)
+            remaining = max(slot_limit - booked, 0)
+            if day_remaining is not None:
+                remaining = min(remaining, day_remaining)
+            capacity.append({'time': slot_time, 'capacity': slot_limit, 'booked': booked, 'remaining': remaining})
+        return {
+            'success': True,
+            'slots': [slot['time'] for slot in capacity if slot['remaining']],
+            'capacity': capacity,
+            'day_remaining': day_remaining
+        }
+
+    def slot_check(self, service_type, appointment_date, appointment_time, slot_count, day_count):
+        """check_availability result from the slot's and the day's active booking counts"""
+        slot_limit = schedules.for_service(service_type).slot_capacity
+        return {
+            'success': True,
+            'available': self.admission_error(
+                service_type, appointment_date, appointment_time, slot_count, day_count
+            ) is None,
+            'booked_count': slot_count,
+            'capacity': slot_limit,
+            'remaining': max(slot_limit - slot_count, 0)
+        }
+
+    def default_statistics_range(self, days=7):
+        """Today and the following days, as appointment_date strings"""
+        today = datetime.now()
+        return today.strftime('%Y-%m-%d'), (today + timedelta(days=days - 1)).strftime('%Y-%m-%d')
+
+    def add_listener(self, listener):
+        """Register an object notified after appointment writes.
+
+        Listeners may define appointment_created(id, appointment),
+        appointment_updated(id, appointment) and appointment_deleted(id, appointment).
+        """
+        if listener not in self.listeners:
+            self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def notify_listeners(self, event, appointment_id, appointment):
+        for listener in list(self.listeners):
+            handler = getattr(listener, event, None)
+            if handler is None:
+                continue
+            try:
+                handler(appointment_id, appointment)
+            except Exception as e:
+                print(f"Appointment listener error ({event}): {e}")
+
+    def get_changes(self, since=None, service_type=None, date=None, limit=None):
+        """Appointments changed and deleted after the `since` watermark.
+
+        Returns {'success': True, 'data': [...], 'deleted': [ids],
+        'watermark': ..., 'has_more': bool}; pass the watermark back as
+        `since` for the next call. Without `since` every appointment is
+        returned. Writes from the last sync_settle_seconds are sent again on
+        the next call, in case an older write has yet to commit. A watermark
+        older than tombstone_retention_days gives 'expired': True.
+        """
+        try:
+            page_size = min(int(limit or APP_SETTINGS['max_page_size']), APP_SETTINGS['max_page_size'])
+            after = None
+            if since:
+                order_field, timestamp, doc_id = self.decode_cursor(since)
+                if order_field != 'updated_at':
+                    raise ValueError('Invalid watermark')
+                after = (timestamp, doc_id)
+                horizon = datetime.now() - timedelta(days=APP_SETTINGS['tombstone_retention_days'])
+                if timestamp < horizon.isoformat():
+                    return {'success': False, 'expired': True,
+                            'error': 'Watermark expired; sync again without since'}
+
+            changed = [(appt['updated_at'], appt['id'], appt) for appt in
+                       self.get_changed_appointments(after, service_type, date, page_size + 1)]
+            deleted = [(tomb['deleted_at'], tomb['id'], None) for tomb in
+                       self.get_tombstones(after, service_type, date, page_size + 1)]
+            merged = sorted(changed + deleted, key=lambda change: change[:2])
+            has_more = len(merged) > page_size
+            merged = merged[:page_size]
+
+            if has_more:
+                watermark = merged[-1][:2]
+            else:
+                settled = (datetime.now() - timedelta(seconds=APP_SETTINGS['sync_settle_seconds'])).isoformat()
+                watermark = max(after or ('', ''), (settled, ''))
+            return {
+                'success': True,
+                'data': [appt for _, _, appt in merged if appt is not None],
+                'deleted': [doc_id for _, doc_id, appt in merged if appt is None],
+                'watermark': self.encode_cursor('updated_at', *watermark),
+                'has_more': has_more
+            }
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    def tombstone(self, appointment_id, appointment):
+        """Record of a deleted appointment for delta sync"""
+        return {
+            'id': appointment_id,
+            'service_type': appointment.get('service_type'),
+            'appointment_date': appointment.get('appointment_date'),
+            'deleted_at': datetime.now().isoformat()
+        }
+
+    def export_batches(self, start_date, end_date, service_type=None, status=None,
+                       after=None, batch_size=1000):
+        """Yield the export range one keyset page at a time.
+
+        Each page is a separate short query, so no read stays open for the
+        length of the export.
+        """
+        while True:
+            page = self.get_export_page(start_date, end_date, service_type, status, after, batch_size)
+            if page:
+                yield page
+            if len(page) < batch_size:
+                return
+            after = (page[-1]['appointment_date'], page[-1]['id'])
+
+    def watch_appointments(self, callback, service_type=None, status=None, date=None):
+        """Call callback(changes) whenever matching appointments change.
+
+        changes is a list of (kind, appointment_id, appointment) with kind
+        'added', 'modified' or 'removed'; the first call lists every current
+        match as 'added'. Returns a function that stops the watch. This
+        version follows the write listeners, so it sees this process's writes.
+        """
+        watch = _AppointmentWatch(callback, {
+            'service_type': service_type, 'status': status, 'appointment_date': date
+        })
+        self.add_listener(watch)
+        try:
+            watch.start(self.stream_appointments(service_type, status, date))
+        except Exception:
+            self.remove_listener(watch)
+            raise
+        return lambda: self.remove_listener(watch)
+
+    def parse_order_by(self, order_by):
+        """'-created_at' -> ('created_at', True); the flag means descending"""
+        field = order_by.lstrip('-')
+        if field not in SORTABLE_FIELDS:
+            raise ValueError(f'Cannot order by {field}')
+        return field, order_by.startswith('-')
+
+    def encode_cursor(self, order_field, value, doc_id):
+        """Opaque page cursor: the last row's sort value and document id"""
+        raw = json.dumps([order_field, value, doc_id]).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """Inverse of encode_cursor"""
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            order_field, value, doc_id = json.loads(raw)
+            return order_field, value, doc_id
+        except Exception:
+            raise ValueError('Invalid cursor')
+
+
+class _AppointmentWatch:
+    """Write listener behind AppointmentStore.watch_appointments"""
+
+    def __init__(self, callback, filters):
+        self.callback = callback
+        self.filters = filters
+        self.ids = set()
+        self.lock = threading.Lock()
+
+    def matches(self, appointment):
+        return all(not value or appointment.get(field) == value for field, value in self.filters.items())
+
+    def start(self, appointments):
+        with self.lock:
+            changes = []
+            for appt in appointments:
+                self.ids.add(appt['id'])
+                changes.append(('added', appt['id'], appt))
+            self.callback(changes)
+
+    def appointment_created(self, appointment_id, appointment):
+        self.changed(appointment_id, appointment)
+
+    def appointment_updated(self, appointment_id, appointment):
+        self.changed(appointment_id, appointment)
+
+    def appointment_deleted(self, appointment_id, appointment):
+        with self.lock:
+            if appointment_id in self.ids:
+                self.ids.discard(appointment_id)
+                self.callback([('removed', appointment_id, appointment)])
+
+    def changed(self, appointment_id, appointment):
+        with self.lock:
+            if self.matches(appointment):
+                kind = 'modified' if appointment_id in self.ids else 'added'
+                self.ids.add(appointment_id)
+            elif appointment_id in self.ids:
+                kind = 'removed'
+                self.ids.discard(appointment_id)
+            else:
+                return
+            self.callback([(kind, appointment_id, appointment)])
+
+
+def create_storage(backend=None):
+    """Instantiate the configured storage backend"""
+    backend = backend or STORAGE_CONFIG['backend']
+    if backend == 'sqlite':
+        from sqlite_db import SQLiteDB
+        return SQLiteDB(STORAGE_CONFIG['sqlite_path'])
+    if backend == 'firestore':
+        from firebase_db import FirebaseDB
+        return FirebaseDB()
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+# Initialize database (clients connect on first use in each process)
+with boot_phase('storage'):
+    database = create_storage()
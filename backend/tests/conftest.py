@@ -0,0 +1,70 @@
+"""
+Shared test setup: the SQLite backend in memory, no reminders and the default
+schedules (no schedule file), so the tests run without Firebase.
+"""
+import os
+
+os.environ['STORAGE_BACKEND'] = 'sqlite'
+os.environ['SQLITE_PATH'] = ':memory:'
+os.environ['REMINDERS_ENABLED'] = 'false'
+os.environ['SCHEDULE_FILE'] = os.path.join(os.path.dirname(__file__), 'no-schedules.json')
+
+import pytest
+
+import storage  # noqa: E402  (before sqlite_db, which imports it)
+from sqlite_db import SQLiteDB  # noqa: E402
+
+# A Monday far enough ahead to be bookable whenever the tests run
+BOOKABLE_DATE = '2099-06-01'
+
+
+@pytest.fixture
+def store():
+    """A fresh in-memory SQLite store"""
+    return SQLiteDB(':memory:')
+
+
+@pytest.fixture
+def book(store):
+    """book(time, date, service_type): store.reserve_appointment with placeholder client details"""
+    def book(appointment_time='10:00', appointment_date=BOOKABLE_DATE, service_type='Bank'):
+        return store.reserve_appointment(
+            service_type,
+            {'client_name': 'Ada Lovelace', 'client_email': 'ada@example.com', 'client_phone': '5550100'},
+            {'appointment_date': appointment_date, 'appointment_time': appointment_time}
+        )
+    return book
+
+
+@pytest.fixture
+def capacity(monkeypatch):
+    """capacity(slot_capacity, max_per_day): set the schedule the store admits against"""
+    from schedules import compile_schedules
+
+    def capacity(slot_capacity, max_per_day=0):
+        tables = compile_schedules(
+            {'default': {'slot_capacity': slot_capacity, 'max_per_day': max_per_day}},
+            storage.schedules.defaults
+        )
+        monkeypatch.setattr(storage.schedules, '_tables', tables)
+    return capacity
+
+
+@pytest.fixture
+def client():
+    """A test client for the Flask app (on the in-memory SQLite store)"""
+    from app import app
+    return app.test_client()
+
+
+@pytest.fixture
+def token():
+    """token(role, identity): Authorization headers carrying an access token for that role"""
+    from flask_jwt_extended import create_access_token
+    from app import app
+
+    def token(role, identity=None):
+        with app.app_context():
+            access_token = create_access_token(identity=identity or f'{role}-1', additional_claims={'role': role})
+        return {'Authorization': f'Bearer {access_token}'}
+    return token
@@ -0,0 +1,90 @@
+import io
+import json
+import logging
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import access_log
+from access_log import AccessLog, JsonFormatter, ListenerQueueHandler, count_datastore_call
+
+CONFIG = {'sample_above_rps': 2, 'sample_rate': 0.0, 'slow_request_ms': 500}
+
+
+@pytest.fixture
+def lines():
+    """JSON lines written by the 'access' logger through a queue handler"""
+    output = io.StringIO()
+    stream = logging.StreamHandler(output)
+    stream.setFormatter(JsonFormatter())
+    handler = ListenerQueueHandler([stream], queue_size=100)
+    logger = logging.getLogger('access')
+    logger.addHandler(handler)
+    previous_level = logger.level
+    logger.setLevel(logging.INFO)
+
+    def lines():
+        handler.stop()
+        return [json.loads(line) for line in output.getvalue().splitlines()]
+    yield lines
+    logger.removeHandler(handler)
+    logger.setLevel(previous_level)
+    handler.stop()
+
+
+def test_one_json_line_per_request_with_its_datastore_calls(lines):
+    access = AccessLog(CONFIG)
+    access.start()
+    count_datastore_call()
+    count_datastore_call(2)
+    access.record('GET', '/api/appointments/<appointment_id>', '/api/appointments/a1', 200, 0.0123, 512, '10.0.0.1')
+
+    entry, = lines()
+    assert entry['message'] == 'GET /api/appointments/<appointment_id> 200'
+    assert {key: entry[key] for key in ('route', 'path', 'status', 'duration_ms', 'datastore_calls',
+                                         'response_bytes', 'remote_addr', 'sample_rate')} == {
+        'route': '/api/appointments/<appointment_id>', 'path': '/api/appointments/a1', 'status': 200,
+        'duration_ms': 12.3, 'datastore_calls': 3, 'response_bytes': 512, 'remote_addr': '10.0.0.1',
+        'sample_rate': 1
+    }
+
+
+def test_datastore_calls_are_counted_per_request():
+    access = AccessLog(CONFIG)
+    seen = {}
+
+    def request(name, calls):
+        access.start()
+        for _ in range(calls):
+            count_datastore_call()
+        seen[name] = access_log._datastore_calls.get()[0]
+
+    threads = [threading.Thread(target=request, args=(name, calls)) for name, calls in (('a', 1), ('b', 4))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert seen == {'a': 1, 'b': 4}
+
+
+def test_busy_seconds_sample_fast_successes_but_keep_errors_and_slow_requests(lines, monkeypatch):
+    monkeypatch.setattr(access_log, 'time', SimpleNamespace(monotonic=lambda: 1000.0))
+    access = AccessLog(CONFIG)
+    for status, seconds in ((200, 0.01), (200, 0.01), (200, 0.01), (200, 0.01), (500, 0.01), (200, 0.9)):
+        access.record('GET', '/api/health', '/api/health', status, seconds)
+
+    logged = [(entry['status'], entry['duration_ms']) for entry in lines()]
+    # Only the first sample_above_rps fast successes in the second are written
+    assert logged == [(200, 10.0), (200, 10.0), (500, 10.0), (200, 900.0)]
+
+
+def test_a_full_queue_drops_records_instead_of_blocking():
+    handler = ListenerQueueHandler([logging.NullHandler()], queue_size=1)
+    handler._pid = os.getpid()     # no listener draining the queue
+    record = logging.LogRecord('access', logging.INFO, __file__, 1, 'message', None, None)
+    handler.emit(record)
+    handler.emit(record)
+    handler.emit(record)
+    assert handler.dropped == 2
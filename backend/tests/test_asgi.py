@@ -0,0 +1,124 @@
+"""
+The ASGI entry point driven directly through its ASGI callable, on the app's
+own (in-memory) store. Each test books on a date of its own.
+"""
+import asyncio
+import itertools
+import json
+import threading
+
+import pytest
+
+asgi = pytest.importorskip('asgi')
+from async_store import ThreadedAsyncStore  # noqa: E402
+
+addresses = (f'10.0.3.{n}' for n in itertools.count(1))
+
+
+async def call(method, path, body=None, headers=()):
+    """(status, headers, body) of one request to asgi.application"""
+    path, _, query = path.partition('?')
+    scope = {
+        'type': 'http', 'method': method, 'path': path, 'raw_path': path.encode(), 'root_path': '',
+        'query_string': query.encode(), 'scheme': 'http', 'http_version': '1.1',
+        'server': ('testserver', 80), 'client': (next(addresses), 50000),
+        'headers': [(b'host', b'testserver'), (b'content-type', b'application/json')] +
+                   [(name.encode(), value.encode()) for name, value in headers],
+    }
+    requests = [{'type': 'http.request', 'body': json.dumps(body).encode() if body is not None else b''}]
+    finished = asyncio.Event()
+    messages = []
+
+    async def receive():
+        if requests:
+            return requests.pop()
+        await finished.wait()       # the client stays connected
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        messages.append(message)
+
+    await asgi.application(scope, receive, send)
+    finished.set()
+    start = messages[0]
+    return start['status'], dict(start['headers']), b''.join(m.get('body', b'') for m in messages[1:])
+
+
+def run(*requests):
+    async def main():
+        return [await call(*request) for request in requests]
+    return asyncio.run(main())
+
+
+@pytest.fixture(autouse=True)
+def confirmations(monkeypatch):
+    sent = []
+    monkeypatch.setattr(asgi.notification_service, 'send_appointment_confirmation', sent.append)
+    return sent
+
+
+def booking(appointment_date, appointment_time='10:00'):
+    return {'service_type': 'Bank', 'client_name': 'Ada Lovelace', 'client_email': 'ada@example.com',
+            'client_phone': '5550100', 'appointment_date': appointment_date, 'appointment_time': appointment_time}
+
+
+def test_booking_then_reading_it_back(capacity, confirmations):
+    capacity(1)
+    (status, _, body), (taken, _, _) = run(('POST', '/api/appointments', booking('2099-07-06')),
+                                           ('POST', '/api/appointments', booking('2099-07-06')))
+    assert (status, taken) == (201, 409)
+    created = json.loads(body)
+
+    (status, _, body), = run(('GET', f"/api/appointments/{created['appointment_id']}"))
+    assert status == 200
+    assert json.loads(body)['data']['appointment_number'] == created['appointment_number']
+    assert len(confirmations) == 1
+
+
+def test_listing_streams_ndjson_on_request(capacity):
+    capacity(5)
+    run(*[('POST', '/api/appointments', booking('2099-07-13', time)) for time in ('09:00', '09:30', '10:00')])
+
+    (status, headers, body), = run(('GET', '/api/appointments?date=2099-07-13&fields=appointment_time', None,
+                                    [('accept', 'application/x-ndjson')]))
+    assert status == 200
+    assert headers[b'content-type'].startswith(b'application/x-ndjson')
+    times = sorted(json.loads(line)['appointment_time'] for line in body.splitlines())
+    assert times == ['09:00', '09:30', '10:00']
+
+
+def test_bad_requests_are_refused():
+    (missing, _, _), (no_email, _, _), (no_token, _, _) = run(
+        ('POST', '/api/appointments', {'service_type': 'Bank'}),
+        ('GET', '/api/appointments/by-number/A-1'),
+        ('GET', '/api/appointments/stream'),
+    )
+    assert (missing, no_email, no_token) == (400, 400, 401)
+
+
+def test_other_routes_are_served_by_the_flask_app():
+    (status, _, body), = run(('GET', '/api/health'))
+    assert status == 200
+    assert json.loads(body)['status'] == 'healthy'
+
+
+def test_threaded_store_runs_calls_off_the_event_loop():
+    class Store:
+        def where(self):
+            return threading.current_thread().name
+
+        def stream_appointments(self):
+            return iter(range(1200))
+
+    store = ThreadedAsyncStore(Store(), max_workers=2)
+
+    async def main():
+        rows = [row async for row in await store.stream_appointments()]
+        return await store.where(), rows
+
+    try:
+        thread_name, rows = asyncio.run(main())
+    finally:
+        store.shutdown()
+    assert thread_name.startswith('async-io')
+    assert rows == list(range(1200))
@@ -0,0 +1,115 @@
+import os
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import boot
+import firebase_db
+from firebase_db import FirebaseDB
+from notifications import NotificationService
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_lazy_module_is_imported_on_first_use(tmp_path, monkeypatch):
+    (tmp_path / 'lazy_probe.py').write_text('ANSWER = 42\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    module = boot.lazy_import('lazy_probe')
+    assert 'lazy_probe' not in sys.modules
+
+    assert module.ANSWER == 42
+    assert 'lazy_probe' in sys.modules
+    assert 'import lazy_probe' in boot.boot_timings()
+    monkeypatch.delitem(sys.modules, 'lazy_probe')
+
+
+def test_importing_the_firestore_backend_leaves_the_sdk_unloaded():
+    probe = "import sys, firebase_db; print('firebase_admin' in sys.modules)"
+    env = dict(os.environ, STORAGE_BACKEND='sqlite', SQLITE_PATH=':memory:', REMINDERS_ENABLED='false')
+    output = subprocess.run([sys.executable, '-c', probe], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    assert output.strip().splitlines()[-1] == 'False'
+
+
+def test_worker_tasks_run_once_per_process_in_the_background(monkeypatch):
+    ran = []
+
+    def failing():
+        raise RuntimeError('no datastore')
+
+    monkeypatch.setattr(boot, '_worker_tasks', [])
+    monkeypatch.setattr(boot, '_worker_pid', None)
+    boot.on_worker_start(failing)
+    boot.on_worker_start(lambda: ran.append(os.getpid()))
+    monkeypatch.delitem(boot._timings, 'ready', raising=False)
+
+    boot.start_worker()
+    boot.start_worker()
+    deadline = time.monotonic() + 5
+    while 'ready' not in boot.boot_timings():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    # A failing task does not stop the ones after it
+    assert ran == [os.getpid()]
+
+
+@pytest.fixture
+def firebase(monkeypatch):
+    """Fake Firebase Admin SDK modules; calls['init'] counts initialize_app"""
+    calls = {'init': 0, 'fail': False}
+
+    def initialize_app(cred, name):
+        calls['init'] += 1
+        if calls['fail']:
+            raise ValueError('bad service account key')
+        return SimpleNamespace(name=name)
+
+    monkeypatch.setattr(firebase_db, 'credentials', SimpleNamespace(Certificate=lambda path: path))
+    monkeypatch.setattr(firebase_db, 'firebase_admin',
+                        SimpleNamespace(initialize_app=initialize_app, delete_app=lambda app: None))
+    monkeypatch.setattr(firebase_db, 'firestore', SimpleNamespace(client=lambda app: ('client', app.name)))
+    return calls
+
+
+def test_firestore_client_is_created_on_first_use_in_each_process(firebase):
+    store = FirebaseDB()
+    assert firebase['init'] == 0
+
+    assert store.db == ('client', f'appointmentpro-{os.getpid()}')
+    assert store.db is store.db
+    assert firebase['init'] == 1
+
+    store._client_pid = -1          # as seen from a forked child
+    store.db
+    assert firebase['init'] == 2
+
+
+def test_a_failed_initialize_is_retried_after_a_pause(firebase):
+    firebase['fail'] = True
+    store = FirebaseDB()
+    assert store.db is None
+    assert store.db is None
+    assert firebase['init'] == 1
+
+    firebase['fail'] = False
+    store._retry_at = (os.getpid(), time.monotonic())     # INIT_RETRY_SECONDS have passed
+    assert store.db is not None
+    assert firebase['init'] == 2
+
+
+def test_twilio_client_is_created_on_first_use_in_each_process(monkeypatch):
+    service = NotificationService()
+    created = []
+    monkeypatch.setattr(service, 'initialize_twilio', lambda: created.append(os.getpid()) or 'twilio')
+
+    assert created == []
+    assert service.twilio_client == 'twilio'
+    assert service.twilio_client == 'twilio'
+    assert created == [os.getpid()]
+
+    service._twilio_pid = -1        # as seen from a forked child
+    service.twilio_client
+    assert len(created) == 2
@@ -0,0 +1,63 @@
+import threading
+
+
+def test_full_slot_refuses_another_booking(store, book, capacity):
+    capacity(2)
+    day = book('10:00')['data']['appointment_date']
+    assert book('10:00')['success']
+    refused = book('10:00')
+    assert refused == {'success': False, 'slot_taken': True, 'error': 'Time slot is not available'}
+    assert book('10:30')['success']
+
+    slot = next(slot for slot in store.get_available_slots('Bank', day)['capacity']
+                if slot['time'] == '10:00')
+    assert (slot['booked'], slot['remaining']) == (2, 0)
+
+
+def test_day_cap_refuses_bookings_in_free_slots(store, book, capacity):
+    capacity(1, max_per_day=2)
+    assert book('09:00')['success'] and book('09:30')['success']
+    refused = book('10:00')
+    assert refused['day_full'] and refused['slot_taken']
+    # Another service on the same day has its own cap
+    assert book('10:00', service_type='Cafe')['success']
+
+
+def test_time_outside_the_schedule_is_refused(book, capacity):
+    capacity(1)
+    assert book('08:00') == {'success': False, 'error': 'Bank does not take appointments at that time'}
+    assert not book('10:15')['success']
+
+
+def test_cancelling_frees_the_place_and_reactivating_takes_it_back(store, book, capacity):
+    capacity(1)
+    first = book('10:00')['appointment_id']
+    assert store.update_appointment_status(first, 'Cancelled')['success']
+    second = book('10:00')['appointment_id']
+
+    refused = store.update_appointment_status(first, 'Pending')
+    assert refused['slot_taken']
+    assert store.get_appointment_by_id(first)['data']['status'] == 'Cancelled'
+    # Moving between active statuses needs no new place
+    assert store.update_appointment_status(second, 'Confirmed')['success']
+
+
+def test_concurrent_bookings_never_overfill_a_slot(store, book, capacity):
+    capacity(3)
+    results = []
+    lock = threading.Lock()
+
+    def attempt():
+        result = book('10:00')
+        with lock:
+            results.append(result['success'])
+
+    threads = [threading.Thread(target=attempt) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert results.count(True) == 3
+    day = store.get_changes()['data'][0]['appointment_date']
+    assert store.check_availability('Bank', day, '10:00')['available'] is False
@@ -0,0 +1,265 @@
+"""
+Firestore slot capacity: per-slot counters and the day total split across
+shards, checked against an in-memory client whose transactions fail on
+commit when a document they read has changed (as Firestore's do).
+"""
+import itertools
+import os
+import threading
+import time
+import zlib
+
+import pytest
+
+import firebase_db
+from firebase_db import FirebaseDB, DAY_CAPACITY_COLLECTION
+from tests.conftest import BOOKABLE_DATE
+
+SLOT_TIMES = ['09:00', '09:30', '10:00', '10:30', '11:00', '11:30', '12:00', '12:30']
+
+
+class Snapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self.exists = data is not None
+        self._data = data
+
+    def get(self, field):
+        return self._data[field]
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class DocumentRef:
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+        self.id = path[1]
+
+    def get(self, transaction=None):
+        time.sleep(0.001)   # round trips, so that concurrent transactions overlap
+        data, version = self.client.docs.get(self.path, (None, 0))
+        if transaction is not None:
+            transaction.read(self.path, version)
+        self.client.reads.append(self.path)
+        return Snapshot(self.id, data)
+
+    def set(self, data):
+        with self.client.lock:
+            self.client.docs[self.path] = (dict(data), self.client.docs.get(self.path, (None, 0))[1] + 1)
+
+
+class Query:
+    def __init__(self, client, name, filters=(), size=None):
+        self.client = client
+        self.name = name
+        self.filters = filters
+        self.size = size
+
+    def where(self, field, op, value):
+        test = (lambda v: v in value) if op == 'in' else (lambda v: v == value)
+        return Query(self.client, self.name, self.filters + ((field, test),), self.size)
+
+    def limit(self, size):
+        return Query(self.client, self.name, self.filters, size)
+
+    def stream(self, transaction=None):
+        self.client.queries.append(self.name)
+        with self.client.lock:
+            docs = [(path, entry) for path, entry in self.client.docs.items() if path[0] == self.name]
+        matches = [(path, data, version) for path, (data, version) in docs
+                   if all(field in data and test(data[field]) for field, test in self.filters)]
+        for path, data, version in matches[:self.size]:
+            if transaction is not None:
+                transaction.read(path, version)
+            yield Snapshot(path[1], data)
+
+
+class Collection(Query):
+    def document(self, doc_id=None):
+        return DocumentRef(self.client, (self.name, doc_id or str(next(self.client.ids))))
+
+
+class Transaction:
+    def __init__(self, client):
+        self.client = client
+        self.versions = {}
+        self.writes = []
+
+    def read(self, path, version):
+        self.versions.setdefault(path, version)
+
+    def set(self, ref, data):
+        self.writes.append((ref.path, data))
+
+    def commit(self):
+        """False, writing nothing, if a document read has changed since"""
+        time.sleep(0.001)
+        with self.client.lock:
+            for path, version in self.versions.items():
+                if self.client.docs.get(path, (None, 0))[1] != version:
+                    self.client.conflicts += 1
+                    return False
+            for path, data in self.writes:
+                self.client.docs[path] = (dict(data), self.client.docs.get(path, (None, 0))[1] + 1)
+            return True
+
+
+class Client:
+    def __init__(self):
+        self.docs = {}          # (collection, id) -> (data, version)
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.conflicts = 0
+        self.reads = []
+        self.queries = []
+
+    def collection(self, name):
+        return Collection(self, name)
+
+    def data(self, collection):
+        return {path[1]: data for path, (data, _) in self.docs.items() if path[0] == collection}
+
+
+class NoCounters:
+    def record_create(self, *args):
+        pass
+
+
+def fake_store(capacity_shards):
+    """A FirebaseDB on the in-memory client (statistics counters left out)"""
+    store = FirebaseDB()
+    store.capacity_shards = capacity_shards
+    store.counters = NoCounters()
+    store._client = Client()
+    store._client_pid = os.getpid()
+    return store
+
+
+@pytest.fixture
+def firestore_store():
+    return fake_store(capacity_shards=4)
+
+
+def reserve(store, appointment_time, appointment_date=BOOKABLE_DATE):
+    """FirebaseDB.book's transaction, retried on conflict as firestore.transactional does"""
+    client = store.db
+    while True:
+        transaction = Transaction(client)
+        counts = store.read_capacity(transaction, 'Bank', appointment_date, appointment_time)
+        if store.capacity_admission_error(counts) is not None:
+            return False
+        doc_ref = client.collection('appointments').document()
+        appointment = {'appointment_number': f'N{doc_ref.id}', 'service_type': 'Bank', 'status': 'Pending',
+                       'appointment_date': appointment_date, 'appointment_time': appointment_time}
+        store.reservation_writes(client, transaction, doc_ref, appointment, counts, (0, None))
+        if transaction.commit():
+            return True
+
+
+def book_concurrently(store, times):
+    results = []
+    barrier = threading.Barrier(len(times))
+
+    def attempt(appointment_time):
+        barrier.wait()
+        results.append(reserve(store, appointment_time))
+
+    threads = [threading.Thread(target=attempt, args=(appointment_time,)) for appointment_time in times]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    return results
+
+
+def test_shard_quotas_add_up_to_the_day_cap(firestore_store):
+    assert [firestore_store.shard_quota(10, shard) for shard in range(4)] == [3, 3, 2, 2]
+    assert sum(firestore_store.shard_quota(150, shard) for shard in range(4)) == 150
+
+
+def test_concurrent_bookings_never_pass_the_day_cap(firestore_store, capacity):
+    capacity(slot_capacity=10, max_per_day=10)
+    results = book_concurrently(firestore_store, SLOT_TIMES * 4)
+
+    assert results.count(True) == 10
+    client = firestore_store.db
+    shards = client.data(DAY_CAPACITY_COLLECTION)
+    assert sum(shard['count'] for shard in shards.values()) == 10
+    assert all(shard['count'] <= firestore_store.shard_quota(10, shard['shard']) for shard in shards.values())
+    # Each booking is recorded against the shard that admitted it
+    held = [appointment['capacity_shard'] for appointment in client.data('appointments').values()]
+    assert sorted(held) == sorted(itertools.chain.from_iterable(
+        [shard['shard']] * shard['count'] for shard in shards.values()))
+
+
+def test_concurrent_bookings_never_overfill_a_slot(firestore_store, capacity):
+    capacity(slot_capacity=3)
+    results = book_concurrently(firestore_store, ['10:00'] * 20)
+    assert results.count(True) == 3
+    slot, = firestore_store.db.data('slot_capacity').values()
+    assert slot['count'] == 3
+
+
+def test_bookings_in_different_slots_spread_over_the_shards(firestore_store, capacity):
+    capacity(slot_capacity=10)
+    assert all(book_concurrently(firestore_store, SLOT_TIMES * 3))
+    shards = firestore_store.db.data(DAY_CAPACITY_COLLECTION)
+    assert len(shards) > 1
+    assert sum(shard['count'] for shard in shards.values()) == len(SLOT_TIMES) * 3
+
+
+def test_shards_take_contention_off_the_day_total(capacity):
+    capacity(slot_capacity=1)
+    times = firebase_db.schedules.for_service('Bank').times_on(BOOKABLE_DATE)
+    conflicts = {}
+    for shards in (1, 8):
+        store = fake_store(shards)
+        # One booking per slot: transactions only meet on the day's counters
+        assert all(book_concurrently(store, times))
+        conflicts[shards] = store.db.conflicts
+    assert conflicts[8] < conflicts[1] / 2
+
+
+def test_a_full_shard_passes_the_booking_to_the_next(firestore_store, capacity, monkeypatch):
+    capacity(slot_capacity=10, max_per_day=8)
+    monkeypatch.setattr(firebase_db.random, 'randrange', lambda n: 1)
+    for _ in range(3):
+        assert reserve(firestore_store, '10:00')
+    counts = {shard['shard']: shard['count'] for shard in firestore_store.db.data(DAY_CAPACITY_COLLECTION).values()}
+    assert counts == {1: 2, 2: 1}
+
+
+def test_missing_counters_are_counted_from_booked_appointments(firestore_store, capacity):
+    capacity(slot_capacity=2, max_per_day=0)
+    client = firestore_store.db
+    # Booked before the counters existed: no capacity_shard, spread by id
+    for doc_id in ('legacy-a', 'legacy-b'):
+        client.docs[('appointments', doc_id)] = ({
+            'service_type': 'Bank', 'status': 'Confirmed',
+            'appointment_date': BOOKABLE_DATE, 'appointment_time': '10:00'
+        }, 1)
+
+    transaction = Transaction(client)
+    counts = firestore_store.read_capacity(transaction, 'Bank', BOOKABLE_DATE, '10:00', shard=0)
+    assert counts['slot'] == 2
+    assert counts['shard_count'] == sum(1 for doc_id in ('legacy-a', 'legacy-b')
+                                        if zlib.crc32(doc_id.encode()) % 4 == 0)
+    assert not reserve(firestore_store, '10:00')
+
+
+def test_freeing_a_place_reads_only_the_shard_that_holds_it(firestore_store, capacity):
+    capacity(slot_capacity=10, max_per_day=10)
+    assert reserve(firestore_store, '10:00')
+    client = firestore_store.db
+    appointment_id, appointment = next(iter(client.data('appointments').items()))
+    shard = firestore_store.holder_shard(appointment_id, appointment)
+
+    client.reads.clear()
+    transaction = Transaction(client)
+    counts = firestore_store.read_capacity(transaction, 'Bank', BOOKABLE_DATE, '10:00', shard)
+    assert len(client.reads) == 2
+    firestore_store.write_capacity(transaction, counts, -1)
+    assert transaction.commit()
+    assert all(shard['count'] == 0 for shard in client.data(DAY_CAPACITY_COLLECTION).values())
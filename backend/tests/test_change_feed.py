@@ -0,0 +1,95 @@
+import json
+
+import pytest
+
+from change_feed import ChangeFeedHub, Subscription, sse_stream
+
+
+def events(subscription):
+    found = []
+    while True:
+        event = subscription.get(0)
+        if event is None:
+            return found
+        found.append(event)
+
+
+def ids(appointments):
+    return sorted(appointment['id'] for appointment in appointments)
+
+
+def test_subscriber_gets_a_snapshot_then_only_matching_changes(store, book):
+    bank = book('09:00')['appointment_id']
+    book('09:00', service_type='Hospital')
+    subscription = ChangeFeedHub(store).subscribe(Subscription(10), service_type='Bank')
+
+    (event, data), = events(subscription)
+    assert event == 'snapshot' and ids(data['appointments']) == [bank]
+
+    later = book('09:30')['appointment_id']
+    book('09:30', service_type='Hospital')
+    store.update_appointment_status(bank, 'Confirmed')
+    store.delete_appointment(later)
+    assert [(event, data['id']) for event, data in events(subscription)] == \
+        [('added', later), ('modified', bank), ('removed', later)]
+
+
+def test_status_filter_removes_appointments_that_stop_matching(store, book):
+    appointment_id = book('09:00')['appointment_id']
+    subscription = ChangeFeedHub(store).subscribe(Subscription(10), service_type='Bank', status='Pending')
+    events(subscription)
+
+    store.update_appointment_status(appointment_id, 'Cancelled')
+    assert [(event, data['id']) for event, data in events(subscription)] == [('removed', appointment_id)]
+
+
+def test_subscribers_to_one_filter_share_a_watch(store, book):
+    hub = ChangeFeedHub(store)
+    first = hub.subscribe(Subscription(10), date='2099-06-01')
+    second = hub.subscribe(Subscription(10), date='2099-06-01')
+    hub.subscribe(Subscription(10), service_type='Bank')
+    assert hub.stats() == {'feeds': 2, 'subscribers': 3}
+    assert events(second)[0][0] == 'snapshot'
+
+    listeners = len(store.listeners)
+    first.close()
+    assert len(store.listeners) == listeners
+    second.close()
+    assert len(store.listeners) == listeners - 1
+    assert hub.stats() == {'feeds': 1, 'subscribers': 1}
+
+
+def test_unfiltered_feed_is_refused(store):
+    with pytest.raises(ValueError):
+        ChangeFeedHub(store).subscribe(Subscription(10), status='Pending')
+
+
+def test_slow_subscriber_is_reset_and_dropped(store, book):
+    hub = ChangeFeedHub(store)
+    subscription = hub.subscribe(Subscription(1), service_type='Bank')
+    book('09:00')
+    book('09:30')
+
+    chunks = list(sse_stream(subscription, lambda data: json.dumps(data).encode(), 0))
+    assert chunks[-1].startswith(b'event: reset')
+    assert hub.stats() == {'feeds': 0, 'subscribers': 0}
+
+
+def test_stream_route_is_staff_only(client, token):
+    assert client.get('/api/appointments/stream?service_type=Bank', headers=token('client')).status_code == 403
+    assert client.get('/api/appointments/stream?service_type=Bank').status_code == 401
+
+
+def test_asgi_stream_route_is_staff_only(token):
+    asgi = pytest.importorskip('asgi')
+
+    class Request:
+        args = {}
+
+        def __init__(self, headers):
+            self.headers = {name.lower(): value for name, value in headers.items()}
+
+    assert asgi.token_error(Request(token('client')), staff_only=True)[1] == 403
+    assert asgi.token_error(Request(token('staff')), staff_only=True) is None
+    assert asgi.token_error(Request(token('client'))) is None
+    assert asgi.token_error(Request({}), staff_only=True)[1] == 401
@@ -0,0 +1,82 @@
+"""
+POST /api/appointments against the app's own (in-memory) store. Each test
+books on a date of its own, since the store is shared by the app, and posts
+from addresses of its own, so the booking rate limit does not carry over.
+"""
+import itertools
+import threading
+
+import pytest
+
+import app as app_module
+
+
+@pytest.fixture
+def confirmations(monkeypatch):
+    sent = []
+    monkeypatch.setattr(app_module.notification_service, 'send_appointment_confirmation', sent.append)
+    return sent
+
+
+addresses = (f'10.0.2.{n}' for n in itertools.count(1))
+
+
+def post(client, body):
+    return client.post('/api/appointments', json=body, environ_base={'REMOTE_ADDR': next(addresses)})
+
+
+def booking(appointment_date, appointment_time='10:00', **changes):
+    return dict({
+        'service_type': 'Bank', 'client_name': 'Ada Lovelace', 'client_email': 'ada@example.com',
+        'client_phone': '5550100', 'appointment_date': appointment_date, 'appointment_time': appointment_time
+    }, **changes)
+
+
+def test_booking_creates_the_appointment_and_confirms_it(client, capacity, confirmations):
+    capacity(1)
+    response = post(client, booking('2099-06-08'))
+    assert response.status_code == 201
+    body = response.get_json()
+
+    stored = app_module.database.get_appointment_by_id(body['appointment_id'])['data']
+    assert stored['appointment_number'] == body['appointment_number']
+    assert stored['status'] == 'Pending'
+    assert [sent['appointment_number'] for sent in confirmations] == [body['appointment_number']]
+
+
+def test_a_taken_slot_is_a_conflict(client, capacity, confirmations):
+    capacity(1)
+    assert post(client, booking('2099-06-15')).status_code == 201
+    response = post(client, booking('2099-06-15'))
+    assert response.status_code == 409
+    assert response.get_json() == {'success': False, 'error': 'Time slot is not available'}
+    assert len(confirmations) == 1
+
+
+def test_missing_fields_are_refused(client, confirmations):
+    body = booking('2099-06-22')
+    del body['client_phone']
+    assert post(client, body).status_code == 400
+    assert confirmations == []
+
+
+def test_concurrent_requests_for_one_place_book_it_once(client, capacity, confirmations):
+    capacity(1)
+    statuses = []
+    barrier = threading.Barrier(8)
+
+    def attempt():
+        from app import app
+        barrier.wait()
+        with app.test_client() as own_client:
+            statuses.append(post(own_client, booking('2099-06-29')).status_code)
+
+    threads = [threading.Thread(target=attempt) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert sorted(statuses) == [201] + [409] * 7
+    listing = app_module.database.get_appointments(date='2099-06-29')['data']
+    assert len(listing) == 1
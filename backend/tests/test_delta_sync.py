@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+
+
+def test_first_sync_returns_every_appointment(store, book):
+    ids = {book('10:00')['appointment_id'], book('11:00')['appointment_id']}
+    result = store.get_changes()
+    assert result['success'] and not result['has_more']
+    assert {appointment['id'] for appointment in result['data']} == ids
+    assert result['deleted'] == []
+
+
+def test_deleted_appointment_comes_back_as_a_tombstone(store, book):
+    kept = book('10:00')['appointment_id']
+    deleted = book('11:00')['appointment_id']
+    watermark = store.get_changes()['watermark']
+
+    store.delete_appointment(deleted)
+    result = store.get_changes(since=watermark)
+    assert result['deleted'] == [deleted]
+    # Writes from the last few seconds are sent again, but never the deleted one
+    assert deleted not in [appointment['id'] for appointment in result['data']]
+    assert store.get_appointment_by_id(kept)['success']
+
+
+def test_tombstones_follow_the_filters(store, book):
+    bank = book('10:00', service_type='Bank')['appointment_id']
+    cafe = book('10:00', service_type='Cafe')['appointment_id']
+    watermark = store.get_changes()['watermark']
+    store.delete_appointment(bank)
+    store.delete_appointment(cafe)
+
+    assert store.get_changes(since=watermark, service_type='Cafe')['deleted'] == [cafe]
+
+
+def test_status_change_is_sent_again(store, book):
+    appointment_id = book('10:00')['appointment_id']
+    watermark = store.get_changes()['watermark']
+    store.update_appointment_status(appointment_id, 'Confirmed')
+
+    changed = store.get_changes(since=watermark)['data']
+    assert [(appointment['id'], appointment['status']) for appointment in changed] == \
+        [(appointment_id, 'Confirmed')]
+
+
+def test_pages_follow_has_more(store, book):
+    times = ['09:00', '09:30', '10:00', '10:30', '11:00']
+    booked = {book(time)['appointment_id'] for time in times}
+    removed = booked.pop()
+    store.delete_appointment(removed)
+
+    seen, deleted, since = set(), [], None
+    while True:
+        result = store.get_changes(since=since, limit=2)
+        assert len(result['data']) + len(result['deleted']) <= 2
+        seen.update(appointment['id'] for appointment in result['data'])
+        deleted += result['deleted']
+        since = result['watermark']
+        if not result['has_more']:
+            break
+    assert seen == booked
+    assert deleted == [removed]
+
+
+def test_watermark_older_than_tombstone_retention_expires(store):
+    old = (datetime.now() - timedelta(days=365)).isoformat()
+    result = store.get_changes(since=store.encode_cursor('updated_at', old, ''))
+    assert result['success'] is False and result['expired'] is True
+
+
+def test_invalid_watermark_is_an_error(store):
+    result = store.get_changes(since=store.encode_cursor('created_at', '2099-01-01', ''))
+    assert result == {'success': False, 'error': 'Invalid watermark'}
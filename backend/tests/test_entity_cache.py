@@ -0,0 +1,72 @@
+import time
+
+from entity_cache import EntityCache
+
+
+def test_get_returns_a_copy_of_the_cached_value():
+    cache = EntityCache(max_entries=10, ttl_seconds=60)
+    cache.put('a', {'status': 'Pending'})
+    value = cache.get('a')
+    value['status'] = 'Cancelled'
+    assert cache.get('a') == {'status': 'Pending'}
+
+
+def test_put_stores_a_copy():
+    cache = EntityCache(max_entries=10, ttl_seconds=60)
+    value = {'status': 'Pending'}
+    cache.put('a', value)
+    value['status'] = 'Cancelled'
+    assert cache.get('a') == {'status': 'Pending'}
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = EntityCache(max_entries=2, ttl_seconds=60)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert cache.stats()['evictions'] == 1
+
+
+def test_entries_expire_after_the_ttl():
+    cache = EntityCache(max_entries=10, ttl_seconds=0.05)
+    cache.put('a', 1)
+    time.sleep(0.1)
+    assert cache.get('a') is None
+    assert cache.stats()['size'] == 0
+
+
+def test_patch_updates_a_cached_value_in_place():
+    cache = EntityCache(max_entries=10, ttl_seconds=60)
+    cache.put('a', {'status': 'Pending', 'client_name': 'Ada'})
+    cache.patch('a', {'status': 'Confirmed'})
+    cache.patch('missing', {'status': 'Confirmed'})
+    assert cache.get('a') == {'status': 'Confirmed', 'client_name': 'Ada'}
+    assert cache.get('missing') is None
+
+
+def test_evict_and_clear_invalidate_entries():
+    cache = EntityCache(max_entries=10, ttl_seconds=60)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.evict('a')
+    assert cache.get('a') is None and cache.get('b') == 2
+    cache.clear()
+    assert cache.get('b') is None
+
+
+def test_zero_size_cache_stores_nothing():
+    cache = EntityCache(max_entries=0, ttl_seconds=60)
+    cache.put('a', 1)
+    assert cache.get('a') is None
+
+
+def test_stats_count_hits_and_misses():
+    cache = EntityCache(max_entries=10, ttl_seconds=60)
+    cache.put('a', 1)
+    cache.get('a')
+    cache.get('b')
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['hit_ratio']) == (1, 1, 0.5)
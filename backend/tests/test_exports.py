@@ -0,0 +1,78 @@
+import csv
+import io
+import json
+
+import pytest
+
+from exports import AppointmentExport, load_checkpoint
+
+
+def dump_bytes(value):
+    return json.dumps(value).encode()
+
+
+def csv_rows(data):
+    return list(csv.DictReader(io.StringIO(data.decode())))
+
+
+@pytest.fixture
+def booked(book):
+    return [book(time)['appointment_id'] for time in ('09:00', '09:30', '10:00', '10:30', '11:00')]
+
+
+def start(store, owner='staff-1', **kwargs):
+    return AppointmentExport.start(store, kwargs.pop('export_format', 'csv'), '2099-06-01', '2099-06-30',
+                                   batch_size=2, owner=owner, **kwargs)
+
+
+def test_export_streams_every_row_in_the_range(store, booked, book):
+    book('10:00', appointment_date='2099-07-01')
+    export = start(store)
+    rows = csv_rows(b''.join(export.chunks(dump_bytes)))
+    assert sorted(row['id'] for row in rows) == sorted(booked)
+    assert load_checkpoint(store, export.export_id, 'staff-1')['complete'] is True
+
+
+def test_ndjson_export_filters_by_status(store, booked):
+    store.update_appointment_status(booked[0], 'Cancelled')
+    export = start(store, export_format='ndjson', status='Pending')
+    lines = b''.join(export.chunks(dump_bytes)).splitlines()
+    assert sorted(json.loads(line)['id'] for line in lines) == sorted(booked[1:])
+
+
+def test_interrupted_export_resumes_after_its_checkpoint(store, booked):
+    export = start(store)
+    chunks = export.chunks(dump_bytes)
+    sent = next(chunks) + next(chunks)      # the header and the first page
+    next(chunks)                            # the first page's checkpoint is saved; this chunk is lost
+    chunks.close()
+
+    resumed = AppointmentExport.resume(store, export.export_id, batch_size=2, owner='staff-1')
+    assert resumed.filename.endswith('-from-2.csv')
+    rows = csv_rows(sent) + csv_rows(b''.join(resumed.chunks(dump_bytes)))
+    assert sorted(row['id'] for row in rows) == sorted(booked)
+
+
+def test_only_the_owner_can_resume_or_follow_an_export(store, booked):
+    export = start(store, owner='staff-1')
+    assert AppointmentExport.resume(store, export.export_id, owner='staff-2') is None
+    assert load_checkpoint(store, export.export_id, 'staff-2') is None
+    assert AppointmentExport.resume(store, 'unknown', owner='staff-1') is None
+
+
+def test_invalid_exports_are_refused(store):
+    with pytest.raises(ValueError):
+        AppointmentExport.start(store, 'xlsx')
+    with pytest.raises(ValueError):
+        AppointmentExport.start(store, 'csv', '2099-06-30', '2099-06-01')
+
+
+def test_export_routes_are_staff_only(client, token):
+    assert client.get('/api/appointments/export', headers=token('client')).status_code == 403
+    response = client.get('/api/appointments/export', headers=token('staff'))
+    assert response.status_code == 200
+    export_id = response.headers['X-Export-Id']
+    response.close()
+    assert client.get(f'/api/appointments/export/{export_id}', headers=token('staff')).status_code == 200
+    assert client.get(f'/api/appointments/export/{export_id}',
+                      headers=token('staff', identity='staff-2')).status_code == 404
@@ -0,0 +1,97 @@
+import asyncio
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+from flask import Flask
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+import json_provider
+from json_provider import FastJSONProvider, ndjson_chunks, ndjson_chunks_async, prefers_ndjson
+
+
+@pytest.fixture
+def provider():
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+    return app.json
+
+
+@pytest.fixture
+def default_provider():
+    return Flask(__name__).json
+
+
+@pytest.mark.parametrize('value', [
+    {'b': 1, 'a': [1.5, None, True], 'text': 'café ☃'},
+    {'when': datetime(2099, 6, 1, 10, 30), 'day': date(2099, 6, 1)},
+    {1: 'non-string key'},
+    {'big': 2 ** 70},
+    {'amount': Decimal('12.50')},
+])
+def test_output_matches_the_default_provider(provider, default_provider, value):
+    assert json.loads(provider.dump_bytes(value)) == json.loads(default_provider.dumps(value))
+
+
+def test_loads_round_trips(provider):
+    value = {'id': 'a1', 'count': 3, 'nested': {'ok': True}}
+    assert provider.loads(provider.dump_bytes(value)) == value
+
+
+def test_works_without_orjson(provider, monkeypatch):
+    monkeypatch.setattr(json_provider, 'orjson', None)
+    assert provider.dump_bytes({'b': 1, 'a': 2}) == b'{"a":2,"b":1}'
+    assert provider.dumps({'when': date(2099, 6, 1)}) == '{"when": "Mon, 01 Jun 2099 00:00:00 GMT"}'
+    assert provider.loads('{"a": 1}') == {'a': 1}
+
+
+def test_ndjson_is_preferred_only_when_ranked_first():
+    def accept(header):
+        return parse_accept_header(header, MIMEAccept)
+
+    assert prefers_ndjson(accept('application/x-ndjson'))
+    assert not prefers_ndjson(accept('application/json, application/x-ndjson;q=0.5'))
+    assert not prefers_ndjson(accept('*/*'))
+
+
+def test_ndjson_chunks_hold_whole_lines(provider, monkeypatch):
+    monkeypatch.setattr(json_provider, 'NDJSON_CHUNK_SIZE', 40)
+    rows = [{'id': f'appointment-{i}'} for i in range(10)]
+    chunks = list(ndjson_chunks(rows, provider.dump_bytes))
+
+    assert len(chunks) > 1
+    assert all(chunk.endswith(b'\n') for chunk in chunks)
+    assert [json.loads(line) for line in b''.join(chunks).splitlines()] == rows
+
+
+def test_a_failure_mid_stream_ends_with_an_error_line(provider):
+    def rows():
+        yield {'id': 'a1'}
+        raise RuntimeError('datastore unavailable')
+
+    lines = b''.join(ndjson_chunks(rows(), provider.dump_bytes)).splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {'id': 'a1'}, {'success': False, 'error': 'datastore unavailable'}
+    ]
+
+
+def test_async_chunks_match_the_sync_ones(provider):
+    rows = [{'id': f'appointment-{i}'} for i in range(5)]
+
+    async def aiter_rows():
+        for row in rows:
+            yield row
+
+    async def collect():
+        return [chunk async for chunk in ndjson_chunks_async(aiter_rows(), provider.dump_bytes)]
+
+    assert asyncio.run(collect()) == list(ndjson_chunks(rows, provider.dump_bytes))
+
+
+def test_listing_route_streams_ndjson_on_request(client):
+    response = client.get('/api/appointments?fields=status', headers={'Accept': 'application/x-ndjson'})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert all(set(json.loads(line)) == {'id', 'status'} for line in response.data.splitlines())
@@ -0,0 +1,66 @@
+import pytest
+
+SLOT_TIMES = ['09:00', '09:30', '10:00', '10:30', '11:00', '11:30', '12:00']
+
+
+@pytest.fixture
+def booked(store, book, capacity):
+    capacity(5)
+    ids = [book(time)['appointment_id'] for time in SLOT_TIMES]
+    # Ties on the sort field are broken by id
+    store._conn().execute("UPDATE appointments SET created_at = '2099-01-01T00:00:00'")
+    return ids
+
+
+def pages(store, **kwargs):
+    """Every page of a listing, following next_cursor"""
+    found, cursor = [], None
+    while True:
+        result = store.get_appointments(start_after=cursor, **kwargs)
+        assert result['success'], result
+        found.append(result['data'])
+        cursor = result['next_cursor']
+        if cursor is None:
+            return found
+
+
+def test_pages_cover_every_appointment_once(store, booked):
+    found = pages(store, limit=3)
+    assert [len(page) for page in found] == [3, 3, 1]
+    assert sorted(appt['id'] for page in found for appt in page) == sorted(booked)
+
+
+def test_descending_order_reverses_the_pages(store, booked):
+    ascending = [appt['id'] for page in pages(store, limit=2, order_by='appointment_time') for appt in page]
+    descending = [appt['id'] for page in pages(store, limit=2, order_by='-appointment_time') for appt in page]
+    assert ascending == booked
+    assert descending == booked[::-1]
+
+
+def test_projection_returns_only_the_fields_asked_for(store, booked):
+    result = store.get_appointments(limit=2, order_by='appointment_time', fields=['appointment_number'])
+    # The sort field is read for the cursor but not returned
+    assert all(set(appt) == {'id', 'appointment_number'} for appt in result['data'])
+    assert result['next_cursor'] is not None
+
+
+def test_unknown_fields_and_foreign_cursors_are_refused(store, booked):
+    assert store.get_appointments(fields=['password'])['success'] is False
+    cursor = store.get_appointments(limit=2)['next_cursor']
+    refused = store.get_appointments(limit=2, start_after=cursor, order_by='appointment_time')
+    assert refused == {'success': False, 'error': 'Cursor does not match order_by'}
+
+
+def test_page_size_is_capped(store, booked, monkeypatch):
+    from config import APP_SETTINGS
+    monkeypatch.setitem(APP_SETTINGS, 'max_page_size', 4)
+    assert len(store.get_appointments(limit=100)['data']) == 4
+
+
+def test_listing_route_pages_and_projects(client):
+    response = client.get('/api/appointments?limit=1&fields=status&order_by=-created_at')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert all(set(appt) == {'id', 'status'} for appt in body['data'])
+    assert 'next_cursor' in body
+    assert client.get('/api/appointments?fields=nope').status_code == 400
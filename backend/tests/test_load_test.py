@@ -0,0 +1,33 @@
+from benchmarks.load_test import Recorder, compare, percentile
+
+
+def test_percentile_interpolates_between_samples():
+    values = [1.0, 2.0, 3.0, 4.0]
+    assert percentile(values, 0) == 1.0
+    assert percentile(values, 50) == 2.5
+    assert percentile(values, 100) == 4.0
+    assert percentile([], 95) == 0.0
+
+
+def test_recorder_summarises_each_route_and_the_total():
+    recorder = Recorder()
+    for seconds in (0.001, 0.002, 0.003):
+        recorder.record('GET /a', seconds, True)
+    recorder.record('POST /b', 0.010, False)
+
+    routes, total = recorder.summary(elapsed=2)
+    assert routes['GET /a'] == {
+        'requests': 3, 'errors': 0, 'throughput_rps': 1.5, 'mean_ms': 2.0,
+        'p50_ms': 2.0, 'p95_ms': 2.9, 'p99_ms': 2.98, 'max_ms': 3.0
+    }
+    assert (routes['POST /b']['errors'], total['requests'], total['errors']) == (1, 4, 1)
+    assert total['max_ms'] == 10.0
+
+
+def test_compare_flags_routes_slower_than_the_tolerance(capsys):
+    baseline = {'routes': {'GET /a': {'p95_ms': 10.0}, 'GET /b': {'p95_ms': 10.0}, 'GET /idle': {'p95_ms': 0.0}}}
+    current = {'routes': {'GET /a': {'p95_ms': 11.0}, 'GET /b': {'p95_ms': 13.0},
+                          'GET /idle': {'p95_ms': 5.0}, 'GET /new': {'p95_ms': 5.0}}}
+
+    assert compare(current, baseline, tolerance=0.2) == ['GET /b']
+    assert 'regression' in capsys.readouterr().out
@@ -0,0 +1,70 @@
+import pytest
+
+from tests.conftest import BOOKABLE_DATE
+from tests.test_capacity_shards import fake_store, reserve
+
+
+def test_sqlite_lookup_finds_the_booking(store, book):
+    created = book()
+    found = store.get_appointment_by_number(created['appointment_number'])
+    assert found['data']['id'] == created['appointment_id']
+    assert store.get_appointment_by_number('no-such-number') == {'success': False, 'error': 'Appointment not found'}
+
+
+def test_sqlite_lookup_uses_the_number_index(store):
+    plan = ' '.join(row[3] for row in store._conn().execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM appointments WHERE appointment_number = ?", ('A-1',)))
+    assert 'idx_appointments_number' in plan
+
+
+@pytest.fixture
+def firestore_store(capacity):
+    capacity(slot_capacity=10)
+    return fake_store(capacity_shards=4)
+
+
+def test_firestore_lookup_is_two_point_reads_then_cached(firestore_store):
+    assert reserve(firestore_store, '10:00')
+    client = firestore_store.db
+    appointment_id, appointment = next(iter(client.data('appointments').items()))
+    firestore_store.number_index.evict(appointment['appointment_number'])
+    firestore_store.appointment_cache.evict(appointment_id)
+
+    client.reads.clear()
+    client.queries.clear()
+    found = firestore_store.get_appointment_by_number(appointment['appointment_number'])
+    assert found['data']['id'] == appointment_id
+    assert [collection for collection, _ in client.reads] == ['appointment_numbers', 'appointments']
+    assert client.queries == []
+
+    client.reads.clear()
+    assert firestore_store.get_appointment_by_number(appointment['appointment_number'])['success']
+    assert client.reads == []
+
+
+def test_firestore_lookup_backfills_the_index_for_older_appointments(firestore_store):
+    client = firestore_store.db
+    client.docs[('appointments', 'legacy')] = ({
+        'appointment_number': 'BANK-0001', 'service_type': 'Bank', 'status': 'Pending',
+        'appointment_date': BOOKABLE_DATE, 'appointment_time': '10:00'
+    }, 1)
+
+    assert firestore_store.get_appointment_by_number('BANK-0001')['data']['id'] == 'legacy'
+    assert client.queries == ['appointments']
+    assert client.data('appointment_numbers') == {'BANK-0001': {'appointment_id': 'legacy'}}
+    assert firestore_store.get_appointment_by_number('BANK-0002')['success'] is False
+
+
+def test_route_needs_the_matching_email(client):
+    from app import database
+    created = database.reserve_appointment(
+        'Bank', {'client_name': 'Ada', 'client_email': 'Ada@Example.com', 'client_phone': '5550100'},
+        {'appointment_date': '2099-07-20', 'appointment_time': '10:00'}
+    )
+    path = f"/api/appointments/by-number/{created['appointment_number']}"
+
+    assert client.get(path).status_code == 400
+    assert client.get(f'{path}?email=someone@example.com').status_code == 404
+    response = client.get(f'{path}?email=ada@example.com')
+    assert response.status_code == 200
+    assert response.get_json()['data']['id'] == created['appointment_id']
@@ -0,0 +1,71 @@
+import threading
+
+import metrics
+from metrics import MetricsRegistry
+
+
+def sample(text, line_start):
+    """The value of the one sample line starting with line_start"""
+    value, = [line.rsplit(' ', 1)[1] for line in text.splitlines() if line.startswith(line_start)]
+    return float(value)
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    histogram = registry.histogram('latency_seconds', 'Latency', ('route',), buckets=(0.1, 1.0))
+    for seconds in (0.05, 0.5, 0.5, 5):
+        histogram.labels('/a').observe(seconds)
+
+    text = registry.render()
+    assert sample(text, 'latency_seconds_bucket{route="/a",le="0.1"}') == 1
+    assert sample(text, 'latency_seconds_bucket{route="/a",le="1.0"}') == 3
+    assert sample(text, 'latency_seconds_bucket{route="/a",le="+Inf"}') == 4
+    assert sample(text, 'latency_seconds_count{route="/a"}') == 4
+    assert sample(text, 'latency_seconds_sum{route="/a"}') == 6.05
+
+
+def test_counts_from_finished_threads_are_kept():
+    registry = MetricsRegistry()
+    counter = registry.counter('jobs', 'Jobs', ('kind',))
+    threads = [threading.Thread(target=lambda: [counter.labels('x').inc() for _ in range(100)]) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sample(registry.render(), 'jobs_total{kind="x"}') == 800
+
+
+def test_label_values_are_escaped():
+    registry = MetricsRegistry()
+    registry.counter('jobs', 'Jobs', ('kind',)).labels('a"b\\c\n').inc()
+    assert 'jobs_total{kind="a\\"b\\\\c\\n"} 1' in registry.render()
+
+
+def test_observe_request_reuses_the_series_for_a_route():
+    metrics.observe_request('GET', '/observe-test', 200, 0.01)
+    series = metrics._request_series[('GET', '/observe-test', 200)]
+    metrics.observe_request('GET', '/observe-test', 200, 0.02)
+
+    assert metrics._request_series[('GET', '/observe-test', 200)] is series
+    assert series == (metrics.request_duration.labels('GET', '/observe-test'),
+                      metrics.requests_total.labels('GET', '/observe-test', 200))
+    text = metrics.registry.render()
+    assert sample(text, 'appointmentpro_http_requests_total{method="GET",route="/observe-test",status="200"}') == 2
+    assert sample(text, 'appointmentpro_http_request_duration_seconds_count{method="GET",route="/observe-test"}') == 2
+
+
+def test_timed_store_methods_count_failures_but_not_taken_slots():
+    class Store:
+        def book(self, outcome):
+            return outcome
+
+    store = Store()
+    metrics.instrument_store(store, ['book'])
+    errors = metrics.datastore_errors.labels('book')
+    before = errors.totals()[0]
+    store.book({'success': True})
+    store.book({'success': False, 'slot_taken': True})
+    store.book({'success': False, 'error': 'unavailable'})
+
+    assert errors.totals()[0] == before + 1
@@ -0,0 +1,72 @@
+import threading
+import time
+
+import pytest
+
+from notifications import NotificationService
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def service():
+    """A NotificationService with one worker, a one-job queue and quick retries"""
+    service = NotificationService()
+    service.email_config = dict(service.email_config, async_dispatch=True, queue_workers=1, queue_max_size=1,
+                                max_retries=2, retry_backoff_seconds=0.01, queue_drain_timeout_seconds=1)
+    service.async_dispatch = True
+    yield service
+    service.shutdown(timeout=1)
+
+
+def test_failed_sends_are_retried(service):
+    attempts = []
+
+    def send_email(**kwargs):
+        attempts.append(kwargs)
+        return {'success': len(attempts) == 3, 'error': 'SMTP unavailable'}
+
+    service.send_email = send_email
+    assert service.dispatch('send_email', to_email='ada@example.com', subject='s', body='b')['success']
+    wait_for(lambda: service.queue_stats()['sent'] == 1)
+    stats = service.queue_stats()
+    assert (len(attempts), stats['retried'], stats['failed']) == (3, 2, 0)
+
+
+def test_sends_fail_after_the_last_retry(service):
+    service.send_email = lambda **kwargs: {'success': False, 'error': 'SMTP unavailable'}
+    service.dispatch('send_email', to_email='ada@example.com', subject='s', body='b')
+    wait_for(lambda: service.queue_stats()['failed'] == 1)
+    assert service.queue_stats()['retried'] == 2
+
+
+def test_results_say_queued_not_sent(service):
+    result = service.send_reminder({'client_email': 'ada@example.com', 'appointment_number': 'A1'})
+    assert result['message'] == 'Reminders queued'
+    assert result['results']['email'] == {'success': True, 'message': 'send_email queued'}
+
+
+def test_shutdown_with_a_full_queue_drops_pending_retries_instead_of_blocking(service):
+    service.email_config['retry_backoff_seconds'] = 60
+    release = threading.Event()
+    service.send_email = lambda **kwargs: {'success': False, 'error': 'SMTP unavailable'}
+    service.send_sms = lambda **kwargs: {'success': release.wait(10)}
+
+    service.dispatch('send_email', to_email='ada@example.com', subject='s', body='b')
+    wait_for(lambda: service.queue_stats()['pending_retries'] == 1)
+    # The worker is busy and the queue is full
+    service.dispatch('send_sms', phone_number='5550100', message='m')
+    wait_for(lambda: service.queue_stats()['depth'] == 0)
+    service.dispatch('send_sms', phone_number='5550100', message='m')
+
+    started = time.monotonic()
+    service.shutdown(timeout=0.2)
+    assert time.monotonic() - started < 2
+    assert service.queue_stats()['dropped'] == 1
+    assert service.dispatch('send_sms', phone_number='5550100', message='m')['success'] is False
+    release.set()
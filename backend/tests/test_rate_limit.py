@@ -0,0 +1,111 @@
+import pytest
+
+from rate_limit import MemoryBucketStore, RateLimiter, SQLiteBucketStore, _take, client_key
+
+LOGIN = ('POST', '/api/auth/client-login')
+STREAM = '/api/appointments/stream'
+
+
+def limiter(requests=3, per_seconds=60, **kwargs):
+    return RateLimiter({LOGIN: (requests, per_seconds)}, MemoryBucketStore(100), **kwargs)
+
+
+def admit(rate_limiter, rule=LOGIN[1], client='ip:1.2.3.4'):
+    return rate_limiter.admit('POST', rule, lambda: client)
+
+
+def test_take_refills_at_the_rate_up_to_capacity():
+    assert _take(0, 0, capacity=3, rate=1, now=1.5) == (0.5, 0)
+    assert _take(0, 0, capacity=3, rate=1, now=100) == (2, 0)
+    tokens, wait = _take(0.5, 10, capacity=3, rate=0.5, now=10)
+    assert tokens == 0.5 and wait == pytest.approx(1)
+
+
+def test_client_key_prefers_the_user_then_the_proxy_address():
+    assert client_key('uid-1', '10.0.0.1') == 'user:uid-1'
+    assert client_key(None, '10.0.0.1') == 'ip:10.0.0.1'
+    # Only the entry the trusted proxy added counts; the client wrote the others
+    assert client_key(None, '10.0.0.1', 'spoofed, 203.0.113.9') == 'ip:203.0.113.9'
+
+
+def test_bucket_allows_a_burst_then_throttles():
+    rate_limiter = limiter(requests=3)
+    assert [admit(rate_limiter) for _ in range(3)] == [None] * 3
+    error, retry_after = admit(rate_limiter)
+    assert error == 'Too many requests, please retry later'
+    assert retry_after == 20
+    # Another client has its own bucket
+    assert admit(rate_limiter, client='ip:5.6.7.8') is None
+    assert rate_limiter.stats()['throttled'] == 1
+
+
+def test_routes_without_a_limit_are_not_throttled():
+    rate_limiter = limiter(requests=1)
+    assert [admit(rate_limiter, rule='/api/health') for _ in range(5)] == [None] * 5
+
+
+def test_concurrency_cap_sheds_until_a_request_is_released():
+    rate_limiter = limiter(requests=100, max_concurrent=2, exempt=[STREAM])
+    assert admit(rate_limiter) is None
+    assert admit(rate_limiter) is None
+    assert admit(rate_limiter) == ('Server is busy, please retry shortly', 1)
+    # Exempt routes neither count nor get shed
+    assert admit(rate_limiter, rule=STREAM) is None
+    rate_limiter.release(STREAM)
+
+    rate_limiter.release(LOGIN[1])
+    assert admit(rate_limiter) is None
+    assert rate_limiter.stats()['shed'] == 1
+    assert rate_limiter.stats()['in_flight'] == 2
+
+
+def test_throttled_request_gives_back_its_place_under_the_cap():
+    rate_limiter = limiter(requests=1, max_concurrent=5)
+    assert admit(rate_limiter) is None
+    assert admit(rate_limiter) is not None
+    assert rate_limiter.stats()['in_flight'] == 1
+
+
+def test_disabled_limiter_admits_everything():
+    rate_limiter = limiter(requests=1, max_concurrent=1, enabled=False)
+    assert [admit(rate_limiter) for _ in range(5)] == [None] * 5
+    rate_limiter.release(LOGIN[1])
+    assert rate_limiter.stats()['in_flight'] == 0
+
+
+def test_failing_store_admits_the_request():
+    class Broken(MemoryBucketStore):
+        def take(self, *args):
+            raise OSError('disk full')
+
+    rate_limiter = RateLimiter({LOGIN: (1, 60)}, Broken(10))
+    assert admit(rate_limiter) is None
+    assert admit(rate_limiter) is None
+
+
+def test_memory_store_evicts_the_least_recently_used_bucket():
+    store = MemoryBucketStore(max_keys=2)
+    store.take('a', 1, 1, 0)
+    store.take('b', 1, 1, 0)
+    store.take('a', 1, 1, 0)
+    store.take('c', 1, 1, 0)
+    assert store.size() == 2 and store.evicted == 1
+    # 'b' was evicted, so it starts again with a full bucket
+    assert store.take('b', 1, 1, 0) == 0
+
+
+def test_sqlite_store_is_shared_between_limiters(tmp_path):
+    path = str(tmp_path / 'ratelimits.db')
+    first = RateLimiter({LOGIN: (2, 60)}, SQLiteBucketStore(path, 100, 60))
+    second = RateLimiter({LOGIN: (2, 60)}, SQLiteBucketStore(path, 100, 60))
+    assert admit(first) is None
+    assert admit(second) is None
+    assert admit(first) is not None
+
+
+def test_sqlite_store_prunes_idle_and_excess_buckets(tmp_path):
+    store = SQLiteBucketStore(str(tmp_path / 'ratelimits.db'), max_keys=2, idle_seconds=60)
+    for i, now in enumerate((0, 100, 101, 102)):
+        store.take(f'key{i}', 1, 1, now)
+    store.prune(now=130)
+    assert store.size() == 2
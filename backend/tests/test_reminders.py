@@ -0,0 +1,42 @@
+from reminders import ReminderScheduler
+
+
+class CachedStore:
+    """A store whose cache still says Pending after another worker cancelled"""
+
+    def __init__(self):
+        self.claimed = []
+
+    def get_appointment_by_id(self, appointment_id, fresh=False):
+        status = 'Cancelled' if fresh else 'Pending'
+        return {'success': True, 'data': {'id': appointment_id, 'status': status}}
+
+    def claim_reminder(self, appointment_id):
+        self.claimed.append(appointment_id)
+        return True
+
+
+class Notifications:
+    def __init__(self):
+        self.sent = []
+
+    def send_reminder(self, appointment):
+        self.sent.append(appointment['id'])
+
+
+def test_reminder_rechecks_the_appointment_without_the_cache():
+    notifications = Notifications()
+    scheduler = ReminderScheduler(CachedStore(), notifications, 24)
+    scheduler._send('a1')
+    assert notifications.sent == []
+    assert scheduler.stats['skipped'] == 1
+
+
+def test_reminder_is_sent_once_claimed(store, book):
+    appointment_id = book()['appointment_id']
+    notifications = Notifications()
+    scheduler = ReminderScheduler(store, notifications, 24)
+    scheduler._send(appointment_id)
+    scheduler._send(appointment_id)
+    assert notifications.sent == [appointment_id]
+    assert scheduler.stats['sent'] == 1 and scheduler.stats['skipped'] == 1
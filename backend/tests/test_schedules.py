@@ -0,0 +1,81 @@
+import json
+import os
+
+import pytest
+
+from schedules import ScheduleRegistry, ServiceSchedule, compile_schedules
+
+DEFAULTS = {'open': '09:00', 'close': '12:00', 'slot_minutes': 30, 'slot_capacity': 1, 'max_per_day': 20}
+MONDAY, SUNDAY = '2099-06-01', '2099-06-07'
+
+
+def test_slots_run_from_open_to_close_around_breaks():
+    schedule = ServiceSchedule(dict(DEFAULTS, breaks=[['10:00', '10:45']]))
+    assert schedule.slot_times == ('09:00', '09:30', '11:00', '11:30')
+
+
+def test_last_slot_ends_by_closing_time():
+    schedule = ServiceSchedule(dict(DEFAULTS, close='10:20', slot_minutes=40))
+    assert schedule.slot_times == ('09:00', '09:40')
+
+
+def test_closed_weekdays_and_holidays_have_no_slots():
+    schedule = ServiceSchedule(dict(DEFAULTS, closed_weekdays=['sun'], holidays=['2099-06-02']))
+    assert schedule.times_on(SUNDAY) == ()
+    assert schedule.times_on('2099-06-02') == ()
+    assert schedule.is_bookable(MONDAY, '09:30')
+    assert not schedule.is_bookable(MONDAY, '09:15')
+    with pytest.raises(ValueError):
+        schedule.is_open('not a date')
+
+
+def test_service_overrides_the_defaults_and_adds_holidays():
+    tables = compile_schedules({
+        'default': {'holidays': ['2099-12-25']},
+        'services': {'Hospital': {'slot_minutes': 60, 'slot_capacity': 4, 'holidays': ['2099-06-01']}}
+    }, DEFAULTS)
+    hospital, other = tables['Hospital'], tables[None]
+    assert hospital.slot_times == ('09:00', '10:00', '11:00')
+    assert (hospital.slot_capacity, other.slot_capacity) == (4, 1)
+    assert hospital.holidays == {'2099-12-25', '2099-06-01'}
+    assert other.holidays == {'2099-12-25'}
+
+
+@pytest.mark.parametrize('config', [
+    {'defaults': {}},
+    {'services': {'Bank': {'opn': '09:00'}}},
+    {'default': {'open': '25:00'}},
+    {'default': {'open': '12:00', 'close': '09:00'}},
+    {'default': {'closed_weekdays': ['someday']}},
+])
+def test_invalid_schedules_are_refused(config):
+    with pytest.raises(ValueError):
+        compile_schedules(config, DEFAULTS)
+
+
+def write(path, config, mtime):
+    path.write_text(json.dumps(config))
+    os.utime(path, ns=(mtime, mtime))
+
+
+def test_registry_picks_up_a_changed_file(tmp_path):
+    path = tmp_path / 'schedules.json'
+    registry = ScheduleRegistry(str(path), DEFAULTS, check_seconds=0)
+    assert registry.for_service('Bank').slot_capacity == 1
+
+    write(path, {'services': {'Bank': {'slot_capacity': 3}}}, 1_000_000_000)
+    assert registry.reload() is True
+    assert registry.for_service('Bank').slot_capacity == 3
+    assert registry.for_service('Cafe').slot_capacity == 1
+    assert registry.reload() is False
+
+
+def test_registry_keeps_the_current_tables_when_a_file_is_invalid(tmp_path):
+    path = tmp_path / 'schedules.json'
+    write(path, {'services': {'Bank': {'slot_capacity': 3}}}, 1_000_000_000)
+    registry = ScheduleRegistry(str(path), DEFAULTS, check_seconds=0)
+
+    write(path, {'services': {'Bank': {'capacity': 5}}}, 2_000_000_000)
+    with pytest.raises(ValueError):
+        registry.reload()
+    assert registry.for_service('Bank').slot_capacity == 3
@@ -0,0 +1,119 @@
+import pytest
+
+import search_index
+from search_index import AppointmentSearchIndex, query_terms
+from tests.conftest import BOOKABLE_DATE
+
+
+@pytest.fixture
+def add(store):
+    """add(name, email, phone, time): book an appointment for that client, returning its id"""
+    def add(name, email, phone, appointment_time='10:00', service_type='Bank'):
+        return store.reserve_appointment(
+            service_type,
+            {'client_name': name, 'client_email': email, 'client_phone': phone},
+            {'appointment_date': BOOKABLE_DATE, 'appointment_time': appointment_time}
+        )['appointment_id']
+    return add
+
+
+@pytest.fixture
+def index(store):
+    index = AppointmentSearchIndex(store, refresh_seconds=3600)
+    yield index
+    index.stop()
+
+
+def found(index, q, **filters):
+    result = index.search(q, **filters)
+    assert result['success'], result
+    return [row['id'] for row in result['data']]
+
+
+def test_query_terms():
+    assert query_terms('Ada  LOVELACE') == ['ada', 'lovelace']
+    assert query_terms('(555) 01-23') == ['5550123']
+    assert query_terms('  ') == []
+
+
+def test_every_term_must_match_a_word_prefix(index, add):
+    ada = add('Ada Lovelace', 'ada@example.com', '5550100', '09:00')
+    grace = add('Grace Hopper', 'grace@navy.mil', '5550199', '09:30')
+    assert found(index, 'lov') == [ada]
+    assert found(index, 'ada lov') == [ada]
+    assert found(index, 'ada hop') == []
+    assert found(index, 'navy') == [grace]
+    assert index.search('')['success'] is False
+
+
+def test_name_matches_rank_above_email_matches_and_exact_above_prefix(index, add):
+    in_email = add('Grace Hopper', 'adam@example.com', '5550101', '09:00')
+    prefix = add('Adam Smith', 'smith@example.com', '5550102', '09:30')
+    exact = add('Ada Lovelace', 'lovelace@example.com', '5550103', '10:00')
+    assert found(index, 'ada') == [exact, prefix, in_email]
+
+
+def test_phone_digits_match_anywhere(index, add):
+    ada = add('Ada Lovelace', 'ada@example.com', '+1 (555) 010-0123', '09:00')
+    add('Grace Hopper', 'grace@example.com', '+1 (555) 777-8888', '09:30')
+    assert found(index, '0100') == [ada]
+    assert found(index, '010-01') == [ada]
+    assert found(index, '0123') == [ada]
+    assert len(found(index, '555')) == 2
+
+
+def test_filters_and_paging(index, add):
+    ids = [add(f'Ada Number{i}', f'ada{i}@example.com', f'555010{i}', f'{9 + i:02d}:00') for i in range(5)]
+    hospital = add('Ada Hospital', 'ada.h@example.com', '5550200', service_type='Hospital')
+    assert found(index, 'ada', service_type='Hospital') == [hospital]
+    assert set(found(index, 'ada', service_type='Bank')) == set(ids)
+
+    first = index.search('ada', service_type='Bank', limit=3)
+    second = index.search('ada', service_type='Bank', limit=3, offset=first['next_offset'])
+    assert first['total'] == 5 and second['next_offset'] is None
+    assert {row['id'] for row in first['data'] + second['data']} == set(ids)
+
+
+def test_writes_in_this_process_are_indexed_at_once(index, store, add):
+    ada = add('Ada Lovelace', 'ada@example.com', '5550100', '09:00')
+    assert found(index, 'ada') == [ada]
+
+    grace = add('Grace Hopper', 'grace@example.com', '5550199', '09:30')
+    assert found(index, 'grace') == [grace]
+    store.update_appointment_status(grace, 'Confirmed')
+    assert found(index, 'grace', status='Confirmed') == [grace]
+    store.delete_appointment(ada)
+    assert found(index, 'ada') == []
+
+
+def test_other_workers_writes_arrive_on_refresh(index, store, add):
+    ada = add('Ada Lovelace', 'ada@example.com', '5550100', '09:00')
+    assert found(index, 'ada') == [ada]
+
+    store.remove_listener(index)     # as if written by another worker
+    grace = add('Grace Hopper', 'grace@example.com', '5550199', '09:30')
+    store.delete_appointment(ada)
+    assert found(index, 'grace') == []
+
+    index.refresh()
+    assert found(index, 'grace') == [grace]
+    assert found(index, 'ada') == []
+
+
+def test_replaced_entries_are_compacted(index, store, add, monkeypatch):
+    monkeypatch.setattr(search_index, 'COMPACT_ABOVE', 2)
+    ids = [add(f'Client{i}', f'c{i}@example.com', f'555010{i}', f'{9 + i:02d}:00') for i in range(3)]
+    assert len(found(index, 'client')) == 3
+    for appointment_id in ids:
+        store.update_appointment_status(appointment_id, 'Cancelled')
+        store.delete_appointment(appointment_id)
+    assert index.stats() == {'appointments': 0, 'dead_slots': 0, 'tokens': 0}
+
+    add('Client Again', 'again@example.com', '5550109')
+    assert index.stats()['appointments'] == 1
+    assert len(found(index, 'client')) == 1
+
+
+def test_search_route_is_staff_only(client, token):
+    assert client.get('/api/appointments/search?q=ada', headers=token('client')).status_code == 403
+    assert client.get('/api/appointments/search?q=ada', headers=token('staff')).status_code in (200, 503)
@@ -0,0 +1,94 @@
+import threading
+import time
+
+import pytest
+
+from sequences import BlockSequence
+
+
+class Counter:
+    """lease() over one shared counter per key, like the store's sequence documents"""
+
+    def __init__(self, fail=False):
+        self.values = {}
+        self.leases = []
+        self.fail = fail
+        self.lock = threading.Lock()
+
+    def lease(self, key, size):
+        if self.fail:
+            raise ConnectionError('store down')
+        with self.lock:
+            start = self.values.get(key, 0) + 1
+            self.values[key] = start + size - 1
+            self.leases.append((key, start))
+            return start
+
+
+def wait_for_prefetch(sequence, key):
+    deadline = time.monotonic() + 5
+    while sequence._blocks[key].prefetching and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_numbers_are_consecutive_within_a_block():
+    counter = Counter()
+    sequence = BlockSequence(counter.lease, block_size=10)
+    assert [sequence.next('day') for _ in range(5)] == [1, 2, 3, 4, 5]
+    assert counter.leases == [('day', 1)]
+
+
+def test_next_block_is_leased_before_the_current_runs_out():
+    counter = Counter()
+    sequence = BlockSequence(counter.lease, block_size=10, prefetch_fraction=0.2)
+    numbers = [sequence.next('day') for _ in range(8)]
+    wait_for_prefetch(sequence, 'day')
+    numbers += [sequence.next('day') for _ in range(4)]
+    assert numbers == list(range(1, 13))
+    assert len(counter.leases) == 2
+
+
+def test_processes_sharing_a_counter_never_repeat_a_number():
+    counter = Counter()
+    sequences = [BlockSequence(counter.lease, block_size=5) for _ in range(3)]
+    numbers = []
+    lock = threading.Lock()
+
+    def take(sequence):
+        for _ in range(40):
+            number = sequence.next('day')
+            with lock:
+                numbers.append(number)
+
+    threads = [threading.Thread(target=take, args=(sequence,)) for sequence in sequences for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert len(numbers) == 240
+    assert len(set(numbers)) == 240
+
+
+def test_a_new_key_retires_the_old_block_leaving_a_gap():
+    counter = Counter()
+    sequence = BlockSequence(counter.lease, block_size=10)
+    assert sequence.next('monday') == 1
+    assert sequence.next('tuesday') == 1
+    # Monday's unused numbers are skipped: coming back leases a new block
+    assert sequence.next('monday') == 11
+
+
+def test_failed_lease_is_retried_on_the_next_number():
+    counter = Counter()
+    sequence = BlockSequence(counter.lease, block_size=5, prefetch_fraction=0.4)
+    assert sequence.next('day') == 1
+    counter.fail = True
+    for expected in (2, 3, 4, 5):
+        assert sequence.next('day') == expected
+        wait_for_prefetch(sequence, 'day')     # the background lease fails
+
+    with pytest.raises(ConnectionError):
+        sequence.next('day')
+    counter.fail = False
+    assert sequence.next('day') == 6
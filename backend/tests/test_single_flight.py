@@ -0,0 +1,154 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def run_concurrently(count, target):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert not any(thread.is_alive() for thread in threads)
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight(window_seconds=0)
+    calls = []
+    results = []
+
+    def read():
+        calls.append(1)
+        time.sleep(0.1)
+        return {'success': True, 'slots': ['10:00']}
+
+    run_concurrently(10, lambda: results.append(flight.do('key', read)))
+
+    assert len(calls) == 1
+    assert results == [{'success': True, 'slots': ['10:00']}] * 10
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_each_caller_gets_its_own_copy():
+    flight = SingleFlight(window_seconds=60)
+    first = flight.do('key', lambda: {'slots': ['10:00']})
+    first['slots'].append('11:00')
+    assert flight.do('key', lambda: {'slots': []}) == {'slots': ['10:00']}
+
+
+def test_result_is_kept_for_the_window():
+    flight = SingleFlight(window_seconds=60)
+    assert flight.do('key', lambda: 1) == 1
+    assert flight.do('key', lambda: 2) == 1
+    assert flight.stats()['cached'] == 1
+
+
+def test_invalidate_drops_kept_results():
+    flight = SingleFlight(window_seconds=60)
+    flight.do('key', lambda: 1)
+    flight.invalidate()
+    assert flight.do('key', lambda: 2) == 2
+
+
+def test_read_started_before_a_write_is_not_joined_after_it():
+    flight = SingleFlight(window_seconds=60)
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_read():
+        started.set()
+        release.wait(5)
+        return 'before write'
+
+    leader = threading.Thread(target=lambda: flight.do('key', slow_read))
+    leader.start()
+    started.wait(5)
+    flight.invalidate()
+    # A caller after the write runs its own read instead of waiting for the stale one
+    assert flight.do('key', lambda: 'after write') == 'after write'
+    release.set()
+    leader.join(5)
+    # The stale result is not kept
+    assert flight.do('key', lambda: 'fresh') == 'after write'
+
+
+def test_failures_are_shared_but_not_kept():
+    flight = SingleFlight(window_seconds=60)
+
+    def down():
+        raise ValueError('down')
+
+    with pytest.raises(ValueError):
+        flight.do('key', down)
+    assert flight.do('key', lambda: {'success': False}) == {'success': False}
+    assert flight.do('key', lambda: 'ok') == 'ok'
+
+
+def test_waiters_are_released_when_the_read_raises_base_exception():
+    flight = SingleFlight(window_seconds=0)
+    started = threading.Event()
+    errors = []
+
+    def interrupted():
+        started.set()
+        time.sleep(0.1)
+        raise SystemExit
+
+    def leader():
+        try:
+            flight.do('key', interrupted)
+        except SystemExit:
+            errors.append('leader')
+
+    def waiter():
+        try:
+            flight.do('key', lambda: 'unused')
+        except RuntimeError:
+            errors.append('waiter')
+
+    leader_thread = threading.Thread(target=leader)
+    leader_thread.start()
+    started.wait(5)
+    run_concurrently(3, waiter)
+    leader_thread.join(5)
+
+    assert sorted(errors) == ['leader', 'waiter', 'waiter', 'waiter']
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_coroutines_share_one_call():
+    flight = SingleFlight(window_seconds=0)
+    calls = []
+
+    async def read():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'slots'
+
+    async def main():
+        return await asyncio.gather(*(flight.do_async('key', read) for _ in range(20)))
+
+    assert asyncio.run(main()) == ['slots'] * 20
+    assert len(calls) == 1
+
+
+def test_cancelled_waiter_does_not_cancel_the_read():
+    flight = SingleFlight(window_seconds=0)
+
+    async def read():
+        await asyncio.sleep(0.05)
+        return 'slots'
+
+    async def main():
+        leader = asyncio.ensure_future(flight.do_async('key', read))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flight.do_async('key', read))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        return await leader
+
+    assert asyncio.run(main()) == 'slots'
@@ -0,0 +1,98 @@
+import time
+
+from slot_index import SlotOccupancyIndex
+
+DAY = ('Bank', '2099-06-01')
+
+
+def loaded_index(*appointments, ttl_seconds=0):
+    index = SlotOccupancyIndex(ttl_seconds=ttl_seconds)
+    index.load_day(*DAY, appointments)
+    return index
+
+
+def test_load_counts_only_active_bookings():
+    index = loaded_index(('a', '10:00', 'Pending'), ('b', '10:00', 'Confirmed'),
+                         ('c', '11:00', 'Cancelled'), ('d', '12:00', 'Completed'))
+    assert index.is_loaded(*DAY)
+    assert index.slot_counts(*DAY) == {'10:00': 2}
+
+
+def test_unloaded_day_is_not_reported_as_loaded():
+    index = SlotOccupancyIndex()
+    assert not index.is_loaded(*DAY)
+    assert index.slot_counts(*DAY) == {}
+
+
+def test_add_status_change_and_remove_keep_counts_current():
+    index = loaded_index(('a', '10:00', 'Pending'))
+    index.add('b', *DAY, '11:00')
+    index.add('b', *DAY, '11:00')           # a repeated add is ignored
+    assert index.slot_counts(*DAY) == {'10:00': 1, '11:00': 1}
+
+    index.set_status('a', 'Cancelled')
+    assert index.slot_counts(*DAY) == {'11:00': 1}
+    index.set_status('a', 'Confirmed')
+    assert index.slot_counts(*DAY) == {'10:00': 1, '11:00': 1}
+
+    index.remove('b')
+    assert index.slot_counts(*DAY) == {'10:00': 1}
+
+
+def test_changes_to_unindexed_days_are_ignored():
+    index = SlotOccupancyIndex()
+    index.add('a', *DAY, '10:00')
+    index.set_status('a', 'Cancelled')
+    index.remove('a')
+    assert not index.is_loaded(*DAY)
+
+
+def test_day_expires_after_the_ttl():
+    index = loaded_index(('a', '10:00', 'Pending'), ttl_seconds=0.05)
+    assert index.is_loaded(*DAY)
+    time.sleep(0.1)
+    assert not index.is_loaded(*DAY)
+
+
+def test_changes_made_while_a_day_loads_are_replayed_onto_it():
+    index = SlotOccupancyIndex()
+    pending = index.begin_load(*DAY)
+    # Made after the query read the day, so missing from or stale in its result
+    index.add('new', *DAY, '11:00')
+    index.set_status('old', 'Cancelled')
+    index.load_day(*DAY, [('old', '10:00', 'Pending'), ('kept', '12:00', 'Confirmed')], pending)
+    assert index.slot_counts(*DAY) == {'11:00': 1, '12:00': 1}
+
+
+def test_replayed_change_already_in_the_result_is_not_counted_twice():
+    index = SlotOccupancyIndex()
+    pending = index.begin_load(*DAY)
+    index.add('new', *DAY, '11:00')
+    index.load_day(*DAY, [('new', '11:00', 'Pending')], pending)
+    assert index.slot_counts(*DAY) == {'11:00': 1}
+
+
+def test_reload_does_not_undo_a_concurrent_remove():
+    index = loaded_index(('a', '10:00', 'Pending'), ('b', '11:00', 'Pending'))
+    pending = index.begin_load(*DAY)
+    index.remove('a')
+    index.load_day(*DAY, [('a', '10:00', 'Pending'), ('b', '11:00', 'Pending')], pending)
+    assert index.slot_counts(*DAY) == {'11:00': 1}
+    index.set_status('b', 'Cancelled')
+    assert index.slot_counts(*DAY) == {}
+
+
+def test_cancelled_load_stops_recording_changes():
+    index = SlotOccupancyIndex()
+    pending = index.begin_load(*DAY)
+    index.cancel_load(*DAY, pending)
+    index.add('a', *DAY, '10:00')
+    assert pending == []
+
+
+def test_past_days_are_pruned_on_load():
+    index = SlotOccupancyIndex()
+    index.load_day('Bank', '2000-01-01', [('old', '10:00', 'Pending')])
+    index.load_day(*DAY, [])
+    assert not index.is_loaded('Bank', '2000-01-01')
+    index.set_status('old', 'Cancelled')     # its appointments are forgotten too
@@ -0,0 +1,67 @@
+import threading
+
+import pytest
+
+import smtp_pool
+from smtp_pool import SMTPConnectionPool
+
+
+class FakeSMTP:
+    """An SMTP session whose socket drops after one message"""
+
+    def __init__(self, host, port, timeout):
+        self.sent = []
+
+    def starttls(self):
+        pass
+
+    def login(self, username, password):
+        pass
+
+    def noop(self):
+        return (250, b'OK')
+
+    def send_message(self, msg):
+        if self.sent:
+            raise OSError('connection reset')
+        self.sent.append(msg)
+
+    def quit(self):
+        pass
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(smtp_pool.smtplib, 'SMTP', FakeSMTP)
+    pool = SMTPConnectionPool('smtp.example.com', 587, 'user', 'secret', max_size=4)
+    yield pool
+    pool.close_all()
+
+
+def test_a_dropped_session_is_replaced(pool):
+    for _ in range(3):
+        pool.send_message('message')
+    stats = pool.pool_stats()
+    # Each later send finds the idle session dead and retries on a new one
+    assert (stats['connects'], stats['reuses'], stats['reconnects'], stats['closed']) == (3, 2, 2, 2)
+    assert (stats['open'], stats['idle']) == (1, 1)
+
+
+def test_concurrent_reconnects_are_all_counted(pool):
+    barrier = threading.Barrier(8)
+
+    def send():
+        barrier.wait()
+        for _ in range(5):
+            pool.send_message('message')
+
+    threads = [threading.Thread(target=send) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    stats = pool.pool_stats()
+    # Every dropped session is counted once when it is closed and once as a reconnect
+    assert stats['reconnects'] == stats['closed'] > 0
+    assert stats['connects'] - stats['closed'] == stats['open'] <= 4
@@ -0,0 +1,68 @@
+import threading
+
+import pytest
+
+from sqlite_db import SQLiteDB
+from storage import create_storage
+from tests.conftest import BOOKABLE_DATE
+
+
+def counts_table(store, sql):
+    return {tuple(row[:-1]): row[-1] for row in store._conn().execute(sql) if row[-1]}
+
+
+def recounted(store, sql):
+    return {tuple(row[:-1]): row[-1] for row in store._conn().execute(sql)}
+
+
+def test_trigger_counts_match_a_recount(store, book, capacity):
+    capacity(3)
+    first = book('10:00')['appointment_id']
+    second = book('10:00')['appointment_id']
+    book('10:30', service_type='Cafe')
+    store.update_appointment_status(first, 'Cancelled')
+    store.update_appointment_status(first, 'Confirmed')
+    store.update_appointment_status(second, 'Completed')
+    store.delete_appointment(book('11:00')['appointment_id'])
+
+    assert counts_table(store, "SELECT service_type, appointment_date, appointment_time, count FROM slot_counts") == \
+        recounted(store, "SELECT service_type, appointment_date, appointment_time, COUNT(*) FROM appointments "
+                         "WHERE status IN ('Pending', 'Confirmed') "
+                         "GROUP BY service_type, appointment_date, appointment_time")
+    assert counts_table(store, "SELECT service_type, appointment_date, status, count FROM appointment_counts") == \
+        recounted(store, "SELECT service_type, appointment_date, status, COUNT(*) FROM appointments "
+                         "GROUP BY service_type, appointment_date, status")
+
+
+def test_slot_counts_are_backfilled_for_an_existing_database(tmp_path, capacity):
+    capacity(1)
+    path = str(tmp_path / 'appointments.db')
+    store = SQLiteDB(path)
+    assert store.reserve_appointment('Bank', {'client_name': 'Ada'},
+                                     {'appointment_date': BOOKABLE_DATE, 'appointment_time': '10:00'})['success']
+    # A database from before the slot counters
+    conn = store._conn()
+    conn.execute("DROP TABLE slot_counts")
+    for trigger in ('insert', 'delete', 'release', 'claim'):
+        conn.execute(f"DROP TRIGGER trg_appointments_slot_{trigger}")
+
+    reopened = SQLiteDB(path)
+    assert reopened.check_availability('Bank', BOOKABLE_DATE, '10:00')['available'] is False
+
+
+def test_writes_are_visible_to_other_threads_connections(tmp_path, capacity):
+    capacity(5)
+    store = SQLiteDB(str(tmp_path / 'appointments.db'))
+    created = store.reserve_appointment('Bank', {'client_name': 'Ada'},
+                                        {'appointment_date': BOOKABLE_DATE, 'appointment_time': '10:00'})
+    seen = []
+    thread = threading.Thread(target=lambda: seen.append(store.get_appointment_by_id(created['appointment_id'])))
+    thread.start()
+    thread.join(5)
+    assert seen[0]['data']['appointment_number'] == created['appointment_number']
+
+
+def test_storage_backend_is_chosen_by_name():
+    assert isinstance(create_storage('sqlite'), SQLiteDB)
+    with pytest.raises(ValueError):
+        create_storage('mongodb')
@@ -0,0 +1,55 @@
+from sqlite_db import SQLiteDB
+from tests.conftest import BOOKABLE_DATE
+
+LATER_DATE = '2099-06-02'
+
+
+def test_statistics_follow_bookings_status_changes_and_deletes(store, book, capacity):
+    capacity(5)
+    first = book('10:00')['appointment_id']
+    second = book('10:30')['appointment_id']
+    book('10:00', LATER_DATE, 'Cafe')
+    store.update_appointment_status(first, 'Confirmed')
+    store.update_appointment_status(second, 'Cancelled')
+    store.delete_appointment(second)
+
+    stats = store.get_statistics(BOOKABLE_DATE, LATER_DATE)
+    assert stats['total_appointments'] == 2
+    assert stats['by_status'] == {'Confirmed': 1, 'Pending': 1}
+    assert stats['by_service'] == {'Bank': {'total': 1, 'Confirmed': 1}, 'Cafe': {'total': 1, 'Pending': 1}}
+
+
+def test_per_day_counts_cover_only_the_range(store, book, capacity):
+    capacity(5)
+    book('10:00')
+    book('10:00', LATER_DATE)
+
+    stats = store.get_statistics(LATER_DATE, LATER_DATE)
+    # Totals cover every appointment; per-day figures only the range asked for
+    assert stats['total_appointments'] == 2
+    assert list(stats['by_day']) == [LATER_DATE]
+
+
+def test_totals_are_backfilled_for_an_existing_database(tmp_path, capacity):
+    capacity(5)
+    path = str(tmp_path / 'appointments.db')
+    store = SQLiteDB(path)
+    for appointment_time in ('10:00', '10:30'):
+        store.reserve_appointment('Bank', {'client_name': 'Ada'},
+                                  {'appointment_date': BOOKABLE_DATE, 'appointment_time': appointment_time})
+    # A database from before the totals table
+    conn = store._conn()
+    conn.execute("DROP TABLE appointment_totals")
+    for trigger in ('insert', 'delete', 'status'):
+        conn.execute(f"DROP TRIGGER trg_appointments_total_{trigger}")
+
+    assert SQLiteDB(path).get_statistics()['by_service'] == {'Bank': {'total': 2, 'Pending': 2}}
+
+
+def test_rebuild_repairs_the_totals(store, book, capacity):
+    capacity(5)
+    book('10:00')
+    store._conn().execute("UPDATE appointment_totals SET count = 7")
+
+    assert store.rebuild_statistics()['success']
+    assert store.get_statistics()['by_status'] == {'Pending': 1}
@@ -0,0 +1,317 @@
+import operator
+from types import SimpleNamespace
+
+import pytest
+
+import stat_counters
+from stat_counters import ShardedCounters, DAY_COLLECTION, SHARD_COLLECTION
+
+OPERATORS = {'==': operator.eq, '>=': operator.ge, '<=': operator.le}
+
+
+class Increment:
+    def __init__(self, value):
+        self.value = value
+
+
+def transactional(fn):
+    """firestore.transactional for the in-memory client: no other writers, so no retries"""
+    def run(transaction, *args):
+        result = fn(transaction, *args)
+        transaction.commit()
+        return result
+    return run
+
+
+@pytest.fixture(autouse=True)
+def firestore(monkeypatch):
+    fake = SimpleNamespace(Increment=Increment, transactional=transactional,
+                           FieldPath=SimpleNamespace(document_id=lambda: '__name__'))
+    monkeypatch.setattr(stat_counters, 'firestore', fake)
+    return fake
+
+
+class Snapshot:
+    def __init__(self, reference, data):
+        self.id = reference.id
+        self.reference = reference
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class DocumentRef:
+    def __init__(self, collection, doc_id):
+        self.collection = collection
+        self.id = doc_id
+
+    def get(self, transaction=None):
+        return Snapshot(self, self.collection.docs.get(self.id))
+
+
+class Query:
+    def __init__(self, collection, filters=(), after=None, size=None):
+        self.collection = collection
+        self.filters = filters
+        self.after = after
+        self.size = size
+
+    def where(self, field, op, value):
+        return Query(self.collection, self.filters + ((field, OPERATORS[op], value),), self.after, self.size)
+
+    def order_by(self, field):
+        return self     # always by document id
+
+    def start_after(self, snapshot):
+        return Query(self.collection, self.filters, snapshot.id, self.size)
+
+    def limit(self, size):
+        return Query(self.collection, self.filters, self.after, size)
+
+    def stream(self, transaction=None):
+        found = [
+            Snapshot(DocumentRef(self.collection, doc_id), data)
+            for doc_id, data in sorted(self.collection.docs.items())
+            if (self.after is None or doc_id > self.after)
+            and all(field in data and op(data[field], value) for field, op, value in self.filters)
+        ]
+        return iter(found[:self.size])
+
+
+class Collection(Query):
+    def __init__(self):
+        super().__init__(self)
+        self.docs = {}
+
+    def document(self, doc_id):
+        return DocumentRef(self, doc_id)
+
+
+def merged(into, data):
+    """A document after a merge write whose values may be increments"""
+    into = dict(into or {})
+    for key, value in data.items():
+        if isinstance(value, dict):
+            into[key] = merged(into.get(key), value)
+        elif isinstance(value, Increment):
+            into[key] = into.get(key, 0) + value.value
+        else:
+            into[key] = value
+    return into
+
+
+class Batch:
+    """A write batch, also standing in for a transaction"""
+
+    def __init__(self):
+        self.writes = []
+
+    def set(self, ref, data, merge=False):
+        self.writes.append((ref, data, merge))
+
+    def update(self, ref, data):
+        self.writes.append((ref, data, True))
+
+    def delete(self, ref):
+        self.writes.append((ref, None, False))
+
+    def commit(self):
+        for ref, data, merge in self.writes:
+            docs = ref.collection.docs
+            if data is None:
+                docs.pop(ref.id, None)
+            else:
+                docs[ref.id] = merged(docs.get(ref.id) if merge else None, data)
+
+
+class Client:
+    """The part of the Firestore client ShardedCounters uses"""
+
+    def __init__(self):
+        self.collections = {}
+
+    def collection(self, name):
+        return self.collections.setdefault(name, Collection())
+
+    def batch(self):
+        return Batch()
+
+    def transaction(self):
+        return Batch()
+
+
+def appointment(service_type, appointment_date, status):
+    return {'service_type': service_type, 'appointment_date': appointment_date, 'status': status}
+
+
+@pytest.fixture
+def client():
+    client = Client()
+    appointments = client.collection('appointments').docs
+    appointments['a'] = appointment('Bank', '2099-06-01', 'Pending')
+    appointments['b'] = appointment('Bank', '2099-06-01', 'Cancelled')
+    appointments['c'] = appointment('Cafe', '2099-06-02', 'Pending')
+    appointments['d'] = appointment('Cafe', '2099-07-01', 'Confirmed')
+    return client
+
+
+def state(counters, client):
+    return counters.write_state(counters.meta_ref(client).get())
+
+
+def create(counters, client, doc_id, appointment):
+    """FirebaseDB.book's statistics writes"""
+    batch = Batch()
+    counters.record_create(client, batch, appointment, state(counters, client))
+    batch.set(client.collection('appointments').document(doc_id), appointment)
+    batch.commit()
+
+
+def change(counters, client, doc_id, new_status):
+    """FirebaseDB.status_writes' statistics writes"""
+    current = client.collection('appointments').docs[doc_id]
+    batch = Batch()
+    changes = {'status': new_status}
+    changes.update(counters.record_status_change(
+        client, batch, current, current['status'], new_status, state(counters, client)
+    ))
+    batch.update(client.collection('appointments').document(doc_id), changes)
+    batch.commit()
+
+
+def delete(counters, client, doc_id):
+    """FirebaseDB.delete_appointment's statistics writes"""
+    current = client.collection('appointments').docs[doc_id]
+    batch = Batch()
+    counters.record_delete(client, batch, current, state(counters, client))
+    batch.delete(client.collection('appointments').document(doc_id))
+    batch.commit()
+
+
+def recount(client):
+    counts = stat_counters._empty()
+    for appointment in client.collection('appointments').docs.values():
+        stat_counters._add(counts, appointment)
+    return counts
+
+
+def nonzero(counts):
+    """counts without the buckets increments have brought back to zero"""
+    return {key: nonzero(value) if isinstance(value, dict) else value
+            for key, value in counts.items() if value != 0}
+
+
+def test_rebuild_then_read_counts_every_appointment(client):
+    counters = ShardedCounters(num_shards=4)
+    assert counters.rebuild(client) == 3
+
+    counts = counters.read(client, '2099-06-01', '2099-06-30')
+    assert counts['total'] == 4
+    assert counts['status'] == {'Pending': 2, 'Cancelled': 1, 'Confirmed': 1}
+    assert counts['service']['Bank'] == {'total': 2, 'Pending': 1, 'Cancelled': 1}
+    # Per-day figures cover only the requested range
+    assert list(counts['by_day']) == ['2099-06-01', '2099-06-02']
+    assert counts['by_day']['2099-06-02']['service'] == {'Cafe': {'total': 1, 'Pending': 1}}
+
+
+def test_read_sums_the_shards(client):
+    counters = ShardedCounters(num_shards=2)
+    shards = client.collection(SHARD_COLLECTION).docs
+    shards['0'] = {'total': 2, 'status': {'Pending': 2}, 'service': {'Bank': {'total': 2, 'Pending': 2}}}
+    shards['1'] = {'total': 1, 'status': {'Pending': 1}, 'service': {'Bank': {'total': 1, 'Pending': 1}}}
+
+    counts = counters.read(client, '2099-06-01', '2099-06-30')
+    assert counts['total'] == 3
+    assert counts['service']['Bank'] == {'total': 3, 'Pending': 3}
+
+
+def test_rebuild_replaces_stale_counters(client):
+    counters = ShardedCounters(num_shards=4)
+    client.collection(SHARD_COLLECTION).docs['3'] = {'total': 99, 'status': {'Pending': 99}}
+    client.collection(DAY_COLLECTION).docs['2099-01-01_2'] = {'date': '2099-06-01', 'total': 99}
+
+    counters.rebuild(client)
+    counts = counters.read(client, '2099-06-01', '2099-06-01')
+    assert counts['total'] == 4
+    assert counts['by_day']['2099-06-01']['total'] == 2
+    # Only the new generation's documents are left
+    assert all(doc.get('generation') == 1 for doc in client.collection(SHARD_COLLECTION).docs.values())
+    assert all(doc.get('generation') == 1 for doc in client.collection(DAY_COLLECTION).docs.values())
+
+
+def test_readers_keep_the_old_generation_until_the_switch(client):
+    counters = ShardedCounters(num_shards=4)
+    client.collection(SHARD_COLLECTION).docs['0'] = {'total': 99, 'status': {'Pending': 99}}
+
+    building = counters.start_rebuild(client)
+    counters.count_appointments(client, building)
+    assert counters.read(client, '2099-06-01', '2099-06-30')['total'] == 99
+    counters.finish_rebuild(client, building)
+    assert counters.read(client, '2099-06-01', '2099-06-30')['total'] == 4
+
+
+def test_writes_during_a_rebuild_are_counted_once(client, monkeypatch):
+    monkeypatch.setattr(stat_counters, 'REBUILD_PAGE_SIZE', 2)
+    counters = ShardedCounters(num_shards=4)
+    counters.rebuild(client)
+
+    # Drift the live counters, then rebuild while bookings keep changing
+    next(iter(client.collection(SHARD_COLLECTION).docs.values()))['total'] += 5
+    building = counters.start_rebuild(client)
+    create(counters, client, 'e', appointment('Bank', '2099-06-01', 'Pending'))
+    change(counters, client, 'a', 'Cancelled')          # before the scan reaches it
+    delete(counters, client, 'b')
+    counters.count_appointments(client, building)
+    change(counters, client, 'c', 'Confirmed')          # after the scan counted it
+    create(counters, client, 'f', appointment('Cafe', '2099-06-02', 'Pending'))
+    delete(counters, client, 'e')
+
+    # Until the switch the live generation (drift included) is read
+    assert counters.read(client, '2099-06-01', '2099-06-30')['total'] == 9
+    counters.finish_rebuild(client, building)
+
+    counts = counters.read(client, '2099-06-01', '2099-06-30')
+    by_day = counts.pop('by_day')
+    assert nonzero(counts) == recount(client)
+    assert by_day['2099-06-01']['total'] == 1
+    assert nonzero(by_day['2099-06-02']['status']) == {'Confirmed': 1, 'Pending': 1}
+
+
+def test_an_overtaken_rebuild_does_not_switch(client):
+    counters = ShardedCounters(num_shards=4)
+    first = counters.start_rebuild(client)
+    second = counters.start_rebuild(client)
+    counters.count_appointments(client, first)
+    with pytest.raises(RuntimeError):
+        counters.finish_rebuild(client, first)
+    counters.count_appointments(client, second)
+    counters.finish_rebuild(client, second)
+    assert counters.read(client, '2099-06-01', '2099-06-30')['total'] == 4
+
+
+def test_status_change_moves_one_count_between_statuses():
+    client = Client()
+    batch = Batch()
+    ShardedCounters(num_shards=4).record_status_change(
+        client, batch, appointment('Bank', '2099-06-01', 'Pending'), 'Pending', 'Cancelled', (0, None)
+    )
+
+    # One write to a shard and one to its day document for each side of the move
+    assert len(batch.writes) == 4
+    deltas = {}
+    for ref, data, merge in batch.writes:
+        assert merge and 'total' not in data
+        for status, increment in data['status'].items():
+            assert isinstance(increment, Increment)
+            deltas.setdefault(ref.collection is client.collection(DAY_COLLECTION), {})[status] = increment.value
+    assert deltas == {False: {'Pending': -1, 'Cancelled': 1}, True: {'Pending': -1, 'Cancelled': 1}}
+
+
+def test_unchanged_status_writes_nothing():
+    batch = Batch()
+    ShardedCounters(num_shards=4).record_status_change(
+        Client(), batch, appointment('Bank', '2099-06-01', 'Pending'), 'Pending', 'Pending', (0, None)
+    )
+    assert batch.writes == []